@@ -0,0 +1,68 @@
+"""
+Times converting templates with a growing number of section tags
+and reports the peak memory used, both should grow linearly with the tag count
+
+usage: python -m benchmarks.bench_sections
+"""
+import time
+import tracemalloc
+
+import mustache_to_handlebars.main as main
+
+SECTION_COUNTS = [2500, 5000, 10000, 20000]
+
+
+def _make_template(section_count: int) -> str:
+    lines = []
+    for i in range(section_count):
+        lines.append("{{#tag%d}}" % (i % 500))
+        lines.append("    {{value%d}} {{{items.%d}}}" % (i, i % 10))
+        lines.append("{{/tag%d}}" % (i % 500))
+    return "\n".join(lines)
+
+
+def _measure(section_count: int) -> dict:
+    in_txt = _make_template(section_count)
+    handlebars_tag_set = main.HandlebarTagSet(
+        if_tags={"tag%d" % i for i in range(500)}
+    )
+    whitespace_config = main.HandlebarsWhitespaceConfig(
+        remove_whitespace_before_open=True,
+        remove_whitespace_before_close=True,
+    )
+    # timed separately since tracing allocations slows the conversion down
+    start = time.perf_counter()
+    main._convert_handlebars_to_mustache(in_txt, handlebars_tag_set, whitespace_config)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    main._convert_handlebars_to_mustache(in_txt, handlebars_tag_set, whitespace_config)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "section_count": section_count,
+        "input_bytes": len(in_txt),
+        "seconds": seconds,
+        "peak_bytes": peak_bytes,
+    }
+
+
+def run():
+    results = [_measure(section_count) for section_count in SECTION_COUNTS]
+    first = results[0]
+    print("sections  input_bytes  seconds  peak_bytes  time_ratio  memory_ratio  size_ratio")
+    for result in results:
+        print(
+            "{:>8}  {:>11}  {:>7.3f}  {:>10}  {:>10.2f}  {:>12.2f}  {:>10.2f}".format(
+                result["section_count"],
+                result["input_bytes"],
+                result["seconds"],
+                result["peak_bytes"],
+                result["seconds"] / first["seconds"],
+                result["peak_bytes"] / first["peak_bytes"],
+                result["input_bytes"] / first["input_bytes"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,138 @@
+"""
+Times tokenizing, converting and a full directory conversion on synthetic corpora,
+writes the results as json and compares them to a stored baseline
+
+usage: python -m benchmarks.bench_suite [-out OUT] [-baseline BASELINE] [-tolerance TOLERANCE]
+"""
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+import typing
+
+import mustache_to_handlebars.main as main
+from benchmarks.corpus import CorpusConfig, make_tag_set, make_templates, write_corpus
+
+CORPUS_CONFIGS = {
+    "many_small_files": CorpusConfig(file_count=300, file_size=50),
+    "large_file": CorpusConfig(file_count=1, file_size=50000),
+    "deep_nesting": CorpusConfig(nesting_depth=30),
+    "many_distinct_tags": CorpusConfig(distinct_tag_count=5000),
+    "dotted_index_heavy": CorpusConfig(dotted_index_density=0.9),
+    "all_standalone": CorpusConfig(standalone_ratio=1.0),
+    "no_standalone": CorpusConfig(standalone_ratio=0.0),
+}
+METRICS = ["tokenize_seconds", "convert_seconds", "convert_without_whitespace_control_seconds", "create_files_seconds"]
+WHITESPACE_CONFIG = main.HandlebarsWhitespaceConfig(
+    remove_whitespace_before_open=True,
+    remove_whitespace_after_open=True,
+    remove_whitespace_before_close=True,
+    remove_whitespace_after_close=True,
+)
+
+
+def _best_time(function: typing.Callable[[], typing.Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _run_case(config: CorpusConfig, repeat: int) -> dict:
+    templates = make_templates(config)
+    handlebars_tag_set = make_tag_set(config)
+    converter = main.Converter(handlebars_tag_set, WHITESPACE_CONFIG)
+    converter_without_whitespace_control = main.Converter(
+        handlebars_tag_set, main.HandlebarsWhitespaceConfig()
+    )
+
+    def create_files():
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            write_corpus(in_dir, templates)
+            in_path_to_out_path = main._get_in_file_to_out_file_map(in_dir, out_dir, recursive=True)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                main._create_files(in_path_to_out_path, handlebars_tag_set, WHITESPACE_CONFIG)
+            return time.perf_counter() - start
+
+    return {
+        "config": dataclasses.asdict(config),
+        "input_bytes": sum(len(template) for template in templates),
+        "tokenize_seconds": _best_time(
+            lambda: [list(main._tokenize(template)) for template in templates], repeat
+        ),
+        "convert_seconds": _best_time(lambda: list(converter.convert_many(templates)), repeat),
+        "convert_without_whitespace_control_seconds": _best_time(
+            lambda: list(converter_without_whitespace_control.convert_many(templates)), repeat
+        ),
+        # writing the corpus is not timed
+        "create_files_seconds": min(create_files() for _ in range(repeat)),
+    }
+
+
+def _find_regressions(results: dict, baseline: dict, tolerance: float) -> typing.List[str]:
+    regressions = []
+    for case_name, case_results in results["cases"].items():
+        baseline_case = baseline["cases"].get(case_name)
+        if baseline_case is None:
+            continue
+        for metric in METRICS:
+            ratio = case_results[metric] / baseline_case[metric]
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    "{} {} took {:.4f}s, {:.0%} of the baseline {:.4f}s".format(
+                        case_name, metric, case_results[metric], ratio, baseline_case[metric]
+                    )
+                )
+    return regressions
+
+
+def __get_args():
+    parser = argparse.ArgumentParser(description="benchmark mustache to handlebars conversion")
+    parser.add_argument("-out", default="bench_output.json", help="the json file to write results to")
+    parser.add_argument("-baseline", help="a json file from an earlier run to compare the results to")
+    parser.add_argument(
+        "-tolerance",
+        type=float,
+        default=0.2,
+        help="how much slower than the baseline a metric may be before it is a regression, 0.2 is 20%%",
+    )
+    parser.add_argument("-repeat", type=int, default=3, help="each metric is the best of this many runs")
+    parser.add_argument("-cases", nargs="*", default=list(CORPUS_CONFIGS), choices=list(CORPUS_CONFIGS))
+    return parser.parse_args()
+
+
+def run():
+    args = __get_args()
+    results = {"python": platform.python_version(), "cases": {}}
+    for case_name in args.cases:
+        case_results = _run_case(CORPUS_CONFIGS[case_name], args.repeat)
+        results["cases"][case_name] = case_results
+        print(
+            "{:<20} {:>10} bytes  ".format(case_name, case_results["input_bytes"])
+            + "  ".join("{}={:.4f}".format(metric, case_results[metric]) for metric in METRICS)
+        )
+    with open(args.out, "w") as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+    print("Wrote results to {}".format(args.out))
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = _find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,82 @@
+"""
+Generates synthetic mustache template corpora for the benchmarks
+"""
+import os
+import random
+import typing
+from dataclasses import dataclass
+
+import mustache_to_handlebars.main as main
+
+
+@dataclass
+class CorpusConfig:
+    file_count: int = 10
+    # lines per file
+    file_size: int = 500
+    # deepest section nesting
+    nesting_depth: int = 3
+    distinct_tag_count: int = 100
+    # share of variables with an array index like {{items.2.name}}
+    dotted_index_density: float = 0.1
+    # share of section tags which are alone on their line and get whitespace control characters
+    standalone_ratio: float = 0.5
+    seed: int = 0
+
+
+def _make_template(config: CorpusConfig, rng: random.Random) -> str:
+    lines = []
+    open_tags = []
+    for _ in range(config.file_size):
+        choice = rng.random()
+        if choice < 0.2 and len(open_tags) < config.nesting_depth:
+            tag = "tag{}".format(rng.randrange(config.distinct_tag_count))
+            open_tags.append(tag)
+            control = "{{#%s}}" % tag if rng.random() < 0.8 else "{{^%s}}" % tag
+        elif choice < 0.4 and open_tags:
+            control = "{{/%s}}" % open_tags.pop()
+        else:
+            control = None
+
+        if rng.random() < config.dotted_index_density:
+            variable = "{{items.%d.name}}" % rng.randrange(10)
+        else:
+            variable = "{{{value%d}}}" % rng.randrange(config.distinct_tag_count)
+        text = "    some text {} and more text".format(variable)
+        if control is None:
+            lines.append(text)
+        elif rng.random() < config.standalone_ratio:
+            lines.append("  " + control)
+            lines.append(text)
+        else:
+            lines.append(control + text)
+    lines.extend("{{/%s}}" % tag for tag in reversed(open_tags))
+    return "\n".join(lines) + "\n"
+
+
+def make_templates(config: CorpusConfig) -> typing.List[str]:
+    rng = random.Random(config.seed)
+    return [_make_template(config, rng) for _ in range(config.file_count)]
+
+
+def make_tag_set(config: CorpusConfig) -> main.HandlebarTagSet:
+    """
+    classifies every generated tag so that no file is skipped for ambiguous tags
+    """
+    tags = ["tag{}".format(i) for i in range(config.distinct_tag_count)]
+    return main.HandlebarTagSet(
+        if_tags=set(tags[0::3]),
+        each_tags=set(tags[1::3]),
+        with_tags=set(tags[2::3]),
+    )
+
+
+def write_corpus(in_dir: str, templates: typing.List[str]):
+    """
+    writes the templates in nested folders of at most 100 files
+    """
+    for i, template in enumerate(templates):
+        folder = os.path.join(in_dir, "folder{}".format(i // 100))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "template{}.{}".format(i, main.MUSTACHE_EXTENSION)), "w") as file:
+            file.write(template)
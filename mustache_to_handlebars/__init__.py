@@ -0,0 +1,9 @@
+from mustache_to_handlebars.main import (
+    Converter,
+    HandlebarTagSet,
+    HandlebarsWhitespaceConfig,
+    Profiler,
+    TagInference,
+    convert_dir,
+    convert_stream,
+)
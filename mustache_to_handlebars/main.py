@@ -1,8 +1,26 @@
 import os
+import sys
+import contextlib
 import argparse
-import glob
+import fnmatch
 import typing
 import re
+import itertools
+import collections
+import threading
+import locale
+import stat
+import time
+import hashlib
+import json
+import dataclasses
+import functools
+import heapq
+import cProfile
+import marshal
+import mmap
+import codecs
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from enum import Enum
 from dataclasses import dataclass, field
 
@@ -12,6 +30,8 @@ HANDLEBARS_EXTENSION = "handlebars"
 HANDLEBARS_WHITESPACE_REMOVAL_CHAR = "~"
 HANDLEBARS_FIRST = "@first"
 HANDLEBARS_LAST = "@last"
+HANDLEBARS_CONTEXT_TAG = "this"
+# the regexes templates were converted with before they were tokenized, kept for code which imports them
 HANDLEBARS_IF_UNLESS_CLOSE_PATTERN = r"{{([#/].+?)}}"
 # for {{ or {{ variables that are not control tags
 HANDLEBARS_VARIABLE_TAG = r"{{2,3}([^#/{]+?)}{2,3}"
@@ -21,7 +41,34 @@ MUSTACHE_VARIABLE_TAG = r"{{2,3}([^#/{^]+?)}{2,3}"
 MUSTACHE_EXTENSION = "mustache"
 MUSTACHE_IF_UNLESS_CLOSE_PATTERN = r"{{([#^/].+?)}}"
 MUSTACHE_PARTIAL_PATTERN = r"{{>\s?(.+?)\s?}}"
+MUSTACHE_PARTIAL_REGEX = re.compile(MUSTACHE_PARTIAL_PATTERN)
 MUSTACHE_TO_HANDLEBARS_TAG = {"-first": HANDLEBARS_FIRST, "-last": HANDLEBARS_LAST}
+MUSTACHE_CONTEXT_TAG = "."
+# only valid while iterating a list
+MUSTACHE_ITERATION_TAGS = {"-first", "-last", "-index"}
+# tags starting with these are usually booleans
+IF_TAG_NAME_PREFIXES = ("is", "has", "getHas", "use", "getIs")
+# inferred section types with at least this confidence are applied when inference is on
+INFER_THRESHOLD = 0.8
+STDIN_PATH = "-"
+STREAM_CHUNK_SIZE = 64 * 1024
+# encodings whose text can be scanned for tags as bytes, see _tokenize_bytes
+MMAP_ENCODINGS = {"utf-8", "ascii"}
+REPORT_BATCH_SIZE = 100
+PROGRESS_BAR_INTERVAL = 0.1
+PROGRESS_BAR_WIDTH = 40
+TAG_CACHE_SIZE = 4096
+PROFILE_TOP_N = 20
+WATCH_INTERVAL = 0.025
+WATCH_DEBOUNCE = 0.025
+# fewer templates than this are converted in this process when watching, as starting worker processes takes longer
+WATCH_MIN_FILES_FOR_JOBS = 64
+IGNORE_FILE_NAME = ".m2hignore"
+MANIFEST_FILE_NAME = ".mustache_to_handlebars_manifest.json"
+# bump when a converter change alters output so every manifest entry is invalidated
+MANIFEST_VERSION = 2
+# bump when a tokenizer or node change alters parsed templates so that parse caches written before are not used
+PARSE_CACHE_VERSION = 1
 
 
 class MustacheTagType(str, Enum):
@@ -51,28 +98,723 @@ class HandlebarsTagType(Enum):
     EACH = ("#each", "/each")
     WITH = ("#with", "/with")
     UNLESS = ("#unless", "/unless")
+    # no longer used, close tags are written by their section
     CLOSE = ("", "")
 
 
-def __get_handlebars_tag_type(
-    tag: str,
-    mustache_tag_control_character: str,
+class MustacheTokenType(Enum):
+    TEXT = "text"
+    VARIABLE = "variable"  # {{name}} {{{name}}} {{&name}}
+    SECTION = "#"
+    INVERTED = "^"
+    CLOSE = "/"
+    PARTIAL = ">"
+    COMMENT = "!"
+    DELIMITER = "="
+
+
+class CheckStatus(Enum):
+    UNCHANGED = "unchanged"
+    # the out file differs from the converted template
+    CHANGED = "changed"
+    MISSING = "missing"
+    # an out file whose template no longer exists
+    STALE = "stale"
+    AMBIGUOUS = "ambiguous"
+    # the template can not be parsed
+    INVALID = "invalid"
+
+
+MUSTACHE_SIGIL_TO_TOKEN_TYPE = {
+    MustacheTagType.IF_EACH_WITH.value: MustacheTokenType.SECTION,
+    MustacheTagType.UNLESS.value: MustacheTokenType.INVERTED,
+    MustacheTagType.CLOSE.value: MustacheTokenType.CLOSE,
+    ">": MustacheTokenType.PARTIAL,
+    "!": MustacheTokenType.COMMENT,
+    "=": MustacheTokenType.DELIMITER,
+}
+# sigils which also need a matching character before the close delimiter
+MUSTACHE_SIGIL_TO_CLOSE_SIGIL = {"{": "}", "=": "="}
+
+
+@dataclass
+class MustacheToken:
+    """
+    value is the literal text for TEXT tokens and the stripped tag content otherwise
+    raw is the exact source text of the token, start is its index in the source
+    standalone is set for tags which are the only non whitespace content on their line
+    end is set when it is not start plus the length of raw, as for tokens of _tokenize_bytes
+    """
+    token_type: MustacheTokenType
+    value: typing.Optional[str]
+    raw: typing.Optional[str]
+    start: int
+    sigil: str = ""
+    standalone: bool = False
+    end: typing.Optional[int] = None
+
+
+@functools.lru_cache(maxsize=None)
+def _get_mustache_tag_pattern(open_delimiter: str, close_delimiter: str) -> re.Pattern:
+    """
+    One alternation matching every mustache tag kind for a delimiter pair
+    triple is set for {{{name}}}, delimiter for {{=<% %>=}}, otherwise sigil and value are set
+    """
+    open_pattern, close_pattern = re.escape(open_delimiter), re.escape(close_delimiter)
+    return re.compile(
+        open_pattern
+        + r"(?:\{(?P<triple>.*?)\}"
+        + close_pattern
+        + r"|=(?P<delimiter>.*?)="
+        + close_pattern
+        + r"|(?P<sigil>[#^/>!&]?)(?P<value>.*?)"
+        + close_pattern
+        + r")",
+        re.DOTALL,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _get_mustache_bytes_tag_pattern(open_delimiter: str, close_delimiter: str, encoding: str) -> re.Pattern:
+    """
+    _get_mustache_tag_pattern for templates encoded with encoding
+    """
+    return re.compile(_get_mustache_tag_pattern(open_delimiter, close_delimiter).pattern.encode(encoding), re.DOTALL)
+
+
+class TemplateError(ValueError):
+    """
+    raised for a template which can not be decoded, tokenized or parsed, like one with an unclosed tag or section
+    """
+
+
+@dataclass
+class _TokenizerState:
+    """
+    what the tokenizer carries from one window of a template to the next
+    """
+    open_delimiter: str = TAG_OPEN
+    close_delimiter: str = TAG_CLOSE
+    # true while everything since the last newline is whitespace
+    blank_line_prefix: bool = True
+    # index in the whole template of the start of the current window
+    offset: int = 0
+
+
+def __is_blank_line_prefix(text: str, blank_line_prefix: bool) -> bool:
+    """
+    whether everything since the last newline is whitespace after text is added
+    """
+    newline_index = text.rfind("\n")
+    if newline_index == -1:
+        return blank_line_prefix and text.strip() == ""
+    return text[newline_index + 1:].strip() == ""
+
+
+def __unclosed_tag_error(window: str, open_index: int, state: _TokenizerState) -> TemplateError:
+    return TemplateError(
+        "Unclosed tag {} at index {}".format(
+            window[open_index:open_index + 20], state.offset + open_index
+        )
+    )
+
+
+def __get_line_split_index(window: str, tag_pattern: re.Pattern, open_delimiter: str) -> int:
+    """
+    where a window without a newline can be split without splitting a tag or deciding if a tag is standalone
+    before the rest of its line is read: before its last tag, as the tags before it have that tag after them
+    on their line, or else before the next open delimiter after its first tag when that tag is followed by text
+    Set delimiter tags change how the rest of the window is read, so it is never split after one, nor after a tag
+    like {{{name}} which is read as a triple or set delimiter tag once its close delimiter is read
+    """
+    first_match = last_match = None
+    for match in tag_pattern.finditer(window):
+        maybe_longer = (
+            match.group("triple") is None
+            and match.group("delimiter") is None
+            and window.startswith(("{", "="), match.start() + len(open_delimiter))
+        )
+        if maybe_longer or (match.group("delimiter") is not None and match.start() > 0):
+            return match.start()
+        first_match = first_match or match
+        last_match = match
+        if match.group("delimiter") is not None:
+            break
+    if last_match is not None and last_match.start() > 0:
+        return last_match.start()
+    index = 0
+    if first_match is not None:
+        index = first_match.end()
+        if not window[index:].strip():
+            return 0
+        if first_match.group("delimiter") is not None:
+            return index
+    open_index = window.find(open_delimiter, index)
+    # an open delimiter may be split between this window and the next
+    return open_index if open_index != -1 else max(index, len(window) - len(open_delimiter) + 1)
+
+
+def __tokenize_window(
+    window: str, state: _TokenizerState, final: bool, split_size: typing.Optional[int] = None
+) -> typing.Generator[MustacheToken, None, int]:
+    """
+    Yields the tokens in window and returns the number of characters consumed
+    Unless final, tokenizing stops after the last complete line so that tags and
+    standalone lines are never split between windows, the rest is left for the next window
+    A line of at least split_size characters is split where __get_line_split_index allows,
+    so that a template without newlines is not held whole
+    """
+    tag_pattern = _get_mustache_tag_pattern(state.open_delimiter, state.close_delimiter)
+    limit = len(window) if final else window.rfind("\n") + 1
+    if not limit and split_size is not None and len(window) >= split_size:
+        limit = __get_line_split_index(window, tag_pattern, state.open_delimiter)
+    index = 0
+    delimiter_changed = True
+    while delimiter_changed:
+        delimiter_changed = False
+        for match in tag_pattern.finditer(window, index, limit):
+            start = match.start()
+            if start > index:
+                text = window[index:start]
+                if state.open_delimiter in text:
+                    raise __unclosed_tag_error(window, window.index(state.open_delimiter, index), state)
+                state.blank_line_prefix = __is_blank_line_prefix(text, state.blank_line_prefix)
+                yield MustacheToken(MustacheTokenType.TEXT, text, text, state.offset + index)
+            index = match.end()
+            raw = match.group(0)
+            if match.group("triple") is not None:
+                token_type, value, sigil = MustacheTokenType.VARIABLE, match.group("triple"), "{"
+            elif match.group("delimiter") is not None:
+                token_type, value, sigil = MustacheTokenType.DELIMITER, match.group("delimiter"), "="
+            else:
+                sigil = match.group("sigil")
+                token_type = MUSTACHE_SIGIL_TO_TOKEN_TYPE.get(sigil, MustacheTokenType.VARIABLE)
+                value = match.group("value")
+            token = MustacheToken(token_type, value.strip(), raw, state.offset + start, sigil)
+            if state.blank_line_prefix:
+                # only the first tag on a line can be standalone so this find runs once per line
+                line_end = window.find("\n", index)
+                token.standalone = window[index:None if line_end == -1 else line_end].strip() == ""
+            state.blank_line_prefix = False
+            yield token
+
+            if token_type is MustacheTokenType.DELIMITER:
+                delimiters = token.value.split()
+                if len(delimiters) != 2:
+                    raise TemplateError("Invalid set delimiter tag {}".format(raw))
+                state.open_delimiter, state.close_delimiter = delimiters
+                tag_pattern = _get_mustache_tag_pattern(*delimiters)
+                delimiter_changed = True
+                break
+
+    end = limit
+    unclosed_index = window.find(state.open_delimiter, index, limit)
+    if unclosed_index != -1:
+        if final:
+            raise __unclosed_tag_error(window, unclosed_index, state)
+        # the tag may be closed in a later line
+        end = unclosed_index
+    if end > index:
+        text = window[index:end]
+        state.blank_line_prefix = __is_blank_line_prefix(text, state.blank_line_prefix)
+        yield MustacheToken(MustacheTokenType.TEXT, text, text, state.offset + index)
+    return end
+
+
+def _tokenize(in_txt: str) -> typing.Iterator[MustacheToken]:
+    """
+    Walks the template once, yielding text and tag tokens in source order
+    Set delimiter tags like {{=<% %>=}} change the delimiters used for the rest of the text
+    """
+    yield from __tokenize_window(in_txt, _TokenizerState(), final=True)
+
+
+def __decode_tag_bytes(data: bytes, encoding: str) -> str:
+    """
+    data decoded with its line endings translated to \n like reading it as text does
+    """
+    text = data.decode(encoding)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def __is_blank_bytes(data: bytes, encoding: str) -> bool:
+    stripped = data.strip()
+    # str.strip also strips non ascii whitespace
+    return not stripped or not stripped.decode(encoding).strip()
+
+
+def _tokenize_bytes(data: typing.Union[bytes, mmap.mmap], encoding: str) -> typing.Iterator[MustacheToken]:
+    """
+    Like _tokenize for a template encoded with encoding, like an mmap of a template file
+    Tags are found in the bytes and decoded, the text between them is not decoded, so text tokens have no value
+    or raw and their span in data is start to end, as are those of tags
+    Only for encodings in MMAP_ENCODINGS, in which the bytes of {{, }} and whitespace are never part of another character
+    Line endings in tags are translated and \r\n or \r end lines like \n, as when a file is read as text,
+    _HandlebarsBytesSerializer translates those in text
+    """
+    open_delimiter, close_delimiter = TAG_OPEN, TAG_CLOSE
+    open_delimiter_bytes = open_delimiter.encode(encoding)
+    tag_pattern = _get_mustache_bytes_tag_pattern(open_delimiter, close_delimiter, encoding)
+    # true while everything since the last newline is whitespace
+    blank_line_prefix = True
+    index = 0
+    delimiter_changed = True
+    while delimiter_changed:
+        delimiter_changed = False
+        for match in tag_pattern.finditer(data, index):
+            start = match.start()
+            if start > index:
+                unclosed_index = data.find(open_delimiter_bytes, index, start)
+                if unclosed_index != -1:
+                    raise __unclosed_bytes_tag_error(data, unclosed_index, encoding)
+                newline_index = data.rfind(b"\n", index, start)
+                newline_index = max(newline_index, data.rfind(b"\r", max(newline_index + 1, index), start))
+                if newline_index == -1:
+                    blank_line_prefix = blank_line_prefix and __is_blank_bytes(data[index:start], encoding)
+                else:
+                    blank_line_prefix = __is_blank_bytes(data[newline_index + 1:start], encoding)
+                yield MustacheToken(MustacheTokenType.TEXT, None, None, index, end=start)
+            index = match.end()
+            raw = __decode_tag_bytes(match.group(0), encoding)
+            if match.group("triple") is not None:
+                token_type, value, sigil = MustacheTokenType.VARIABLE, match.group("triple"), "{"
+            elif match.group("delimiter") is not None:
+                token_type, value, sigil = MustacheTokenType.DELIMITER, match.group("delimiter"), "="
+            else:
+                sigil = match.group("sigil").decode(encoding)
+                token_type = MUSTACHE_SIGIL_TO_TOKEN_TYPE.get(sigil, MustacheTokenType.VARIABLE)
+                value = match.group("value")
+            token = MustacheToken(token_type, __decode_tag_bytes(value, encoding).strip(), raw, start, sigil, end=index)
+            if blank_line_prefix:
+                line_end = data.find(b"\n", index)
+                carriage_return_index = data.find(b"\r", index, len(data) if line_end == -1 else line_end)
+                if carriage_return_index != -1:
+                    line_end = carriage_return_index
+                token.standalone = __is_blank_bytes(data[index:len(data) if line_end == -1 else line_end], encoding)
+            blank_line_prefix = False
+            yield token
+
+            if token_type is MustacheTokenType.DELIMITER:
+                delimiters = token.value.split()
+                if len(delimiters) != 2:
+                    raise TemplateError("Invalid set delimiter tag {}".format(raw))
+                open_delimiter, close_delimiter = delimiters
+                open_delimiter_bytes = open_delimiter.encode(encoding)
+                tag_pattern = _get_mustache_bytes_tag_pattern(open_delimiter, close_delimiter, encoding)
+                delimiter_changed = True
+                break
+    unclosed_index = data.find(open_delimiter_bytes, index)
+    if unclosed_index != -1:
+        raise __unclosed_bytes_tag_error(data, unclosed_index, encoding)
+    if len(data) > index:
+        yield MustacheToken(MustacheTokenType.TEXT, None, None, index, end=len(data))
+
+
+def __unclosed_bytes_tag_error(data: typing.Union[bytes, mmap.mmap], open_index: int, encoding: str) -> TemplateError:
+    return TemplateError(
+        "Unclosed tag {} at byte {}".format(data[open_index:open_index + 20].decode(encoding, "replace"), open_index)
+    )
+
+
+def _tokenize_stream(
+    reader: typing.TextIO, chunk_size: int = STREAM_CHUNK_SIZE
+) -> typing.Iterator[MustacheToken]:
+    """
+    Like _tokenize but reads the template from reader in chunks
+    Only the lines which have not been tokenized yet are kept in memory
+    """
+    state = _TokenizerState()
+    window = ""
+    final = False
+    while not final:
+        chunk = reader.read(chunk_size)
+        final = not chunk
+        window += chunk
+        consumed = yield from __tokenize_window(window, state, final, chunk_size)
+        state.offset += consumed
+        window = window[consumed:]
+
+
+class Node:
+    """
+    a node of a parsed template, start and end are its span in the source
+    """
+    __slots__ = ("start", "end")
+    # only sections have children
+    children = ()
+
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+
+
+class Template(Node):
+    """
+    the root of a parsed template
+    """
+    __slots__ = ("children",)
+
+    def __init__(self, start: int, end: int, children: typing.List[Node]):
+        self.start = start
+        self.end = end
+        self.children = children
+
+
+class Text(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, start: int, end: int, value: str):
+        self.start = start
+        self.end = end
+        self.value = value
+
+
+class _TagNode(Node):
+    """
+    value is the stripped tag content, raw its source text and sigil the character after the open delimiter
+    """
+    __slots__ = ("value", "raw", "sigil")
+
+    def __init__(self, start: int, end: int, value: str, raw: str, sigil: str = ""):
+        self.start = start
+        self.end = end
+        self.value = value
+        self.raw = raw
+        self.sigil = sigil
+
+
+class Variable(_TagNode):
+    """
+    {{name}} {{{name}}} or {{&name}}, tag is the handlebars form of value once _TagElementPass ran
+    """
+    __slots__ = ("tag",)
+
+    def __init__(self, start: int, end: int, value: str, raw: str, sigil: str = ""):
+        self.start = start
+        self.end = end
+        self.value = value
+        self.raw = raw
+        self.sigil = sigil
+        self.tag = value
+
+
+class Section(_TagNode):
+    """
+    {{#name}} and its body up to {{/name}}, the span covers both tags
+    standalone and close_standalone are set when the open and close tags are alone on their lines
+    tag, handlebars_tag_type and the whitespace removal chars are set by the passes, see Converter._convert_nodes,
+    a handlebars_tag_type of None is written as ifOrEachOrWith
+    """
+    __slots__ = (
+        "standalone",
+        "children",
+        "close_raw",
+        "close_standalone",
+        "tag",
+        "handlebars_tag_type",
+        "open_whitespace_removal_chars",
+        "close_whitespace_removal_chars",
+    )
+
+    def __init__(self, start: int, end: int, value: str, raw: str, sigil: str = "", standalone: bool = False):
+        self.start = start
+        self.end = end
+        self.value = value
+        self.raw = raw
+        self.sigil = sigil
+        self.standalone = standalone
+        self.children = []
+        self.close_raw = ""
+        self.close_standalone = False
+        self.tag = value
+        self.handlebars_tag_type = None
+        self.open_whitespace_removal_chars = ("", "")
+        self.close_whitespace_removal_chars = ("", "")
+
+
+class Inverted(Section):
+    """
+    {{^name}} and its body up to {{/name}}
+    """
+    __slots__ = ()
+
+
+class Partial(_TagNode):
+    __slots__ = ()
+
+
+class Comment(_TagNode):
+    __slots__ = ()
+
+
+class SetDelimiter(_TagNode):
+    """
+    {{=<% %>=}}, value is the new delimiters separated by whitespace
+    """
+    __slots__ = ()
+
+
+MUSTACHE_TOKEN_TYPE_TO_NODE_CLASS = {
+    MustacheTokenType.VARIABLE: Variable,
+    MustacheTokenType.SECTION: Section,
+    MustacheTokenType.INVERTED: Inverted,
+    MustacheTokenType.PARTIAL: Partial,
+    MustacheTokenType.COMMENT: Comment,
+    MustacheTokenType.DELIMITER: SetDelimiter,
+}
+
+
+def _iter_parse(tokens: typing.Iterable[MustacheToken], flat: bool = False) -> typing.Iterator[Node]:
+    """
+    Builds the tree of a template from its tokens, yielding each top level node once it is complete
+    so that a template read from a stream is only held from the start of its outermost open section
+    When flat is set nodes are not put into sections, every node is yielded as it is read and each section
+    is yielded when it opens and again when it closes, so that only the open sections are held
+    """
+    text, close = MustacheTokenType.TEXT, MustacheTokenType.CLOSE
+    section, inverted = MustacheTokenType.SECTION, MustacheTokenType.INVERTED
+    open_sections = []
+    # the children of the innermost open section, None at the top level
+    children = None
+    for token in tokens:
+        token_type = token.token_type
+        end = token.start + len(token.raw) if token.end is None else token.end
+        if token_type is text:
+            node = Text(token.start, end, token.value)
+        elif token_type is close:
+            if not open_sections:
+                raise TemplateError("Close tag {} at index {} has no open tag".format(token.raw, token.start))
+            node = open_sections.pop()
+            if node.value != token.value:
+                raise TemplateError(
+                    "Close tag {} at index {} does not match open tag {}".format(token.raw, token.start, node.value)
+                )
+            node.end = end
+            node.close_raw = token.raw
+            node.close_standalone = token.standalone
+            children = open_sections[-1].children if open_sections and not flat else None
+            if children is None:
+                yield node
+            continue
+        elif token_type is section or token_type is inverted:
+            node = MUSTACHE_TOKEN_TYPE_TO_NODE_CLASS[token_type](
+                token.start, end, token.value, token.raw, token.sigil, token.standalone
+            )
+            if children is not None:
+                children.append(node)
+            open_sections.append(node)
+            if flat:
+                yield node
+                continue
+            children = node.children
+            continue
+        else:
+            node = MUSTACHE_TOKEN_TYPE_TO_NODE_CLASS[token_type](
+                token.start, end, token.value, token.raw, token.sigil
+            )
+        if children is None:
+            yield node
+        else:
+            children.append(node)
+    if open_sections:
+        raise TemplateError("Open tags {} are never closed".format([section.value for section in open_sections]))
+
+
+def _parse(tokens: typing.Iterable[MustacheToken]) -> Template:
+    """
+    the tree of a template, see _iter_parse
+    """
+    children = list(_iter_parse(tokens))
+    return Template(0, children[-1].end if children else 0, children)
+
+
+def __iter_node_classes(node_class: type = Node) -> typing.Iterator[type]:
+    yield node_class
+    for node_subclass in node_class.__subclasses__():
+        yield from __iter_node_classes(node_subclass)
+
+
+def _get_node_class_to_visit_method(visitor_class: type) -> typing.Dict[type, typing.Optional[typing.Callable]]:
+    """
+    the visit_<node class name> function of visitor_class for each node class, None for those it has none for
+    """
+    return {
+        node_class: getattr(visitor_class, "visit_" + node_class.__name__, None)
+        for node_class in __iter_node_classes()
+    }
+
+
+class NodeVisitor:
+    """
+    Walks a template tree like ast.NodeVisitor, visit calls the visit_<node class name> method of
+    a node if there is one and generic_visit otherwise, which visits its children
+    The methods are looked up once per visitor class since passes visit every node of every template
+    """
+    _node_class_to_visit_method: typing.Dict[type, typing.Optional[typing.Callable]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._node_class_to_visit_method = _get_node_class_to_visit_method(cls)
+
+    def visit(self, node: Node):
+        visit_method = self._node_class_to_visit_method.get(type(node))
+        if visit_method is None:
+            return self.generic_visit(node)
+        return visit_method(self, node)
+
+    def generic_visit(self, node: Node):
+        node_class_to_visit_method = self._node_class_to_visit_method
+        for child in node.children:
+            visit_method = node_class_to_visit_method.get(type(child))
+            if visit_method is not None:
+                visit_method(self, child)
+            elif child.children:
+                self.generic_visit(child)
+
+
+# the index of a node class is its kind in dumped templates
+CACHED_TAG_NODE_CLASSES = (Variable, Partial, Comment, SetDelimiter)
+
+
+def __dump_nodes(nodes: typing.Iterable[Node]) -> list:
+    """
+    nodes as tuples of builtin types which marshal can write, text is (start, value),
+    other tags are (kind, start, value, raw, sigil) and sections hold their children
+    spans are left out where they follow from the text
+    """
+    records = []
+    for node in nodes:
+        node_class = type(node)
+        if node_class is Text:
+            records.append((node.start, node.value))
+        elif node_class is Section or node_class is Inverted:
+            records.append(
+                (
+                    node_class is Inverted,
+                    node.start,
+                    node.end,
+                    node.value,
+                    node.raw,
+                    node.sigil,
+                    node.standalone,
+                    node.close_raw,
+                    node.close_standalone,
+                    __dump_nodes(node.children),
+                )
+            )
+        else:
+            records.append(
+                (CACHED_TAG_NODE_CLASSES.index(node_class), node.start, node.value, node.raw, node.sigil)
+            )
+    return records
+
+
+def __load_nodes(records: list) -> typing.List[Node]:
+    nodes = []
+    for record in records:
+        if len(record) == 2:
+            start, value = record
+            nodes.append(Text(start, start + len(value), value))
+        elif len(record) == 5:
+            kind, start, value, raw, sigil = record
+            nodes.append(CACHED_TAG_NODE_CLASSES[kind](start, start + len(raw), value, raw, sigil))
+        else:
+            inverted, start, end, value, raw, sigil, standalone, close_raw, close_standalone, children = record
+            section = (Inverted if inverted else Section)(start, end, value, raw, sigil, standalone)
+            section.close_raw = close_raw
+            section.close_standalone = close_standalone
+            section.children = __load_nodes(children)
+            nodes.append(section)
+    return nodes
+
+
+def _dump_template(template: Template) -> bytes:
+    """
+    the template in the marshal format, which loads many times faster than the template is parsed
+    raises ValueError for templates nested too deep for marshal
+    """
+    return marshal.dumps(__dump_nodes(template.children))
+
+
+def _load_template(data: bytes) -> Template:
+    children = __load_nodes(marshal.loads(data))
+    return Template(0, children[-1].end if children else 0, children)
+
+
+class ParseCache:
+    """
+    An on-disk cache of parsed templates in cache_dir, so that later runs only tokenize and parse changed templates
+    Entries are keyed by the hash of the template text and kept in a folder of PARSE_CACHE_VERSION and
+    the marshal version, so a new parser or python starts a new folder. Tag sets and the whitespace config
+    only apply in the passes run on a parsed template, so changing them does not change the entries
+    Entries are marshal data, so only use a cache_dir which no one else can write to
+    hits and misses count the lookups made in this process
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.entry_dir = os.path.join(cache_dir, "v{}-{}".format(PARSE_CACHE_VERSION, marshal.version))
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self) -> dict:
+        # worker processes count their own lookups
+        return {"cache_dir": self.cache_dir}
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def parse(self, in_txt: str) -> Template:
+        """
+        the tree of in_txt from the cache, parsed and added to the cache when it is missing
+        """
+        entry_path = os.path.join(self.entry_dir, _hash_bytes(in_txt.encode("utf-8", "surrogatepass")))
+        try:
+            with open(entry_path, "rb") as file:
+                template = _load_template(file.read())
+            self.hits += 1
+            return template
+        except FileNotFoundError:
+            pass
+        except (EOFError, ValueError, TypeError, IndexError):
+            # a damaged entry is replaced
+            pass
+        self.misses += 1
+        template = _parse(_tokenize(in_txt))
+        try:
+            data = _dump_template(template)
+        except ValueError:
+            return template
+        os.makedirs(self.entry_dir, exist_ok=True)
+        temp_path = "{}.{}.{}.tmp".format(entry_path, os.getpid(), threading.get_ident())
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        # another process adding the same entry writes the same data
+        os.replace(temp_path, entry_path)
+        return template
+
+
+def _parse_with_cache(in_txt: str, parse_cache: typing.Optional[ParseCache] = None) -> Template:
+    return _parse(_tokenize(in_txt)) if parse_cache is None else parse_cache.parse(in_txt)
+
+
+def _get_tag_to_handlebars_tag_type(
     handlebars_tag_set: HandlebarTagSet,
-) -> typing.Optional[HandlebarsTagType]:
-    # mustache_tag_control_character: the #/^ control character
-    mustache_tag_type = MustacheTagType(mustache_tag_control_character)
-    if mustache_tag_type is MustacheTagType.IF_EACH_WITH:
-        if tag in handlebars_tag_set.if_tags:
-            return HandlebarsTagType.IF
-        if tag in handlebars_tag_set.each_tags:
-            return HandlebarsTagType.EACH
-        if tag in handlebars_tag_set.with_tags:
-            return HandlebarsTagType.WITH
-    elif mustache_tag_type is MustacheTagType.UNLESS:
-        return HandlebarsTagType.UNLESS
-    elif mustache_tag_type is MustacheTagType.CLOSE:
-        return HandlebarsTagType.CLOSE
-    return None
+) -> typing.Dict[str, HandlebarsTagType]:
+    """
+    merges the if/each/with tags into one lookup for # tags
+    a tag in several sets resolves to if, then each, then with
+    """
+    tag_to_handlebars_tag_type = {}
+    for tags, handlebars_tag_type in [
+        (handlebars_tag_set.with_tags, HandlebarsTagType.WITH),
+        (handlebars_tag_set.each_tags, HandlebarsTagType.EACH),
+        (handlebars_tag_set.if_tags, HandlebarsTagType.IF),
+    ]:
+        tag_to_handlebars_tag_type.update(dict.fromkeys(tags, handlebars_tag_type))
+    return tag_to_handlebars_tag_type
 
 
 def __mustache_to_handlebars_array_index_tag(in_tag: str) -> str:
@@ -86,12 +828,10 @@ def __mustache_to_handlebars_array_index_tag(in_tag: str) -> str:
             dot_pieces[i] = '[{}]'.format(piece)
     if not contains_digit:
         return in_tag
-    out_tag = '.'.join(dot_pieces)
-    MUSTACHE_TO_HANDLEBARS_TAG[in_tag] = out_tag
-    return out_tag
+    return '.'.join(dot_pieces)
 
 
-def __mustache_to_handlebars_tag_element(mustache_tag_element: str) -> str:
+def _mustache_to_handlebars_tag_element(mustache_tag_element: str) -> str:
     """
     '-first' -> '@first'
     Input excludes the #/^ control characters
@@ -104,7 +844,7 @@ def __mustache_to_handlebars_tag_element(mustache_tag_element: str) -> str:
 
 
 def __dir_path(path: str) -> str:
-    if os.path.isdir(path):
+    if path == STDIN_PATH or os.path.isdir(path):
         return path
     else:
         raise NotADirectoryError(path)
@@ -116,17 +856,48 @@ def __list_of_strings(space_delim_tags: str) -> typing.Set[str]:
     return set(space_delim_tags.split(" "))
 
 
+def __config_single_option_value(action: argparse.Action, value):
+    if value is None:
+        return value
+    if isinstance(value, (bool, list, dict)):
+        raise ValueError("{} is not a single value".format(json.dumps(value)))
+    if action.type is not None:
+        value = action.type(str(value))
+    if action.choices is not None and value not in action.choices:
+        raise ValueError("{} is not one of {}".format(json.dumps(value), list(action.choices)))
+    return value
+
+
+def __config_option_value(action: argparse.Action, value):
+    """
+    Checks and converts an option value of a -config file like argparse would the option on the command line
+    """
+    if action.nargs == 0:
+        if not isinstance(value, bool):
+            raise ValueError("it must be true or false")
+        return value
+    if isinstance(action, argparse._AppendAction):
+        if not isinstance(value, list):
+            raise ValueError("it must be a list")
+        return [__config_single_option_value(action, item) for item in value]
+    return __config_single_option_value(action, value)
+
+
 def __get_args():
     __list_of_string_help = (
         "a list of tags passed in a space delimited string like 'someTag anotherTag'"
     )
+    # the config file sets option defaults, so it is read before the other options are parsed
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("-config", type=str)
+    config_path = config_parser.parse_known_args()[0].config
     parser = argparse.ArgumentParser(
         description="convert templates from mustache to handebars"
     )
     parser.add_argument(
         "in_dir",
         type=__dir_path,
-        help="the folder containing your mustache templates",
+        help="the folder containing your mustache templates, or - to convert stdin to stdout",
     )
     parser.add_argument(
         "-out_dir",
@@ -175,96 +946,974 @@ def __get_args():
         action="store_true",
         help="if passed, the mustache template files will be deleted",
     )
+    parser.add_argument(
+        "-jobs",
+        type=int,
+        help="the number of processes to convert templates in, 0 uses one per cpu. 1 by default, 0 with -check",
+    )
+    parser.add_argument(
+        "-io_threads",
+        type=int,
+        default=0,
+        help="if more than 0, templates are read ahead and written in thread pools of this size while others convert",
+    )
+    parser.add_argument(
+        "-report",
+        choices=list(REPORTERS),
+        default="lines",
+        help="how progress is reported: a line per file, quiet for only the final summary, "
+        "a progress bar on stderr, or json lines",
+    )
+    parser.add_argument(
+        "-manifest",
+        default=False,
+        action="store_true",
+        help="if passed, a manifest of file hashes is kept in out_dir and only new or changed templates are converted",
+    )
+    parser.add_argument(
+        "-include",
+        action="append",
+        default=[],
+        help="only convert templates matching this glob, like 'api/*' or '*_model.mustache', may be repeated",
+    )
+    parser.add_argument(
+        "-exclude",
+        action="append",
+        default=[],
+        help="skip templates and folders matching this glob, like node_modules, may be repeated. "
+        "globs in in_dir/{} are also excluded".format(IGNORE_FILE_NAME),
+    )
+    parser.add_argument(
+        "-follow_symlinks",
+        default=True,
+        action="store_true",
+        help="symlinked folders are searched for templates by default, a folder linked more than once is searched once",
+    )
+    parser.add_argument(
+        "-no_follow_symlinks",
+        dest="follow_symlinks",
+        action="store_false",
+        help="if passed, symlinked folders are not searched for templates",
+    )
+    parser.add_argument(
+        "-profile",
+        type=str,
+        help="if passed, the wall and cpu time of each phase and template are written to this json file",
+    )
+    parser.add_argument(
+        "-profile_top",
+        type=int,
+        default=PROFILE_TOP_N,
+        help="the number of slowest templates listed in the -profile file",
+    )
+    parser.add_argument(
+        "-cprofile",
+        type=str,
+        help="if passed, a cProfile dump of the run is written to this file for use with pstats, "
+        "worker processes of -jobs are not included",
+    )
+    parser.add_argument(
+        "-infer_tags",
+        default=False,
+        action="store_true",
+        help="if passed, the type of section tags in no -handlebars_*_tags list is inferred from their section bodies "
+        "and confidently inferred sections are converted instead of skipped",
+    )
+    parser.add_argument(
+        "-infer_threshold",
+        type=float,
+        default=INFER_THRESHOLD,
+        help="the confidence from 0 to 1 an inferred section type needs to be used with -infer_tags",
+    )
+    parser.add_argument(
+        "-analyze",
+        type=str,
+        help="if passed, templates are not converted, instead every section tag is classified as if, each or with "
+        "from how it is used and the classification is written to this json file",
+    )
+    parser.add_argument(
+        "-parse_cache",
+        type=str,
+        help="if passed, parsed templates are kept in this folder and reused by later runs while the template is "
+        "unchanged, also when the tag or whitespace options change",
+    )
+    parser.add_argument(
+        "-mmap_min_size",
+        type=int,
+        help="if passed, templates of at least this many bytes are converted from an mmap of the file without "
+        "decoding the text between tags, which keeps memory use low for very large templates. 0 maps every "
+        "template",
+    )
+    parser.add_argument(
+        "-check",
+        default=False,
+        action="store_true",
+        help="if passed, nothing is written, instead templates are converted in memory and compared with their out "
+        "files. out files which are changed, missing or stale and templates with ambiguous tags are listed and the "
+        "exit code is 1 if there are any",
+    )
+    parser.add_argument(
+        "-watch",
+        default=False,
+        action="store_true",
+        help="if passed, templates are converted and then reconverted whenever they change until interrupted",
+    )
+    parser.add_argument(
+        "-config",
+        type=str,
+        help="a json file of if_tags, each_tags and with_tags lists, overrides of them for paths matching globs, "
+        "and options, which are used unless given on the command line. the file written by -analyze can be used",
+    )
+    conversion_config = ConversionConfig()
+    if config_path:
+        try:
+            conversion_config = _load_config(config_path)
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+        option_names = {action.dest for action in parser._actions} - {
+            "help", "in_dir", "config", "handlebars_if_tags", "handlebars_each_tags", "handlebars_with_tags"
+        }
+        unknown_option_names = set(conversion_config.options) - option_names
+        if unknown_option_names:
+            parser.error("unknown options in config file {}: {}".format(config_path, sorted(unknown_option_names)))
+        name_to_action = {action.dest: action for action in parser._actions}
+        options = {}
+        for name, value in conversion_config.options.items():
+            try:
+                options[name] = __config_option_value(name_to_action[name], value)
+            except (TypeError, ValueError, argparse.ArgumentTypeError) as error:
+                parser.error("invalid option {} in config file {}: {}".format(name, config_path, error))
+        parser.set_defaults(**options)
     args = parser.parse_args()
+    args.conversion_config = conversion_config
+    if args.manifest and args.delete_in_files:
+        parser.error("-manifest can not be used with -delete_in_files")
+    if args.watch and (args.manifest or args.delete_in_files or args.profile):
+        parser.error("-watch can not be used with -manifest, -delete_in_files or -profile")
+    if args.check and (args.manifest or args.delete_in_files or args.watch):
+        parser.error("-check can not be used with -manifest, -delete_in_files or -watch")
+    if args.in_dir == STDIN_PATH:
+        stdin_option_names = [
+            "-" + name
+            for name in ["infer_tags", "analyze", "watch", "check", "manifest", "delete_in_files"]
+            if getattr(args, name)
+        ]
+        if conversion_config.tag_set_overrides:
+            stdin_option_names.append("-config overrides")
+        if stdin_option_names:
+            parser.error("{} can not be used when in_dir is {}".format(", ".join(stdin_option_names), STDIN_PATH))
+    if args.jobs is None:
+        args.jobs = 0 if args.check else 1
     return args
 
 
-def _get_in_file_to_out_file_map(in_dir: str, out_dir: str, recursive: bool) -> dict:
-    path_args = []
-    if recursive:
-        path_args.append("**")
-    path_args.append("*.{}".format(MUSTACHE_EXTENSION))
-    in_dir_mustache_path_pattern = os.path.join(in_dir, *path_args)
-
-    mustache_files = glob.glob(in_dir_mustache_path_pattern, recursive=recursive)
+def __compile_glob_group(globs: typing.List[str]) -> typing.Optional[re.Pattern]:
+    if not globs:
+        return None
+    return re.compile("|".join(fnmatch.translate(glob_pattern) for glob_pattern in globs))
 
-    in_path_to_out_path = {}
-    for full_path in mustache_files:
-        path_from_dir = os.path.relpath(full_path, in_dir)
-        path_from_dir = path_from_dir.replace(MUSTACHE_EXTENSION, HANDLEBARS_EXTENSION)
-        out_path = os.path.join(out_dir, path_from_dir)
-        in_path_to_out_path[full_path] = out_path
-    return in_path_to_out_path
 
-
-def _add_whitespace_handling(
-    in_txt: str,
-    whitespace_config: HandlebarsWhitespaceConfig,
-) -> str:
+def _compile_globs(globs: typing.Iterable[str]) -> typing.Callable[[str, str], bool]:
     """
-    for lines with only one control tag (if/each/with/unless/close) add whitespace collapsing characters
+    Combines globs into a function of (path relative to in_dir with / separators, name) which
+    is true when any glob matches. Globs without a / match the file or folder name at any depth,
+    like node_modules or *_test.mustache, other globs match the relative path, like vendor/*
     """
-    lines = in_txt.split("\n")
-    for i, line in enumerate(lines):
-        control_tags = set(re.findall(HANDLEBARS_IF_UNLESS_CLOSE_PATTERN, line))
-        if not control_tags:
-            continue
-        if len(control_tags) != 1:
-            continue
-        variable_tags = set(re.findall(HANDLEBARS_VARIABLE_TAG, line))
-        if variable_tags:
-            continue
-        # there is only one tag on this line and it is a control tag
-        try:
-            open_braces_index = line.index(TAG_OPEN)
-        except ValueError:
-            continue
-        try:
-            close_braces_index = line.index(TAG_CLOSE)
-        except ValueError:
-            continue
+    globs = list(globs)
+    name_pattern = __compile_glob_group([glob_pattern for glob_pattern in globs if "/" not in glob_pattern])
+    path_pattern = __compile_glob_group([glob_pattern for glob_pattern in globs if "/" in glob_pattern])
 
-        prefix = line[:open_braces_index]
-        suffix = line[close_braces_index+len(TAG_CLOSE):]
+    def matches(rel_path: str, name: str) -> bool:
+        return bool(
+            (name_pattern and name_pattern.match(name))
+            or (path_pattern and path_pattern.match(rel_path))
+        )
+    return matches
 
-        if prefix.strip() != '':
-            continue
-        if suffix.strip() != '':
-            continue
-        # line beginning and end contain only whitespace
-        tag = control_tags.pop()
-        tag_type = MustacheTagType(tag[0])
-        whitespace_before_char = ''
-        whitespace_after_char = ''
-        if tag_type in MustacheTagType.IF_EACH_WITH:
-            if whitespace_config.remove_whitespace_before_open:
-                whitespace_before_char = HANDLEBARS_WHITESPACE_REMOVAL_CHAR
-            if whitespace_config.remove_whitespace_after_open:
-                whitespace_after_char = HANDLEBARS_WHITESPACE_REMOVAL_CHAR
-        elif tag_type is MustacheTagType.CLOSE:
-            if whitespace_config.remove_whitespace_before_close:
-                whitespace_before_char = HANDLEBARS_WHITESPACE_REMOVAL_CHAR
-            if whitespace_config.remove_whitespace_after_close:
-                whitespace_after_char = HANDLEBARS_WHITESPACE_REMOVAL_CHAR
-        lines[i] = (
-            prefix
-            + TAG_OPEN
-            + whitespace_before_char
-            + tag
-            + whitespace_after_char
-            + TAG_CLOSE
-            + suffix
-        )
-    return "\n".join(lines)
-
-
-def __mustache_to_handlebars_variable_tag_replacer(match: re.Match) -> str:
-    full_match = match.group(0)
-    pattern_str = match.group(1)
-    index = full_match.index(pattern_str)
-    prefix = full_match[:index]
-    suffix = full_match[index+len(pattern_str):]
-    return prefix + __mustache_to_handlebars_tag_element(pattern_str) + suffix
+
+def _read_ignore_file(in_dir: str) -> typing.List[str]:
+    """
+    the globs in the IGNORE_FILE_NAME file of in_dir, one per line, lines starting with # are comments
+    """
+    try:
+        with open(os.path.join(in_dir, IGNORE_FILE_NAME)) as file:
+            lines = [line.strip() for line in file]
+    except FileNotFoundError:
+        return []
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def _iter_mustache_files(
+    in_dir: str,
+    recursive: bool,
+    include_globs: typing.Iterable[str] = (),
+    exclude_globs: typing.Iterable[str] = (),
+    follow_symlinks: bool = True,
+    scanned_dirs: typing.Optional[typing.List[str]] = None,
+    out_extension: typing.Optional[str] = None,
+    ignore_file_dir: typing.Optional[str] = None,
+) -> typing.Iterator[typing.Tuple[str, str]]:
+    """
+    Lazily walks in_dir with os.scandir, yielding (path, path relative to in_dir) of each mustache template
+    Hidden files and folders are skipped, as are paths matching exclude_globs or the globs in in_dir/.m2hignore
+    When include_globs are given only templates matching one of them are yielded
+    When scanned_dirs is given, the path of each folder is added to it as it is scanned
+    Symlinked folders are walked when follow_symlinks is set, each folder once so that links to a parent end
+    When out_extension is given, files with it are found instead, like the out files in an out folder, matched
+    against the globs as the template they are written from, and the relative path of that template is yielded
+    The ignore file is read from ignore_file_dir instead of in_dir when it is given
+    """
+    include_globs = list(include_globs)
+    matches_include_glob = _compile_globs(include_globs)
+    matches_exclude_glob = _compile_globs([*exclude_globs, *_read_ignore_file(ignore_file_dir or in_dir)])
+    extension = "." + (out_extension or MUSTACHE_EXTENSION)
+    visited_dirs = set()
+    # (folder path, folder path relative to in_dir with a trailing /)
+    dirs_to_scan = [(in_dir, "")]
+    while dirs_to_scan:
+        dir_path, rel_dir_path = dirs_to_scan.pop()
+        if follow_symlinks:
+            dir_stat = os.stat(dir_path)
+            if (dir_stat.st_dev, dir_stat.st_ino) in visited_dirs:
+                continue
+            visited_dirs.add((dir_stat.st_dev, dir_stat.st_ino))
+        if scanned_dirs is not None:
+            scanned_dirs.append(dir_path)
+        with os.scandir(dir_path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        sub_dirs = []
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            rel_path = rel_dir_path + entry.name
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                if recursive and not matches_exclude_glob(rel_path, entry.name):
+                    sub_dirs.append((entry.path, rel_path + "/"))
+                continue
+            if not entry.name.endswith(extension) or not entry.is_file():
+                continue
+            name = entry.name
+            if out_extension is not None:
+                name = name[:-len(extension)] + "." + MUSTACHE_EXTENSION
+                rel_path = rel_dir_path + name
+            if matches_exclude_glob(rel_path, name):
+                continue
+            if include_globs and not matches_include_glob(rel_path, name):
+                continue
+            yield entry.path, rel_path
+        # files of a folder come before its sub folders, which are scanned in name order
+        dirs_to_scan.extend(reversed(sub_dirs))
+
+
+def _iter_in_file_to_out_file_pairs(
+    in_dir: str,
+    out_dir: str,
+    recursive: bool,
+    include_globs: typing.Iterable[str] = (),
+    exclude_globs: typing.Iterable[str] = (),
+    follow_symlinks: bool = True,
+    scanned_dirs: typing.Optional[typing.List[str]] = None,
+) -> typing.Iterator[typing.Tuple[str, str]]:
+    """
+    Lazily yields (mustache path, handlebars path) pairs so that conversion can start during discovery
+    """
+    for in_path, rel_path in _iter_mustache_files(
+        in_dir, recursive, include_globs, exclude_globs, follow_symlinks, scanned_dirs
+    ):
+        path_from_dir = rel_path[:-len(MUSTACHE_EXTENSION)] + HANDLEBARS_EXTENSION
+        yield in_path, os.path.join(out_dir, *path_from_dir.split("/"))
+
+
+def _get_in_file_to_out_file_map(
+    in_dir: str,
+    out_dir: str,
+    recursive: bool,
+    include_globs: typing.Iterable[str] = (),
+    exclude_globs: typing.Iterable[str] = (),
+    follow_symlinks: bool = True,
+) -> dict:
+    return dict(
+        _iter_in_file_to_out_file_pairs(
+            in_dir, out_dir, recursive, include_globs, exclude_globs, follow_symlinks
+        )
+    )
+
+
+def _get_whitespace_removal_chars(remove_before: bool, remove_after: bool) -> typing.Tuple[str, str]:
+    """
+    the whitespace collapsing characters to put before and after the content of standalone control tags
+    """
+    return (
+        HANDLEBARS_WHITESPACE_REMOVAL_CHAR if remove_before else "",
+        HANDLEBARS_WHITESPACE_REMOVAL_CHAR if remove_after else "",
+    )
+
+
+def _tag_with_handlebars_delimiters(sigil: str, value: str) -> str:
+    close_sigil = MUSTACHE_SIGIL_TO_CLOSE_SIGIL.get(sigil, "")
+    return TAG_OPEN + sigil + value + close_sigil + TAG_CLOSE
+
+
+def _guess_handlebars_tag_type_from_name(tag: str) -> HandlebarsTagType:
+    """
+    boolean sounding names are if, plural names are each, the rest are with
+    """
+    if tag.startswith(IF_TAG_NAME_PREFIXES):
+        return HandlebarsTagType.IF
+    if tag.endswith("s"):
+        return HandlebarsTagType.EACH
+    return HandlebarsTagType.WITH
+
+
+@dataclass
+class TagInference:
+    handlebars_tag_type: HandlebarsTagType
+    # 0 to 1
+    confidence: float
+    reason: str
+
+
+def _infer_handlebars_tag_type(
+    tag: str,
+    uses_context_tag: bool,
+    uses_iteration_tags: bool,
+    uses_own_tag: bool,
+    uses_other_tags: bool,
+) -> TagInference:
+    """
+    Infers if a {{#tag}} section is if, each or with from what its body uses outside of nested sections
+    {{.}} and -first/-last/-index only make sense while iterating, {{tag}} in its own section only
+    makes sense if tag is a value which is tested for presence, and a body which uses no tags can not be
+    entering an object. Otherwise only the name of the tag is left to go on
+    """
+    if uses_context_tag:
+        return TagInference(HandlebarsTagType.EACH, 0.95, "its body uses {{.}}")
+    if uses_iteration_tags:
+        return TagInference(HandlebarsTagType.EACH, 0.95, "its body uses -first/-last/-index")
+    if uses_own_tag:
+        return TagInference(HandlebarsTagType.IF, 0.9, "its body uses the tag itself")
+    name_handlebars_tag_type = _guess_handlebars_tag_type_from_name(tag)
+    if not uses_other_tags:
+        if name_handlebars_tag_type is HandlebarsTagType.IF:
+            return TagInference(HandlebarsTagType.IF, 0.85, "its body uses no tags and its name sounds boolean")
+        # a list section with a body of only text repeats it, which is rare but possible
+        return TagInference(HandlebarsTagType.IF, 0.6, "its body uses no tags")
+    return TagInference(name_handlebars_tag_type, 0.5, "its name")
+
+
+def _merge_tag_inference(
+    tag_inferences: typing.Dict[str, TagInference], tag: str, tag_inference: TagInference
+):
+    """
+    adds the inference of one section of tag to tag_inferences, keeping the least confident inference of tag
+    sections of tag inferred as different types give an inference with no confidence
+    """
+    old_tag_inference = tag_inferences.get(tag)
+    if old_tag_inference is None:
+        tag_inferences[tag] = tag_inference
+    elif old_tag_inference.handlebars_tag_type is not tag_inference.handlebars_tag_type:
+        tag_inferences[tag] = TagInference(
+            max(old_tag_inference, tag_inference, key=lambda inference: inference.confidence).handlebars_tag_type,
+            0.0,
+            "its sections were inferred as {} and {}".format(
+                old_tag_inference.handlebars_tag_type.name.lower(), tag_inference.handlebars_tag_type.name.lower()
+            ),
+        )
+    elif tag_inference.confidence < old_tag_inference.confidence:
+        tag_inferences[tag] = tag_inference
+
+
+@dataclass
+class _BodyUsage:
+    """
+    what the body of a section or partial uses outside of nested sections
+    """
+    uses_context_tag: bool = False
+    uses_iteration_tags: bool = False
+    uses_own_tag: bool = False
+    uses_other_tags: bool = False
+
+
+@dataclass
+class SectionUsage:
+    """
+    one {{#tag}} or {{^tag}} section of a template
+    context is the tags of the enclosing sections, outermost first
+    the uses fields describe the section body outside of nested sections, see _infer_handlebars_tag_type
+    """
+    in_path: str
+    line: int
+    context: typing.Tuple[str, ...]
+    inverted: bool
+    uses_context_tag: bool = False
+    uses_iteration_tags: bool = False
+    uses_own_tag: bool = False
+    uses_other_tags: bool = False
+
+
+def _get_body_usage(
+    nodes: typing.Iterable[Node],
+    own_tag: str = "",
+    partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+) -> _BodyUsage:
+    """
+    what nodes, the body of the section of own_tag, use outside of nested sections
+    a partial uses what its body uses, from partial_usages by partial name, partials missing from it may use any tag
+    """
+    body_usage = _BodyUsage()
+    for node in nodes:
+        node_class = type(node)
+        if node_class is Partial:
+            partial_usage = partial_usages.get(node.value) if partial_usages else None
+            if partial_usage is None:
+                body_usage.uses_other_tags = True
+                continue
+            body_usage.uses_context_tag |= partial_usage.uses_context_tag
+            body_usage.uses_iteration_tags |= partial_usage.uses_iteration_tags
+            body_usage.uses_other_tags |= partial_usage.uses_other_tags or partial_usage.uses_own_tag
+        elif node_class is Inverted:
+            body_usage.uses_other_tags = True
+        elif node_class is Variable or node_class is Section:
+            if node.value == MUSTACHE_CONTEXT_TAG:
+                body_usage.uses_context_tag = True
+            elif node.value in MUSTACHE_ITERATION_TAGS:
+                body_usage.uses_iteration_tags = True
+            elif node.value == own_tag:
+                body_usage.uses_own_tag = True
+            else:
+                body_usage.uses_other_tags = True
+    return body_usage
+
+
+class _TagElementPass(NodeVisitor):
+    """
+    sets the handlebars tag of variables and sections, like -first -> @first and myList.0 -> myList.[0]
+    """
+
+    def __init__(self, get_handlebars_tag_element: typing.Callable[[str], str]):
+        self.get_handlebars_tag_element = get_handlebars_tag_element
+
+    def visit_Variable(self, node: Variable):
+        node.tag = self.get_handlebars_tag_element(node.value)
+
+    def visit_Section(self, node: Section):
+        node.tag = self.get_handlebars_tag_element(node.value)
+        self.generic_visit(node)
+
+    visit_Inverted = visit_Section
+
+
+class _SectionTypePass(NodeVisitor):
+    """
+    sets the handlebars tag type of sections from tag_to_handlebars_tag_type, sections whose tag is not in it
+    are added to ambiguous_tags, or when infer_threshold is set their type is inferred from their body
+    and merged into tag_inferences
+    Once a tree is visited its inferred sections get the merged type of their tag when its confidence is at least
+    infer_threshold, so sections of one tag inferred as different types are all ambiguous. known_tag_inferences
+    are merged inferences of other templates, which win over those of the tree so that all templates agree
+    """
+
+    def __init__(
+        self,
+        tag_to_handlebars_tag_type: typing.Dict[str, HandlebarsTagType],
+        ambiguous_tags: typing.Set[str],
+        tag_inferences: typing.Dict[str, TagInference],
+        infer_threshold: typing.Optional[float] = None,
+        partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+        known_tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+    ):
+        self.tag_to_handlebars_tag_type = tag_to_handlebars_tag_type
+        self.ambiguous_tags = ambiguous_tags
+        self.tag_inferences = tag_inferences
+        self.infer_threshold = infer_threshold
+        self.partial_usages = partial_usages
+        self.known_tag_inferences = known_tag_inferences or {}
+        self._inferred_sections = []
+
+    def visit(self, node: Node):
+        # generic_visit dispatches children itself, so this is only called for the root of a tree
+        super().visit(node)
+        for section in self._inferred_sections:
+            tag_inference = self.known_tag_inferences.get(section.tag) or self.tag_inferences[section.tag]
+            if tag_inference.confidence >= self.infer_threshold:
+                section.handlebars_tag_type = tag_inference.handlebars_tag_type
+            else:
+                self.ambiguous_tags.add(section.tag)
+                section.handlebars_tag_type = None
+        self._inferred_sections.clear()
+
+    def visit_Section(self, node: Section):
+        # nested sections first, so that inferences are merged in the order the sections close
+        self.generic_visit(node)
+        handlebars_tag_type = self.tag_to_handlebars_tag_type.get(node.tag)
+        if handlebars_tag_type is None and self.infer_threshold is not None:
+            body_usage = _get_body_usage(node.children, node.value, self.partial_usages)
+            tag_inference = _infer_handlebars_tag_type(
+                node.tag,
+                body_usage.uses_context_tag,
+                body_usage.uses_iteration_tags,
+                body_usage.uses_own_tag,
+                body_usage.uses_other_tags,
+            )
+            _merge_tag_inference(self.tag_inferences, node.tag, tag_inference)
+            self._inferred_sections.append(node)
+            return
+        if handlebars_tag_type is None:
+            self.ambiguous_tags.add(node.tag)
+        node.handlebars_tag_type = handlebars_tag_type
+
+    def visit_Inverted(self, node: Inverted):
+        self.generic_visit(node)
+        node.handlebars_tag_type = HandlebarsTagType.UNLESS
+
+
+class _WhitespacePass(NodeVisitor):
+    """
+    sets the whitespace removal chars of standalone section tags
+    """
+
+    def __init__(
+        self,
+        open_whitespace_removal_chars: typing.Tuple[str, str],
+        close_whitespace_removal_chars: typing.Tuple[str, str],
+    ):
+        self.open_whitespace_removal_chars = open_whitespace_removal_chars
+        self.close_whitespace_removal_chars = close_whitespace_removal_chars
+
+    def visit_Section(self, node: Section):
+        if node.standalone:
+            node.open_whitespace_removal_chars = self.open_whitespace_removal_chars
+        if node.close_standalone:
+            node.close_whitespace_removal_chars = self.close_whitespace_removal_chars
+        self.generic_visit(node)
+
+    visit_Inverted = visit_Section
+
+
+def _get_section_context_tag(
+    handlebars_tag_type: typing.Optional[HandlebarsTagType], tag: str, context_tag: typing.Optional[str]
+) -> typing.Optional[str]:
+    """
+    what {{.}} refers to in the body of a section of tag, written as a handlebars path, when it refers to context_tag
+    outside of it. That is this in each and with sections and the tag of the section in if sections, as handlebars
+    if does not change the context. Unless and @first/@last sections do not change the context either,
+    and in sections of unknown type {{.}} is kept
+    """
+    if handlebars_tag_type is None:
+        return MUSTACHE_CONTEXT_TAG
+    if handlebars_tag_type is HandlebarsTagType.EACH or handlebars_tag_type is HandlebarsTagType.WITH:
+        return HANDLEBARS_CONTEXT_TAG
+    if handlebars_tag_type is HandlebarsTagType.IF and not tag.startswith("@"):
+        return tag
+    return context_tag
+
+
+def _uses_unknown_context_tag(nodes: typing.Iterable[Node]) -> bool:
+    """
+    whether nodes, which the passes ran on, use {{.}} outside of sections which set what it refers to
+    """
+    for node in nodes:
+        if type(node) is Variable and node.value == MUSTACHE_CONTEXT_TAG:
+            return True
+        # the body of a tree and of sections which keep the context, like unless, use it too
+        if type(node) is Template and _uses_unknown_context_tag(node.children):
+            return True
+        if (
+            isinstance(node, Section)
+            and _get_section_context_tag(node.handlebars_tag_type, node.tag, None) is None
+            and _uses_unknown_context_tag(node.children)
+        ):
+            return True
+    return False
+
+
+class _HandlebarsSerializer(NodeVisitor):
+    """
+    Writes the handlebars text of trees which the passes ran on to fragments
+    Handlebars has no set delimiter tag, so after one tags are written with {{ }} and {{ in text is escaped
+    {{.}} is written as the path of the value it refers to, see _get_section_context_tag
+    context_tag is what it refers to outside of sections, which is this except in partials included in sections
+    which do not change the context, none when that is unknown, then {{.}} is kept
+    """
+
+    def __init__(self, context_tag: typing.Optional[str] = HANDLEBARS_CONTEXT_TAG):
+        self.fragments = []
+        # where the handlebars text goes
+        self.write = self.fragments.append
+        self.default_delimiters = True
+        # what {{.}} refers to in each open section
+        self.context_tags = [context_tag]
+
+    def visit_Text(self, node: Text):
+        if self.default_delimiters:
+            self.write(node.value)
+        else:
+            self.write(node.value.replace(TAG_OPEN, "\\" + TAG_OPEN))
+
+    def visit_Variable(self, node: Variable):
+        if node.value == MUSTACHE_CONTEXT_TAG:
+            self.write(_tag_with_handlebars_delimiters(node.sigil, self.context_tags[-1] or MUSTACHE_CONTEXT_TAG))
+        elif node.tag == node.value and self.default_delimiters:
+            self.write(node.raw)
+        else:
+            self.write(_tag_with_handlebars_delimiters(node.sigil, node.tag))
+
+    def visit_Section(self, node: Section):
+        self.open_section(node)
+        self.generic_visit(node)
+        self.close_section(node)
+
+    visit_Inverted = visit_Section
+
+    def open_section(self, node: Section):
+        handlebars_tag_type = node.handlebars_tag_type
+        open_prefix = "#ifOrEachOrWith" if handlebars_tag_type is None else handlebars_tag_type.value[0]
+        before, after = node.open_whitespace_removal_chars
+        self.write(TAG_OPEN + before + open_prefix + " " + node.tag + after + TAG_CLOSE)
+        self.context_tags.append(_get_section_context_tag(handlebars_tag_type, node.tag, self.context_tags[-1]))
+
+    def close_section(self, node: Section):
+        self.context_tags.pop()
+        if node.handlebars_tag_type is None:
+            close_tag = "/ifOrEachOrWith"
+        else:
+            close_tag = node.handlebars_tag_type.value[1]
+        before, after = node.close_whitespace_removal_chars
+        self.write(TAG_OPEN + before + close_tag + after + TAG_CLOSE)
+
+    def visit_Partial(self, node: _TagNode):
+        # partials and comments are the same in handlebars
+        if self.default_delimiters:
+            self.write(node.raw)
+        else:
+            self.write(_tag_with_handlebars_delimiters(node.sigil, node.value))
+
+    visit_Comment = visit_Partial
+
+    def visit_SetDelimiter(self, node: SetDelimiter):
+        self.default_delimiters = node.value.split() == [TAG_OPEN, TAG_CLOSE]
+
+
+def _translate_bytes_newlines(data: bytes) -> bytes:
+    """
+    data with its line endings translated like reading it as text and writing it to a file opened with "w" would
+    """
+    data = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    return data if os.linesep == "\n" else data.replace(b"\n", os.linesep.encode())
+
+
+class _HandlebarsBytesSerializer(_HandlebarsSerializer):
+    """
+    Like _HandlebarsSerializer for trees of _tokenize_bytes, passing the encoded handlebars text to write
+    with the line endings writing the text to a file opened with "w" would have
+    Text without line endings to translate is passed on as views of data, so it is never decoded or copied
+    """
+
+    def __init__(
+        self,
+        data: typing.Union[bytes, mmap.mmap],
+        data_view: memoryview,
+        encoding: str,
+        write: typing.Callable[[typing.Union[bytes, memoryview]], typing.Any],
+        context_tag: typing.Optional[str] = HANDLEBARS_CONTEXT_TAG,
+    ):
+        super().__init__(context_tag)
+        self.data = data
+        self.data_view = data_view
+        self.encoding = encoding
+        self.write_bytes = write
+        self.write = lambda fragment: write(_encode_out_txt(fragment, encoding))
+
+    def visit_Text(self, node: Text):
+        text = self.data_view[node.start:node.end]
+        if not self.default_delimiters:
+            open_delimiter = TAG_OPEN.encode(self.encoding)
+            text = bytes(text).replace(open_delimiter, b"\\" + open_delimiter)
+        if os.linesep != "\n" or self.data.find(b"\r", node.start, node.end) != -1:
+            text = _translate_bytes_newlines(bytes(text))
+        self.write_bytes(text)
+
+
+class Converter:
+    """
+    Converts mustache templates to handlebars with one tag set and whitespace config
+    Both are compiled into lookups when the converter is made, so make a new converter to change them
+    Converted tag elements like myList.0 -> myList.[0] are kept in a least recently used cache
+    of at most tag_cache_size entries which belongs to this converter only
+    When infer_threshold is set, the type of sections whose tag is in no tag set is inferred from their bodies
+    and they are written with it when its confidence is at least infer_threshold
+    tag_set_overrides are (globs, tag set) pairs, templates whose path relative to in_dir matches a glob
+    use the tags of that tag set over handlebars_tag_set, later overrides win over earlier ones
+    partial_usages is what the body of each partial uses by partial name, see _get_partial_usages,
+    so that a partial in an inferred section counts as its body
+    known_tag_inferences are the inferences of tags merged across all templates, see _infer_tag_types, so that
+    every section of a tag gets one type, or is ambiguous when its sections disagree, in whichever template it is
+    parse_cache is used to parse templates when given, so that unchanged templates are not parsed again across runs
+    partial_context_tags is what {{.}} refers to outside of sections by template path, see _get_partial_context_tags,
+    this for templates missing from it. {{.}} in templates where it is none is kept and makes . an ambiguous tag
+    """
+
+    def __init__(
+        self,
+        handlebars_tag_set: HandlebarTagSet,
+        whitespace_config: HandlebarsWhitespaceConfig,
+        tag_cache_size: int = TAG_CACHE_SIZE,
+        infer_threshold: typing.Optional[float] = None,
+        tag_set_overrides: typing.Sequence[typing.Tuple[typing.Sequence[str], HandlebarTagSet]] = (),
+        in_dir: str = "",
+        partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+        parse_cache: typing.Optional[ParseCache] = None,
+        known_tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+        partial_context_tags: typing.Optional[typing.Dict[str, typing.Optional[str]]] = None,
+    ):
+        self.handlebars_tag_set = handlebars_tag_set
+        self.whitespace_config = whitespace_config
+        self.tag_cache_size = tag_cache_size
+        self.infer_threshold = infer_threshold
+        self.tag_set_overrides = [(list(globs), tag_set) for globs, tag_set in tag_set_overrides]
+        self.in_dir = in_dir
+        self.partial_usages = partial_usages or {}
+        self.parse_cache = parse_cache
+        self.known_tag_inferences = known_tag_inferences or {}
+        self.partial_context_tags = partial_context_tags or {}
+        self._get_handlebars_tag_element = functools.lru_cache(maxsize=tag_cache_size)(
+            _mustache_to_handlebars_tag_element
+        )
+        self._tag_to_handlebars_tag_type = _get_tag_to_handlebars_tag_type(handlebars_tag_set)
+        self._tag_set_overrides = [
+            (_compile_globs(globs), _get_tag_to_handlebars_tag_type(tag_set))
+            for globs, tag_set in self.tag_set_overrides
+        ]
+        # the merged lookup of each combination of overrides matching a template, by override indexes
+        self._override_indexes_to_tag_to_handlebars_tag_type = {(): self._tag_to_handlebars_tag_type}
+        self._open_whitespace_removal_chars = _get_whitespace_removal_chars(
+            whitespace_config.remove_whitespace_before_open,
+            whitespace_config.remove_whitespace_after_open,
+        )
+        self._close_whitespace_removal_chars = _get_whitespace_removal_chars(
+            whitespace_config.remove_whitespace_before_close,
+            whitespace_config.remove_whitespace_after_close,
+        )
+
+    def __getstate__(self) -> dict:
+        # the cache is not picklable, converters sent to worker processes start with an empty one
+        return {
+            "handlebars_tag_set": self.handlebars_tag_set,
+            "whitespace_config": self.whitespace_config,
+            "tag_cache_size": self.tag_cache_size,
+            "infer_threshold": self.infer_threshold,
+            "tag_set_overrides": self.tag_set_overrides,
+            "in_dir": self.in_dir,
+            "partial_usages": self.partial_usages,
+            "parse_cache": self.parse_cache,
+            "known_tag_inferences": self.known_tag_inferences,
+            "partial_context_tags": self.partial_context_tags,
+        }
+
+    def __setstate__(self, state: dict):
+        self.__init__(**state)
+
+    def _get_tag_to_handlebars_tag_type_for_path(
+        self, in_path: typing.Optional[str]
+    ) -> typing.Dict[str, HandlebarsTagType]:
+        """
+        the tag lookup for the template at in_path, with the tag set overrides matching it applied
+        """
+        if not self._tag_set_overrides or in_path is None:
+            return self._tag_to_handlebars_tag_type
+        rel_path = os.path.relpath(in_path, self.in_dir or os.curdir).replace(os.sep, "/")
+        name = os.path.basename(in_path)
+        override_indexes = tuple(
+            i for i, (matches, _) in enumerate(self._tag_set_overrides) if matches(rel_path, name)
+        )
+        tag_to_handlebars_tag_type = self._override_indexes_to_tag_to_handlebars_tag_type.get(override_indexes)
+        if tag_to_handlebars_tag_type is None:
+            tag_to_handlebars_tag_type = dict(self._tag_to_handlebars_tag_type)
+            for i in override_indexes:
+                tag_to_handlebars_tag_type.update(self._tag_set_overrides[i][1])
+            self._override_indexes_to_tag_to_handlebars_tag_type[override_indexes] = tag_to_handlebars_tag_type
+        return tag_to_handlebars_tag_type
+
+    def _get_handlebars_tag_type(
+        self, tag: str, inverted: bool, in_path: typing.Optional[str]
+    ) -> typing.Optional[HandlebarsTagType]:
+        """
+        the type of a section of tag in the template at in_path when it is known before converting the template,
+        from the tag sets or known_tag_inferences
+        """
+        if inverted:
+            return HandlebarsTagType.UNLESS
+        handlebars_tag_type = self._get_tag_to_handlebars_tag_type_for_path(in_path).get(tag)
+        if handlebars_tag_type is None and self.infer_threshold is not None:
+            return _get_applied_tag_type(self.known_tag_inferences.get(tag), self.infer_threshold)
+        return handlebars_tag_type
+
+    def _get_context_tag(self, in_path: typing.Optional[str]) -> typing.Optional[str]:
+        return self.partial_context_tags.get(in_path, HANDLEBARS_CONTEXT_TAG)
+
+    def _parse_template(self, in_txt: str) -> Template:
+        return _parse_with_cache(in_txt, self.parse_cache)
+
+    def tag_cache_info(self) -> typing.NamedTuple:
+        """
+        hits, misses, maxsize and currsize of the tag element cache
+        """
+        return self._get_handlebars_tag_element.cache_info()
+
+    def _get_passes(
+        self,
+        ambiguous_tags: typing.Set[str],
+        tag_inferences: typing.Dict[str, TagInference],
+        tag_to_handlebars_tag_type: typing.Optional[typing.Dict[str, HandlebarsTagType]] = None,
+    ) -> typing.List[NodeVisitor]:
+        """
+        the passes run on trees before they are serialized, see _convert_nodes
+        """
+        if tag_to_handlebars_tag_type is None:
+            tag_to_handlebars_tag_type = self._tag_to_handlebars_tag_type
+        return [
+            _TagElementPass(self._get_handlebars_tag_element),
+            _SectionTypePass(
+                tag_to_handlebars_tag_type,
+                ambiguous_tags,
+                tag_inferences,
+                self.infer_threshold,
+                self.partial_usages,
+                self.known_tag_inferences,
+            ),
+            _WhitespacePass(self._open_whitespace_removal_chars, self._close_whitespace_removal_chars),
+        ]
+
+    def _convert_nodes(
+        self,
+        nodes: typing.Iterable[Node],
+        ambiguous_tags: typing.Set[str],
+        tag_inferences: typing.Dict[str, TagInference],
+        tag_to_handlebars_tag_type: typing.Optional[typing.Dict[str, HandlebarsTagType]] = None,
+        context_tag: typing.Optional[str] = HANDLEBARS_CONTEXT_TAG,
+    ) -> typing.Iterator[str]:
+        """
+        runs the passes on each node and yields its handlebars text, tags which could be if/each/with are added
+        to ambiguous_tags and when infer_threshold is set the types inferred for them are added to tag_inferences
+        tag_to_handlebars_tag_type is the tag lookup to use, the one of handlebars_tag_set if unset
+        context_tag is what {{.}} refers to outside of sections, see _HandlebarsSerializer
+        """
+        passes = self._get_passes(ambiguous_tags, tag_inferences, tag_to_handlebars_tag_type)
+        serializer = _HandlebarsSerializer(context_tag)
+        for node in nodes:
+            for node_pass in passes:
+                node_pass.visit(node)
+            if context_tag is None and _uses_unknown_context_tag([node]):
+                ambiguous_tags.add(MUSTACHE_CONTEXT_TAG)
+            serializer.visit(node)
+            yield "".join(serializer.fragments)
+            serializer.fragments.clear()
+
+    def _convert_flat_nodes(self, nodes: typing.Iterable[Node], ambiguous_tags: typing.Set[str]) -> typing.Iterator[str]:
+        """
+        like _convert_nodes for the nodes of _iter_parse with flat set, yielding the open and close tags of sections
+        as they are read, which needs the type of sections to follow from their tag alone without inference
+        """
+        passes = self._get_passes(ambiguous_tags, {})
+        serializer = _HandlebarsSerializer()
+        open_sections = []
+        for node in nodes:
+            # a section is yielded again when it closes, then the passes run again to see its close tag
+            for node_pass in passes:
+                node_pass.visit(node)
+            if open_sections and node is open_sections[-1]:
+                open_sections.pop()
+                serializer.close_section(node)
+            elif isinstance(node, Section):
+                open_sections.append(node)
+                serializer.open_section(node)
+            else:
+                serializer.visit(node)
+            yield "".join(serializer.fragments)
+            serializer.fragments.clear()
+
+    def convert(self, in_txt: str, in_path: typing.Optional[str] = None) -> typing.Tuple[str, typing.Set[str]]:
+        """
+        Returns the handlebars template and its ambiguous tags, their sections are written as ifOrEachOrWith
+        in_path is the path of the template, which selects the tag set overrides to use
+        """
+        out_txt, ambiguous_tags, _ = self.convert_with_inferences(in_txt, in_path)
+        return out_txt, ambiguous_tags
+
+    def convert_with_inferences(
+        self, in_txt: str, in_path: typing.Optional[str] = None
+    ) -> typing.Tuple[str, typing.Set[str], typing.Dict[str, TagInference]]:
+        """
+        Like convert, also returning the types inferred for tags in no tag set when infer_threshold is set
+        """
+        ambiguous_tags = set()
+        tag_inferences = {}
+        out_txt = "".join(
+            self._convert_nodes(
+                [self._parse_template(in_txt)],
+                ambiguous_tags,
+                tag_inferences,
+                self._get_tag_to_handlebars_tag_type_for_path(in_path),
+                self._get_context_tag(in_path),
+            )
+        )
+        return out_txt, ambiguous_tags, tag_inferences
+
+    def convert_mapped(
+        self,
+        data: typing.Union[bytes, mmap.mmap],
+        write: typing.Callable[[typing.Union[bytes, memoryview]], typing.Any],
+        encoding: str,
+        in_path: typing.Optional[str] = None,
+    ) -> typing.Tuple[typing.Set[str], typing.Dict[str, TagInference]]:
+        """
+        Converts the template in data, encoded with encoding, like an mmap of a template file,
+        passing the encoded handlebars template to write unless it has ambiguous tags
+        Only the tags are decoded, text between them is passed to write as views of data, see _tokenize_bytes,
+        so memory holds the tags but not the text of the template
+        Returns the ambiguous tags and the inferred tag types like convert_with_inferences
+        """
+        ambiguous_tags = set()
+        tag_inferences = {}
+        template = _parse(_tokenize_bytes(data, encoding))
+        for node_pass in self._get_passes(
+            ambiguous_tags, tag_inferences, self._get_tag_to_handlebars_tag_type_for_path(in_path)
+        ):
+            node_pass.visit(template)
+        context_tag = self._get_context_tag(in_path)
+        if context_tag is None and _uses_unknown_context_tag([template]):
+            ambiguous_tags.add(MUSTACHE_CONTEXT_TAG)
+        if not ambiguous_tags:
+            with memoryview(data) as data_view:
+                _HandlebarsBytesSerializer(data, data_view, encoding, write, context_tag).visit(template)
+        return ambiguous_tags, tag_inferences
+
+    def convert_many(
+        self, in_txts: typing.Iterable[str]
+    ) -> typing.Iterator[typing.Tuple[str, typing.Set[str]]]:
+        """
+        Yields the handlebars template and ambiguous tags of each template in in_txts
+        """
+        for in_txt in in_txts:
+            yield self.convert(in_txt)
+
+    def convert_stream(self, reader: typing.TextIO, writer: typing.TextIO) -> typing.Set[str]:
+        """
+        Converts the mustache template read from reader and writes the handlebars template to writer
+        as it goes, holding only the untokenized lines and the open sections in memory, or the outermost open
+        section when section types are inferred
+        Returns the ambiguous tags, their sections are written as ifOrEachOrWith
+        """
+        ambiguous_tags = set()
+        tokens = _tokenize_stream(reader, STREAM_CHUNK_SIZE)
+        if self.infer_threshold is None:
+            out_fragments = self._convert_flat_nodes(_iter_parse(tokens, flat=True), ambiguous_tags)
+        else:
+            # inferring a section needs its whole body
+            out_fragments = self._convert_nodes(_iter_parse(tokens), ambiguous_tags, {})
+        for out_fragment in out_fragments:
+            writer.write(out_fragment)
+        return ambiguous_tags
 
 
 def _convert_handlebars_to_mustache(
@@ -272,141 +1921,2231 @@ def _convert_handlebars_to_mustache(
     handlebars_tag_set: HandlebarTagSet,
     whitespace_config: HandlebarsWhitespaceConfig,
 ) -> typing.Tuple[str, typing.Set[str]]:
-    in_txt = re.sub(MUSTACHE_VARIABLE_TAG, __mustache_to_handlebars_variable_tag_replacer, in_txt)
-    # extract all control tags from {{#someTag}} and {{/someTag}} patterns
-    tags = set(re.findall(MUSTACHE_IF_UNLESS_CLOSE_PATTERN, in_txt))
+    return Converter(handlebars_tag_set, whitespace_config).convert(in_txt)
+
+
+def convert_stream(
+    reader: typing.TextIO,
+    writer: typing.TextIO,
+    handlebars_tag_set: HandlebarTagSet,
+    whitespace_config: HandlebarsWhitespaceConfig,
+) -> typing.Set[str]:
+    """
+    Converts the mustache template read from reader and writes the handlebars template to writer
+    as it goes, see Converter.convert_stream
+    """
+    return Converter(handlebars_tag_set, whitespace_config).convert_stream(reader, writer)
+
+
+@dataclass
+class ConversionSummary:
+    qty_files: int = 0
+    qty_written: int = 0
+    qty_unchanged: int = 0
+    # files not written because they have ambiguous tags
+    qty_skipped: int = 0
+    # files not written because they can not be parsed
+    qty_failed: int = 0
+    qty_ambiguous_tags: int = 0
+    in_bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.qty_files / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.in_bytes / self.seconds if self.seconds else 0.0
+
+
+class Reporter:
+    """
+    Reports the progress of converting and removing files
+    This default reporter writes one line per file, collecting lines and writing them to
+    stream (sys.stdout if unset) in batches of REPORT_BATCH_SIZE so that output does not slow the run down
+    """
+
+    def __init__(self, stream: typing.Optional[typing.TextIO] = None):
+        self.stream = stream
+        self._lines = []
+
+    def _write_line(self, line: str):
+        self._lines.append(line)
+        if len(self._lines) >= REPORT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._lines:
+            return
+        stream = self.stream or sys.stdout
+        stream.write("\n".join(self._lines) + "\n")
+        stream.flush()
+        self._lines.clear()
+
+    def message(self, message: str):
+        self._write_line(message)
+
+    def file_read(self, file_number: int, qty_files: typing.Optional[int], in_path: str):
+        if qty_files is None:
+            self._write_line("Reading file {}, path={}".format(file_number, in_path))
+        else:
+            self._write_line("Reading file {} out of {}, path={}".format(file_number, qty_files, in_path))
+
+    def file_skipped(self, out_path: str, ambiguous_tags: typing.Set[str]):
+        self._write_line("Skipped writing file {} because it has ambiguous tags".format(out_path))
+
+    def file_written(self, out_path: str, written: bool):
+        if written:
+            self._write_line("Wrote file {}".format(out_path))
+        else:
+            self._write_line("Unchanged file {}".format(out_path))
+
+    def file_failed(self, in_path: str, error: str):
+        self._write_line("Could not convert {}: {}".format(in_path, error))
+
+    def file_removed(self, file_number: int, qty_files: int, path: str):
+        self._write_line("Removing file {} out of {}, path={}".format(file_number, qty_files, path))
+
+    def finish(self, summary: ConversionSummary):
+        self._write_line(
+            "Converted {} files in {:.2f}s, {:.1f} files/sec, {:.0f} bytes/sec, "
+            "wrote {}, unchanged {}, skipped {}, failed {}, ambiguous tags {}".format(
+                summary.qty_files,
+                summary.seconds,
+                summary.files_per_second,
+                summary.bytes_per_second,
+                summary.qty_written,
+                summary.qty_unchanged,
+                summary.qty_skipped,
+                summary.qty_failed,
+                summary.qty_ambiguous_tags,
+            )
+        )
+        self.flush()
+
+
+class QuietReporter(Reporter):
+    """
+    Only reports files which could not be converted and the final summary
+    """
+
+    def message(self, message: str):
+        pass
+
+    def file_read(self, file_number: int, qty_files: typing.Optional[int], in_path: str):
+        pass
+
+    def file_skipped(self, out_path: str, ambiguous_tags: typing.Set[str]):
+        pass
+
+    def file_written(self, out_path: str, written: bool):
+        pass
+
+    def file_removed(self, file_number: int, qty_files: int, path: str):
+        pass
+
+
+class ProgressBarReporter(QuietReporter):
+    """
+    Redraws a progress bar on stream (sys.stderr if unset) at most every PROGRESS_BAR_INTERVAL seconds
+    Messages and files which are skipped or could not be converted are written on their own lines above the bar
+    """
+
+    def __init__(self, stream: typing.Optional[typing.TextIO] = None):
+        super().__init__(stream or sys.stderr)
+        self._last_draw_time = 0.0
+        self._file_number = 0
+        self._qty_files = None
+        # the length of the progress line on stream, 0 when there is none
+        self._bar_length = 0
+
+    def _write_line(self, line: str):
+        # the progress line is cleared so that line replaces it, then it is redrawn below line
+        bar_length = self._bar_length
+        self.stream.write("\r" + " " * bar_length + "\r" + line + "\n" if bar_length else line + "\n")
+        self._bar_length = 0
+        if bar_length:
+            self._draw()
+        else:
+            self.stream.flush()
+
+    message = Reporter.message
+    file_skipped = Reporter.file_skipped
+
+    def _draw(self):
+        if self._qty_files:
+            done_width = PROGRESS_BAR_WIDTH * self._file_number // self._qty_files
+            bar = "[{}{}] {}/{} files".format(
+                "#" * done_width, "." * (PROGRESS_BAR_WIDTH - done_width), self._file_number, self._qty_files
+            )
+        else:
+            bar = "{} files".format(self._file_number)
+        self.stream.write("\r" + bar)
+        self.stream.flush()
+        self._bar_length = len(bar)
+
+    def file_read(self, file_number: int, qty_files: typing.Optional[int], in_path: str):
+        self._file_number, self._qty_files = file_number, qty_files
+        now = time.monotonic()
+        if now - self._last_draw_time >= PROGRESS_BAR_INTERVAL:
+            self._last_draw_time = now
+            self._draw()
+
+    def finish(self, summary: ConversionSummary):
+        self._draw()
+        self.stream.write("\n")
+        self._bar_length = 0
+        super().finish(summary)
+
+
+class JsonLinesReporter(Reporter):
+    """
+    Writes one json object per event, each has an event key naming it
+    """
+
+    def _write_event(self, event: str, **values):
+        self._write_line(json.dumps({"event": event, **values}))
+
+    def message(self, message: str):
+        self._write_event("message", message=message)
+
+    def file_read(self, file_number: int, qty_files: typing.Optional[int], in_path: str):
+        self._write_event("file_read", file_number=file_number, qty_files=qty_files, in_path=in_path)
+
+    def file_skipped(self, out_path: str, ambiguous_tags: typing.Set[str]):
+        self._write_event("file_skipped", out_path=out_path, ambiguous_tags=sorted(ambiguous_tags))
+
+    def file_written(self, out_path: str, written: bool):
+        self._write_event("file_written", out_path=out_path, written=written)
+
+    def file_failed(self, in_path: str, error: str):
+        self._write_event("file_failed", in_path=in_path, error=error)
+
+    def file_removed(self, file_number: int, qty_files: int, path: str):
+        self._write_event("file_removed", file_number=file_number, qty_files=qty_files, path=path)
+
+    def finish(self, summary: ConversionSummary):
+        self._write_event(
+            "summary",
+            files_per_second=summary.files_per_second,
+            bytes_per_second=summary.bytes_per_second,
+            **dataclasses.asdict(summary),
+        )
+        self.flush()
+
+
+REPORTERS = {
+    "lines": Reporter,
+    "quiet": QuietReporter,
+    "progress": ProgressBarReporter,
+    "json": JsonLinesReporter,
+}
+
+
+@dataclass
+class PhaseTime:
+    seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    count: int = 0
+
+    def add(self, seconds: float, cpu_seconds: float):
+        self.seconds += seconds
+        self.cpu_seconds += cpu_seconds
+        self.count += 1
+
+
+@dataclass
+class FileProfile:
+    in_path: str
+    in_size: int = 0
+    phase_times: typing.Dict[str, PhaseTime] = field(default_factory=dict)
+
+    @property
+    def seconds(self) -> float:
+        return sum(phase_time.seconds for phase_time in self.phase_times.values())
+
+
+def _timed(function: typing.Callable, *args) -> typing.Tuple[typing.Any, typing.Tuple[float, float]]:
+    """
+    returns the result of function(*args) and the (wall, cpu) seconds the call took
+    cpu time is that of the calling thread so calls in thread pools are measured on their own
+    """
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    result = function(*args)
+    return result, (time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+
+class Profiler:
+    """
+    Records the wall and cpu seconds spent in each phase of a run, in total and per template
+    The phases are discover, manifest, partials, read, tokenize, parse, convert and write
+    Phases of templates converted in other threads or processes are included, so phase seconds
+    can add up to more than the seconds of the whole run
+    record is called for every measurement, subclass and override it to hook into them as they happen
+    """
+
+    def __init__(self):
+        self.phase_times = {}
+        self.file_profiles = {}
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self._lock = threading.Lock()
+        self._wall_start, self._cpu_start = time.perf_counter(), time.process_time()
+
+    def record(self, phase: str, seconds: float, cpu_seconds: float, in_path: typing.Optional[str] = None):
+        """
+        adds a measurement of phase, in_path is set for phases of one template
+        """
+        with self._lock:
+            self.phase_times.setdefault(phase, PhaseTime()).add(seconds, cpu_seconds)
+            if in_path is not None:
+                file_profile = self.file_profiles.setdefault(in_path, FileProfile(in_path))
+                file_profile.phase_times.setdefault(phase, PhaseTime()).add(seconds, cpu_seconds)
+
+    def record_file(
+        self, in_path: str, in_size: int, phase_times: typing.Dict[str, typing.Tuple[float, float]]
+    ):
+        """
+        records the (wall, cpu) seconds of each phase of a template measured by _timed
+        """
+        for phase, (seconds, cpu_seconds) in phase_times.items():
+            self.record(phase, seconds, cpu_seconds, in_path)
+        with self._lock:
+            self.file_profiles.setdefault(in_path, FileProfile(in_path)).in_size = in_size
+
+    @contextlib.contextmanager
+    def measure(self, phase: str, in_path: typing.Optional[str] = None):
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - wall_start, time.thread_time() - cpu_start, in_path)
+
+    def measure_iterator(self, phase: str, iterable: typing.Iterable) -> typing.Iterator:
+        """
+        yields the items of iterable, recording the time spent producing them as phase
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.measure(phase):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def stop(self):
+        """
+        sets the wall and cpu seconds of the whole run, cpu seconds are of this process only
+        """
+        self.seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = time.process_time() - self._cpu_start
+
+    def slowest_files(self, top_n: int = PROFILE_TOP_N) -> typing.List[FileProfile]:
+        return heapq.nlargest(top_n, self.file_profiles.values(), key=lambda file_profile: file_profile.seconds)
+
+    def to_dict(self, top_n: int = PROFILE_TOP_N) -> dict:
+        def file_profile_to_dict(file_profile: FileProfile) -> dict:
+            return {
+                "in_path": file_profile.in_path,
+                "in_size": file_profile.in_size,
+                "seconds": file_profile.seconds,
+                "phases": {
+                    phase: phase_time.seconds for phase, phase_time in file_profile.phase_times.items()
+                },
+            }
+        return {
+            "seconds": self.seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "phases": {phase: dataclasses.asdict(phase_time) for phase, phase_time in self.phase_times.items()},
+            "slowest_files": [file_profile_to_dict(file_profile) for file_profile in self.slowest_files(top_n)],
+            "files": [
+                file_profile_to_dict(file_profile)
+                for _, file_profile in sorted(self.file_profiles.items())
+            ],
+        }
+
+
+def _read_file(in_path: str) -> typing.Tuple[str, int]:
+    """
+    returns the text of in_path and its size in bytes
+    raises TemplateError when in_path is not text in the locale encoding, so that it is skipped like a template
+    which can not be parsed
+    """
+    with open(in_path) as file:
+        try:
+            return file.read(), os.fstat(file.fileno()).st_size
+        except UnicodeDecodeError as error:
+            raise TemplateError("It is not {} text, {}".format(file.encoding, error)) from None
+
+
+def _convert_file(
+    in_path: str, converter: Converter
+) -> typing.Tuple[str, typing.Set[str], typing.Dict[str, TagInference], int]:
+    """
+    returns the converted text, ambiguous tags, tag inferences and size in bytes of in_path
+    """
+    in_txt, in_size = _read_file(in_path)
+    return (*converter.convert_with_inferences(in_txt, in_path), in_size)
+
+
+def _convert_profiled(
+    in_txt: str,
+    converter: Converter,
+    phase_times: typing.Dict[str, typing.Tuple[float, float]],
+    in_path: typing.Optional[str] = None,
+) -> typing.Tuple[str, typing.Set[str], typing.Dict[str, TagInference]]:
+    """
+    Like Converter.convert_with_inferences, adding the (wall, cpu) seconds of the tokenize, parse and convert phases
+    to phase_times
+    Tokens are collected in a list first so that the phases can be timed apart,
+    with a parse cache the parse phase holds the lookup and there is no tokenize phase
+    """
+    if converter.parse_cache is None:
+        tokens, phase_times["tokenize"] = _timed(list, _tokenize(in_txt))
+        template, phase_times["parse"] = _timed(_parse, tokens)
+    else:
+        template, phase_times["parse"] = _timed(converter.parse_cache.parse, in_txt)
     ambiguous_tags = set()
-    if not tags:
-        return in_txt, ambiguous_tags
-    replacement_index_to_from_to_pair = {}
-    closures = []
-    for i in range(len(in_txt)):
-        for tag_without_braces in tags:
-            tag_with_braces = TAG_OPEN + tag_without_braces + TAG_CLOSE
-
-            end_index = i + len(tag_with_braces)
-            if end_index > len(in_txt):
+    tag_inferences = {}
+    out_txt, phase_times["convert"] = _timed(
+        "".join,
+        converter._convert_nodes(
+            [template], ambiguous_tags, tag_inferences, converter._get_tag_to_handlebars_tag_type_for_path(in_path)
+        ),
+    )
+    return out_txt, ambiguous_tags, tag_inferences
+
+
+def __files_equal(path: str, other_path: str) -> bool:
+    if os.path.getsize(path) != os.path.getsize(other_path):
+        return False
+    with open(path, "rb") as file, open(other_path, "rb") as other_file:
+        while True:
+            chunk = file.read(STREAM_CHUNK_SIZE)
+            if chunk != other_file.read(STREAM_CHUNK_SIZE):
+                return False
+            if not chunk:
+                return True
+
+
+def _convert_mapped_file(
+    in_path: str, converter: Converter, write: typing.Callable[[typing.Union[bytes, memoryview]], typing.Any]
+) -> typing.Tuple[typing.Set[str], typing.Dict[str, TagInference], int]:
+    """
+    Converts in_path through an mmap with Converter.convert_mapped, passing the encoded output to write
+    returns the ambiguous tags, tag inferences and size in bytes of in_path
+    """
+    encoding = locale.getpreferredencoding(False)
+    with open(in_path, "rb") as in_file:
+        in_size = os.fstat(in_file.fileno()).st_size
+        if not in_size:
+            # empty files can not be mapped
+            return (*converter.convert_mapped(b"", write, encoding, in_path), in_size)
+        with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                return (*converter.convert_mapped(data, write, encoding, in_path), in_size)
+            except UnicodeDecodeError as error:
+                error_message = "It is not {} text, {}".format(encoding, error)
+            except TemplateError as error:
+                # its traceback holds matches exporting data, which can not be closed while they exist
+                error_message = str(error)
+    raise TemplateError(error_message)
+
+
+def _is_mapped(in_path: str, mmap_min_size: typing.Optional[int]) -> bool:
+    """
+    whether in_path is converted through an mmap for mmap_min_size, see _convert_file_or_mapped
+    """
+    if mmap_min_size is None or codecs.lookup(locale.getpreferredencoding(False)).name not in MMAP_ENCODINGS:
+        return False
+    return os.stat(in_path).st_size >= mmap_min_size
+
+
+def _convert_file_mapped(
+    in_path: str, out_path: str, converter: Converter
+) -> typing.Tuple[bool, typing.Set[str], typing.Dict[str, TagInference], int]:
+    """
+    Converts in_path through an mmap straight into out_path, see Converter.convert_mapped
+    The template is written to a temporary file next to out_path which is moved into place,
+    unless out_path already holds the same bytes or the template has ambiguous tags
+    returns whether out_path was written, the ambiguous tags, tag inferences and size in bytes of in_path
+    """
+    os.makedirs(os.path.dirname(out_path) or os.curdir, exist_ok=True)
+    temp_path = "{}.{}.{}.tmp".format(out_path, os.getpid(), threading.get_ident())
+    try:
+        with open(temp_path, "wb") as out_file:
+            ambiguous_tags, tag_inferences, in_size = _convert_mapped_file(in_path, converter, out_file.write)
+        if ambiguous_tags or (os.path.isfile(out_path) and __files_equal(temp_path, out_path)):
+            os.remove(temp_path)
+            return False, ambiguous_tags, tag_inferences, in_size
+        if os.path.isfile(out_path):
+            os.chmod(temp_path, stat.S_IMODE(os.stat(out_path).st_mode))
+        os.replace(temp_path, out_path)
+    except BaseException:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+        raise
+    return True, ambiguous_tags, tag_inferences, in_size
+
+
+def _convert_file_or_mapped(
+    in_path: str,
+    out_path: str,
+    converter: Converter,
+    mmap_min_size: typing.Optional[int] = None,
+    profile: bool = False,
+) -> typing.Tuple[
+    typing.Union[str, bool, TemplateError],
+    typing.Set[str],
+    typing.Dict[str, TagInference],
+    int,
+    typing.Optional[typing.Dict[str, typing.Tuple[float, float]]],
+]:
+    """
+    like _convert_file, but templates of at least mmap_min_size bytes are converted with _convert_file_mapped
+    when the locale encoding is one of MMAP_ENCODINGS, and whether their out file was written takes the place
+    of the converted text
+    a template which can not be parsed has its TemplateError in place of the converted text, so that one bad
+    template does not stop the others
+    also returns the (wall, cpu) seconds of each phase when profile is set, a mapped template has only a convert phase
+    """
+    try:
+        if not _is_mapped(in_path, mmap_min_size):
+            if profile:
+                return _convert_file_profiled(in_path, converter)
+            return (*_convert_file(in_path, converter), None)
+        if not profile:
+            return (*_convert_file_mapped(in_path, out_path, converter), None)
+        converted_file, convert_time = _timed(_convert_file_mapped, in_path, out_path, converter)
+        return (*converted_file, {"convert": convert_time})
+    except TemplateError as error:
+        return error, set(), {}, 0, {} if profile else None
+
+
+def _read_file_profiled(in_path: str) -> typing.Tuple[str, int, typing.Dict[str, typing.Tuple[float, float]]]:
+    """
+    like _read_file, also returning phase times holding the read
+    """
+    (in_txt, in_size), read_time = _timed(_read_file, in_path)
+    return in_txt, in_size, {"read": read_time}
+
+
+def _convert_file_profiled(
+    in_path: str, converter: Converter
+) -> typing.Tuple[
+    str, typing.Set[str], typing.Dict[str, TagInference], int, typing.Dict[str, typing.Tuple[float, float]]
+]:
+    """
+    like _convert_file, also returning the (wall, cpu) seconds of each phase
+    """
+    in_txt, in_size, phase_times = _read_file_profiled(in_path)
+    return (*_convert_profiled(in_txt, converter, phase_times, in_path), in_size, phase_times)
+
+
+class _OutFolderCache:
+    """
+    Thread safe set of the output folders which are known to exist
+    """
+
+    def __init__(self):
+        self._out_folders = set()
+        self._lock = threading.Lock()
+
+    def make_folder(self, out_folder: str):
+        with self._lock:
+            if out_folder in self._out_folders:
+                return
+        # makes missing parent folders and is safe when another thread makes the folder first
+        os.makedirs(out_folder, exist_ok=True)
+        with self._lock:
+            self._out_folders.add(out_folder)
+
+
+def _encode_out_txt(out_txt: str, encoding: typing.Optional[str] = None) -> bytes:
+    """
+    the bytes that writing out_txt to a file opened with "w" would produce, encoded with the locale encoding by default
+    """
+    if os.linesep != "\n":
+        out_txt = out_txt.replace("\n", os.linesep)
+    return out_txt.encode(encoding or locale.getpreferredencoding(False))
+
+
+def _write_file(out_path: str, out_txt: str, out_folder_cache: _OutFolderCache) -> bool:
+    """
+    Writes out_txt to out_path unless the file already holds it, so that its mtime is kept
+    The file is written to a temporary file next to it and moved into place,
+    so readers never see a partly written file
+    Returns whether the file was written
+    """
+    out_bytes = _encode_out_txt(out_txt)
+    try:
+        out_stat = os.stat(out_path)
+    except FileNotFoundError:
+        out_stat = None
+    if out_stat is not None and out_stat.st_size == len(out_bytes):
+        with open(out_path, "rb") as file:
+            if file.read() == out_bytes:
+                return False
+
+    out_folder_cache.make_folder(os.path.dirname(out_path))
+    temp_path = "{}.{}.{}.tmp".format(out_path, os.getpid(), threading.get_ident())
+    # same permissions as open(out_path, "w") would give
+    temp_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(temp_fd, "wb") as file:
+            file.write(out_bytes)
+        if out_stat is not None:
+            os.chmod(temp_path, stat.S_IMODE(out_stat.st_mode))
+        os.replace(temp_path, out_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return True
+
+
+def __prefetch_files(
+    in_file_to_out_file_pairs: typing.Iterable[typing.Tuple[str, str]],
+    read_executor: ThreadPoolExecutor,
+    window: int,
+    read_file: typing.Callable = _read_file,
+) -> typing.Iterator[typing.Tuple[str, str, Future]]:
+    """
+    yields each pair with a future of read_file of its in file, keeping up to window reads in flight
+    """
+    pending_reads = collections.deque()
+    for in_path, out_path in in_file_to_out_file_pairs:
+        pending_reads.append((in_path, out_path, read_executor.submit(read_file, in_path)))
+        if len(pending_reads) >= window:
+            yield pending_reads.popleft()
+    yield from pending_reads
+
+
+def __convert_files(
+    in_file_to_out_file_pairs: typing.Iterable[typing.Tuple[str, str]],
+    converter: Converter,
+    jobs: int,
+    read_executor: typing.Optional[ThreadPoolExecutor] = None,
+    window: int = 1,
+    profile: bool = False,
+    mmap_min_size: typing.Optional[int] = None,
+) -> typing.Iterator[
+    typing.Tuple[
+        str,
+        str,
+        typing.Union[str, bool, TemplateError],
+        typing.Set[str],
+        typing.Dict[str, TagInference],
+        int,
+        typing.Optional[typing.Dict[str, typing.Tuple[float, float]]],
+    ]
+]:
+    """
+    yields the in path, out path, converted text, ambiguous tags, tag inferences, in file size and phase times of each file
+    in the order of the pairs, phase times are None unless profile is set
+    a template which can not be parsed has its TemplateError in place of the text
+    when jobs is more than 1, files are read and converted in that many worker processes
+    otherwise each file is converted as soon as its pair is produced,
+    with up to window files read ahead by read_executor when it is given
+    when mmap_min_size is set, files of at least that size are converted straight into their out file,
+    see _convert_file_or_mapped, and whether it was written is yielded in place of the text. They are not read ahead
+    """
+    if jobs == 1 and read_executor is not None and mmap_min_size is None:
+        read_file = _read_file_profiled if profile else _read_file
+        for in_path, out_path, read_future in __prefetch_files(
+            in_file_to_out_file_pairs, read_executor, window, read_file
+        ):
+            phase_times = None
+            try:
+                if profile:
+                    in_txt, in_size, phase_times = read_future.result()
+                    converted_file = _convert_profiled(in_txt, converter, phase_times, in_path)
+                else:
+                    in_txt, in_size = read_future.result()
+                    converted_file = converter.convert_with_inferences(in_txt, in_path)
+            except TemplateError as error:
+                converted_file = (error, set(), {})
+            yield (in_path, out_path, *converted_file, in_size, phase_times)
+        return
+    convert_file = functools.partial(_convert_file_or_mapped, mmap_min_size=mmap_min_size, profile=profile)
+    if jobs == 1:
+        for in_path, out_path in in_file_to_out_file_pairs:
+            yield (in_path, out_path, *convert_file(in_path, out_path, converter))
+        return
+    in_file_to_out_file_pairs = list(in_file_to_out_file_pairs)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        converted_files = executor.map(
+            convert_file,
+            [in_path for in_path, _ in in_file_to_out_file_pairs],
+            [out_path for _, out_path in in_file_to_out_file_pairs],
+            itertools.repeat(converter),
+            chunksize=max(1, len(in_file_to_out_file_pairs) // (jobs * 4)),
+        )
+        for (in_path, out_path), converted_file in zip(in_file_to_out_file_pairs, converted_files):
+            yield (in_path, out_path, *converted_file)
+
+
+def __finish_writes(
+    pending_writes: collections.deque, qty_to_keep: int, reporter: Reporter, summary: ConversionSummary
+):
+    while len(pending_writes) > qty_to_keep:
+        out_path, write_future = pending_writes.popleft()
+        # raises any error from the write
+        __report_write(out_path, write_future.result(), reporter, summary)
+
+
+def __report_write(out_path: str, written: bool, reporter: Reporter, summary: ConversionSummary):
+    if written:
+        summary.qty_written += 1
+    else:
+        summary.qty_unchanged += 1
+    reporter.file_written(out_path, written)
+
+
+def _create_files(
+    in_path_to_out_path: typing.Union[dict, typing.Iterable[typing.Tuple[str, str]]],
+    handlebars_tag_set: HandlebarTagSet,
+    whitespace_config: HandlebarsWhitespaceConfig,
+    jobs: int = 1,
+    io_threads: int = 0,
+    reporter: typing.Optional[Reporter] = None,
+    profiler: typing.Optional[Profiler] = None,
+    infer_threshold: typing.Optional[float] = None,
+    tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+    tag_set_overrides: typing.Sequence[typing.Tuple[typing.Sequence[str], HandlebarTagSet]] = (),
+    in_dir: str = "",
+    partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+    converter: typing.Optional[Converter] = None,
+    parse_cache: typing.Optional[ParseCache] = None,
+    mmap_min_size: typing.Optional[int] = None,
+    failed_in_paths: typing.Optional[typing.List[str]] = None,
+    known_tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+    partial_context_tags: typing.Optional[typing.Dict[str, typing.Optional[str]]] = None,
+) -> typing.Tuple[typing.List[str], typing.Set[str]]:
+    """
+    in_path_to_out_path: a dict or lazy iterable of (in path, out path) pairs
+    jobs: the number of processes to convert files in, 0 uses one per cpu
+    io_threads: when more than 0, upcoming files are read and converted files are written
+        in thread pools of this size so that conversion does not wait on the disk
+    reporter: receives progress and the final summary, a Reporter writing lines to stdout by default
+    profiler: when given, the read, tokenize, convert and write phases of every file are recorded in it
+    infer_threshold: when set, sections of tags in no tag set are written with their type inferred from
+        their bodies if its confidence is at least this, see Converter
+    tag_inferences: when given, the inferred type of tags in no tag set is added to it, merged across files
+    tag_set_overrides: (globs, tag set) pairs matched against in paths relative to in_dir, see Converter
+    partial_usages: what the body of each partial uses by name for inference, see _get_partial_usages
+    known_tag_inferences: the inferences of tags merged across all templates, see _infer_tag_types
+    partial_context_tags: what {{.}} refers to at the top of each partial, see _get_partial_context_tags
+    converter: when given it is used so that its caches stay warm across calls,
+        instead of a converter of handlebars_tag_set, whitespace_config and the options above
+    parse_cache: when given, templates are parsed through it so that unchanged ones are not parsed again
+    mmap_min_size: when set, templates of at least this many bytes are converted from an mmap straight into
+        their out file without decoding the text between tags, see _convert_file_mapped
+    failed_in_paths: when given, the in paths of templates which can not be parsed are added to it,
+        they are reported and skipped while the other templates are converted
+    files are written and reported in the order of in_path_to_out_path for any jobs and io_threads value
+    """
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    if reporter is None:
+        reporter = Reporter()
+    qty_files = None
+    if isinstance(in_path_to_out_path, dict):
+        qty_files = len(in_path_to_out_path)
+        in_path_to_out_path = in_path_to_out_path.items()
+    out_folder_cache = _OutFolderCache()
+    ambiguous_tags = set()
+    if tag_inferences is None:
+        tag_inferences = {}
+    input_files_used_to_make_output_files = []
+    if converter is None:
+        converter = Converter(
+            handlebars_tag_set,
+            whitespace_config,
+            infer_threshold=infer_threshold,
+            tag_set_overrides=tag_set_overrides,
+            in_dir=in_dir,
+            partial_usages=partial_usages,
+            parse_cache=parse_cache,
+            known_tag_inferences=known_tag_inferences,
+            partial_context_tags=partial_context_tags,
+        )
+    summary = ConversionSummary()
+    start_time = time.perf_counter()
+
+    def write_file(in_path: str, out_path: str, out_txt: str) -> bool:
+        if profiler is None:
+            return _write_file(out_path, out_txt, out_folder_cache)
+        written, write_time = _timed(_write_file, out_path, out_txt, out_folder_cache)
+        profiler.record("write", *write_time, in_path=in_path)
+        return written
+
+    with contextlib.ExitStack() as exit_stack:
+        exit_stack.callback(reporter.flush)
+        read_executor = write_executor = None
+        # files read ahead and writes in flight, which bounds how many file texts are held in memory
+        window = max(1, io_threads * 4)
+        if io_threads > 0:
+            read_executor = exit_stack.enter_context(ThreadPoolExecutor(max_workers=io_threads))
+            write_executor = exit_stack.enter_context(ThreadPoolExecutor(max_workers=io_threads))
+        pending_writes = collections.deque()
+        converted_files = __convert_files(
+            in_path_to_out_path,
+            converter,
+            jobs,
+            read_executor,
+            window,
+            profile=profiler is not None,
+            mmap_min_size=mmap_min_size,
+        )
+        for i, (
+            in_path, out_path, out_txt, file_ambiguous_tags, file_tag_inferences, in_size, phase_times
+        ) in enumerate(converted_files):
+            for tag, tag_inference in file_tag_inferences.items():
+                _merge_tag_inference(tag_inferences, tag, tag_inference)
+            if profiler is not None:
+                profiler.record_file(in_path, in_size, phase_times)
+            summary.qty_files += 1
+            summary.in_bytes += in_size
+            reporter.file_read(i + 1, qty_files, in_path)
+            if isinstance(out_txt, TemplateError):
+                summary.qty_failed += 1
+                reporter.file_failed(in_path, str(out_txt))
+                if failed_in_paths is not None:
+                    failed_in_paths.append(in_path)
+                continue
+            if file_ambiguous_tags:
+                ambiguous_tags.update(file_ambiguous_tags)
+                summary.qty_skipped += 1
+                reporter.file_skipped(out_path, file_ambiguous_tags)
+                continue
+
+            input_files_used_to_make_output_files.append(in_path)
+            if isinstance(out_txt, bool):
+                # converted through an mmap straight into out_path, earlier writes are reported first
+                __finish_writes(pending_writes, 0, reporter, summary)
+                __report_write(out_path, out_txt, reporter, summary)
+                continue
+            if write_executor is None:
+                __report_write(out_path, write_file(in_path, out_path, out_txt), reporter, summary)
+                continue
+            pending_writes.append((out_path, write_executor.submit(write_file, in_path, out_path, out_txt)))
+            __finish_writes(pending_writes, window, reporter, summary)
+        __finish_writes(pending_writes, 0, reporter, summary)
+    summary.qty_ambiguous_tags = len(ambiguous_tags)
+    summary.seconds = time.perf_counter() - start_time
+    reporter.finish(summary)
+    return input_files_used_to_make_output_files, ambiguous_tags
+
+
+def convert_dir(
+    in_dir: str,
+    out_dir: str,
+    handlebars_tag_set: HandlebarTagSet,
+    whitespace_config: HandlebarsWhitespaceConfig,
+    recursive: bool = True,
+    jobs: int = 1,
+    reporter: typing.Optional[Reporter] = None,
+    profiler: typing.Optional[Profiler] = None,
+) -> typing.Set[str]:
+    """
+    Converts the mustache templates in in_dir to handlebars templates in out_dir like the command line does
+    When profiler is given, the discover, partials and the phases of every template are recorded in it, see Profiler
+    Returns the ambiguous tags, templates with them are not written
+    """
+    in_file_to_out_file_pairs = _iter_in_file_to_out_file_pairs(in_dir, out_dir, recursive)
+    if profiler is not None:
+        in_file_to_out_file_pairs = profiler.measure_iterator("discover", in_file_to_out_file_pairs)
+    in_path_to_out_path = dict(in_file_to_out_file_pairs)
+    converter = Converter(handlebars_tag_set, whitespace_config, in_dir=in_dir)
+    with profiler.measure("partials") if profiler is not None else contextlib.nullcontext():
+        partial_graph = _build_partial_graph(in_dir, in_path_to_out_path)
+        converter.partial_context_tags = _get_partial_context_tags(
+            in_dir, partial_graph, _get_partial_includes(partial_graph), converter
+        )
+    return _create_files(
+        in_path_to_out_path,
+        handlebars_tag_set,
+        whitespace_config,
+        jobs=jobs,
+        reporter=reporter,
+        profiler=profiler,
+        converter=converter,
+    )[1]
+
+
+def _clean_up_files(files_to_delete: typing.List[str], reporter: typing.Optional[Reporter] = None):
+    if reporter is None:
+        reporter = Reporter()
+    if not files_to_delete:
+        reporter.message("Original templates have not been deleted")
+    for i, path in enumerate(files_to_delete):
+        reporter.file_removed(i + 1, len(files_to_delete), path)
+        os.remove(path)
+    reporter.flush()
+
+
+@dataclass
+class FileCheck:
+    check_status: CheckStatus
+    ambiguous_tags: typing.Set[str] = field(default_factory=set)
+    # why the template can not be parsed, for CheckStatus.INVALID
+    error: str = ""
+
+
+def _check_file(
+    in_path: str, out_path: str, converter: Converter, mmap_min_size: typing.Optional[int] = None
+) -> typing.Tuple[FileCheck, typing.Dict[str, TagInference]]:
+    """
+    Converts in_path in memory and compares the hash of what would be written with that of out_path, writing nothing
+    returns the FileCheck of out_path and the tag inferences of in_path
+    """
+    out_hash = hashlib.sha256()
+    try:
+        if _is_mapped(in_path, mmap_min_size):
+            ambiguous_tags, tag_inferences, _ = _convert_mapped_file(in_path, converter, out_hash.update)
+        else:
+            out_txt, ambiguous_tags, tag_inferences, _ = _convert_file(in_path, converter)
+            out_hash.update(_encode_out_txt(out_txt))
+    except TemplateError as error:
+        return FileCheck(CheckStatus.INVALID, error=str(error)), {}
+    if ambiguous_tags:
+        return FileCheck(CheckStatus.AMBIGUOUS, ambiguous_tags), tag_inferences
+    existing_out_hash = _hash_file(out_path)
+    if existing_out_hash is None:
+        return FileCheck(CheckStatus.MISSING), tag_inferences
+    if existing_out_hash != out_hash.hexdigest():
+        return FileCheck(CheckStatus.CHANGED), tag_inferences
+    return FileCheck(CheckStatus.UNCHANGED), tag_inferences
+
+
+def _iter_stale_out_files(
+    in_dir: str,
+    out_dir: str,
+    recursive: bool,
+    out_paths: typing.Iterable[str],
+    include_globs: typing.Iterable[str] = (),
+    exclude_globs: typing.Iterable[str] = (),
+    follow_symlinks: bool = True,
+) -> typing.Iterator[str]:
+    """
+    Yields the out files in out_dir which are not in out_paths and whose template no longer exists
+    When out_dir has a manifest those are the out files it lists, as only they are known to be written by a run,
+    otherwise the handlebars files found like templates are, with the same globs and in_dir/.m2hignore,
+    so that handlebars files which are not written from templates, like vendored ones, are never stale
+    Templates left out by include or exclude globs still exist, so their out files are not stale
+    """
+    out_paths = set(out_paths)
+    manifest_files = _load_manifest(out_dir)
+    if manifest_files:
+        for in_rel_path, entry in sorted(manifest_files.items()):
+            out_path = os.path.join(out_dir, entry["out_path"])
+            if out_path in out_paths or os.path.isfile(os.path.join(in_dir, in_rel_path)):
+                continue
+            if os.path.isfile(out_path):
+                yield out_path
+        return
+    for out_path, in_rel_path in _iter_mustache_files(
+        out_dir,
+        recursive,
+        include_globs,
+        exclude_globs,
+        follow_symlinks,
+        out_extension=HANDLEBARS_EXTENSION,
+        ignore_file_dir=in_dir,
+    ):
+        if out_path not in out_paths and not os.path.isfile(os.path.join(in_dir, *in_rel_path.split("/"))):
+            yield out_path
+
+
+def _check_files(
+    in_dir: str,
+    out_dir: str,
+    recursive: bool,
+    in_path_to_out_path: typing.Union[dict, typing.Iterable[typing.Tuple[str, str]]],
+    converter: Converter,
+    jobs: int = 0,
+    mmap_min_size: typing.Optional[int] = None,
+    tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+    include_globs: typing.Iterable[str] = (),
+    exclude_globs: typing.Iterable[str] = (),
+    follow_symlinks: bool = True,
+) -> typing.Dict[str, FileCheck]:
+    """
+    Checks that the out files are what converting their templates would write, without writing or removing files
+    Templates are converted in jobs worker processes, 0 uses one per cpu, and only hashes are compared
+    returns the FileCheck of each out path in the order of in_path_to_out_path,
+    followed by the stale out files, which are found with the globs and follow_symlinks, see _iter_stale_out_files
+    tag_inferences: when given, the inferred type of tags in no tag set is added to it, merged across files
+    """
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    if isinstance(in_path_to_out_path, dict):
+        in_path_to_out_path = in_path_to_out_path.items()
+    in_file_to_out_file_pairs = list(in_path_to_out_path)
+    in_paths = [in_path for in_path, _ in in_file_to_out_file_pairs]
+    out_paths = [out_path for _, out_path in in_file_to_out_file_pairs]
+    check_file = functools.partial(_check_file, mmap_min_size=mmap_min_size)
+    with contextlib.ExitStack() as exit_stack:
+        if jobs == 1:
+            checked_files = map(check_file, in_paths, out_paths, itertools.repeat(converter))
+        else:
+            executor = exit_stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            checked_files = executor.map(
+                check_file,
+                in_paths,
+                out_paths,
+                itertools.repeat(converter),
+                chunksize=max(1, len(in_paths) // (jobs * 4)),
+            )
+        out_path_to_check = {}
+        for out_path, (file_check, file_tag_inferences) in zip(out_paths, checked_files):
+            if tag_inferences is not None:
+                for tag, tag_inference in file_tag_inferences.items():
+                    _merge_tag_inference(tag_inferences, tag, tag_inference)
+            out_path_to_check[out_path] = file_check
+    for out_path in _iter_stale_out_files(
+        in_dir, out_dir, recursive, out_paths, include_globs, exclude_globs, follow_symlinks
+    ):
+        out_path_to_check[out_path] = FileCheck(CheckStatus.STALE)
+    return out_path_to_check
+
+
+def _iter_reachable(
+    edges: typing.Dict[str, typing.List[str]], paths: typing.Iterable[str]
+) -> typing.Iterator[str]:
+    """
+    yields the paths reachable from paths through edges, not including paths themselves
+    """
+    seen = set(paths)
+    paths_to_visit = list(seen)
+    while paths_to_visit:
+        for next_path in edges.get(paths_to_visit.pop(), []):
+            if next_path not in seen:
+                seen.add(next_path)
+                paths_to_visit.append(next_path)
+                yield next_path
+
+
+def _scan_partial_names(in_txt: str) -> typing.List[str]:
+    """
+    the names of the partials in_txt includes like {{> partial_name}}, in order without repeats
+    partials after a set delimiter tag are not found
+    """
+    return list(dict.fromkeys(name.strip() for name in MUSTACHE_PARTIAL_REGEX.findall(in_txt)))
+
+
+@dataclass
+class PartialGraph:
+    """
+    which templates include which partials, by template path
+    a partial name is resolved to a template relative to in_dir and then to the folder of the including template
+    """
+    # template path -> paths of the partials it includes
+    partials: typing.Dict[str, typing.List[str]] = field(default_factory=dict)
+    # partial path -> paths of the templates including it
+    dependents: typing.Dict[str, typing.List[str]] = field(default_factory=dict)
+    # partial name -> path, the first resolution of a name is kept
+    partial_name_to_path: typing.Dict[str, str] = field(default_factory=dict)
+    # template path -> names of partials it includes which are not templates in in_dir
+    unresolved: typing.Dict[str, typing.List[str]] = field(default_factory=dict)
+
+    def iter_dependents(self, paths: typing.Iterable[str]) -> typing.Iterator[str]:
+        """
+        yields the templates including any of paths, directly or through other partials, once each
+        """
+        return _iter_reachable(self.dependents, paths)
+
+    def iter_partials(self, path: str) -> typing.Iterator[str]:
+        """
+        yields the partials path includes, directly or through other partials, once each
+        """
+        return _iter_reachable(self.partials, [path])
+
+    def topological_order(self) -> typing.Tuple[typing.List[str], typing.List[typing.List[str]]]:
+        """
+        Returns every template with partials before the templates including them, and the cycles of
+        partials including each other. Templates in a cycle are ordered as if the include closing it was not there
+        """
+        order = []
+        cycles = []
+        # 1 while a template's partials are being visited, 2 once it is in order
+        states = {}
+        for root in self.partials:
+            if root in states:
                 continue
-            substr = in_txt[i : i + len(tag_with_braces)]
-
-            if substr == tag_with_braces:
-                tag = tag_without_braces[1:]
-                tag = __mustache_to_handlebars_tag_element(tag)
-                handlebars_tag_type = __get_handlebars_tag_type(
-                    tag,
-                    tag_without_braces[0],
-                    handlebars_tag_set,
-                )
+            states[root] = 1
+            stack = [(root, iter(self.partials[root]))]
+            while stack:
+                path, partial_paths = stack[-1]
+                partial_path = next(partial_paths, None)
+                if partial_path is None:
+                    stack.pop()
+                    states[path] = 2
+                    order.append(path)
+                elif states.get(partial_path) == 1:
+                    stack_paths = [stack_path for stack_path, _ in stack]
+                    cycles.append(stack_paths[stack_paths.index(partial_path):])
+                elif partial_path not in states:
+                    states[partial_path] = 1
+                    stack.append((partial_path, iter(self.partials.get(partial_path, []))))
+        return order, cycles
 
-                if handlebars_tag_type in {
-                    HandlebarsTagType.IF,
-                    HandlebarsTagType.EACH,
-                    HandlebarsTagType.WITH,
-                    HandlebarsTagType.UNLESS,
-                }:
-                    new_tag = (
-                        TAG_OPEN + handlebars_tag_type.value[0] + " " + tag + TAG_CLOSE
-                    )
-                    closures.append(handlebars_tag_type.value[1])
-                elif handlebars_tag_type is None:
-                    ambiguous_tags.add(tag)
-                    new_tag = "{{#ifOrEachOrWith " + tag + TAG_CLOSE
-                    closures.append("/ifOrEachOrWith")
-                elif handlebars_tag_type is HandlebarsTagType.CLOSE:
-                    new_tag = TAG_OPEN + closures.pop() + TAG_CLOSE
-
-                replacement_index_to_from_to_pair[i] = (tag_with_braces, new_tag)
-                break
 
-    out_txt = str(in_txt)
-    for i, (original_tag, new_tag) in reversed(
-        replacement_index_to_from_to_pair.items()
+def __resolve_partial(
+    name: str, in_path: str, in_dir: str, norm_path_to_path: typing.Dict[str, str]
+) -> typing.Optional[str]:
+    file_name = name if name.endswith("." + MUSTACHE_EXTENSION) else name + "." + MUSTACHE_EXTENSION
+    for folder in (in_dir, os.path.dirname(in_path)):
+        path = norm_path_to_path.get(os.path.normpath(os.path.join(folder, *file_name.split("/"))))
+        if path is not None:
+            return path
+    return None
+
+
+def __read_partial_names(in_path: str) -> typing.List[str]:
+    """
+    the partials in_path includes, none when it can not be read, which is reported when it is converted
+    """
+    try:
+        return _scan_partial_names(_read_file(in_path)[0])
+    except (OSError, TemplateError):
+        return []
+
+
+def _build_partial_graph(in_dir: str, in_paths: typing.Iterable[str]) -> PartialGraph:
+    """
+    reads every template in in_paths and finds the partials it includes
+    """
+    return _link_partial_graph(
+        in_dir, {in_path: __read_partial_names(in_path) for in_path in in_paths}
+    )
+
+
+def _link_partial_graph(in_dir: str, in_path_to_partial_names: typing.Dict[str, typing.List[str]]) -> PartialGraph:
+    """
+    the graph of templates including the partials named in in_path_to_partial_names
+    """
+    norm_path_to_path = {os.path.normpath(in_path): in_path for in_path in in_path_to_partial_names}
+    graph = PartialGraph(dependents={in_path: [] for in_path in in_path_to_partial_names})
+    for in_path, partial_names in in_path_to_partial_names.items():
+        partial_paths = []
+        for name in partial_names:
+            partial_path = __resolve_partial(name, in_path, in_dir, norm_path_to_path)
+            if partial_path is None:
+                graph.unresolved.setdefault(in_path, []).append(name)
+                continue
+            graph.partial_name_to_path.setdefault(name, partial_path)
+            if partial_path not in partial_paths:
+                partial_paths.append(partial_path)
+                graph.dependents[partial_path].append(in_path)
+        graph.partials[in_path] = partial_paths
+    return graph
+
+
+def _get_partials_hash(
+    in_dir: str, partial_graph: PartialGraph, in_path: str, in_path_to_hash: typing.Dict[str, typing.Optional[str]]
+) -> str:
+    """
+    the hash of the paths and in_path_to_hash of the partials in_path includes, directly or through other partials
+    """
+    return _hash_bytes(
+        json.dumps(
+            sorted(
+                (os.path.relpath(partial_path, in_dir), in_path_to_hash.get(partial_path))
+                for partial_path in partial_graph.iter_partials(in_path)
+            )
+        ).encode()
+    )
+
+
+# the name of a partial a template includes and its enclosing sections as (tag, inverted), outermost first
+_PartialInclude = typing.Tuple[str, typing.Tuple[typing.Tuple[str, bool], ...]]
+
+
+class _TemplateAnalyses:
+    """
+    What each template uses as a partial, the usages of its sections and the partials it includes,
+    see _get_partial_usages, _build_tag_index and _get_partial_includes, kept by path relative to in_dir in analyses,
+    which can be json encoded into a manifest
+    An analysis is reused from old_analyses while the fingerprint of its template is unchanged, that is
+    in_path_to_hash of the template and of every partial it includes, since what those use is part of its usages
+    in_path_to_hash can hold any value which changes with a template, like its modification time
+    """
+
+    def __init__(
+        self,
+        in_dir: str,
+        partial_graph: PartialGraph,
+        in_path_to_hash: typing.Dict[str, typing.Optional[str]],
+        old_analyses: typing.Optional[typing.Dict[str, dict]] = None,
     ):
-        out_txt = out_txt[0:i] + new_tag + out_txt[i + len(original_tag) :]
+        self.in_dir = in_dir
+        self.partial_graph = partial_graph
+        self.in_path_to_hash = in_path_to_hash
+        self.old_analyses = old_analyses or {}
+        self.analyses = {}
 
-    out_txt = _add_whitespace_handling(out_txt, whitespace_config)
-    return out_txt, ambiguous_tags
+    def _get_analysis(self, in_path: str) -> dict:
+        rel_path = os.path.relpath(in_path, self.in_dir)
+        analysis = self.analyses.get(rel_path)
+        if analysis is None:
+            fingerprint = _hash_bytes(
+                json.dumps(
+                    [
+                        self.in_path_to_hash.get(in_path),
+                        _get_partials_hash(self.in_dir, self.partial_graph, in_path, self.in_path_to_hash),
+                    ]
+                ).encode()
+            )
+            analysis = self.old_analyses.get(rel_path)
+            if analysis is None or analysis.get("fingerprint") != fingerprint:
+                analysis = {"fingerprint": fingerprint}
+            self.analyses[rel_path] = analysis
+        return analysis
 
+    def get_partial_usage(self, in_path: str) -> typing.Optional[_BodyUsage]:
+        partial_usage = self._get_analysis(in_path).get("partial_usage")
+        return None if partial_usage is None else _BodyUsage(*partial_usage)
 
-def _create_files(
+    def set_partial_usage(self, in_path: str, partial_usage: _BodyUsage):
+        self._get_analysis(in_path)["partial_usage"] = list(dataclasses.astuple(partial_usage))
+
+    def get_section_usages(self, in_path: str) -> typing.Optional[typing.List[typing.Tuple[str, SectionUsage]]]:
+        section_usages = self._get_analysis(in_path).get("section_usages")
+        if section_usages is None:
+            return None
+        return [
+            (tag, SectionUsage(in_path, line, tuple(context), *usage))
+            for tag, line, context, *usage in section_usages
+        ]
+
+    def set_section_usages(self, in_path: str, tags_and_usages: typing.List[typing.Tuple[str, SectionUsage]]):
+        self._get_analysis(in_path)["section_usages"] = [
+            [tag, *dataclasses.astuple(usage)[1:]] for tag, usage in tags_and_usages
+        ]
+
+    def get_includes(self, in_path: str) -> typing.Optional[typing.List[_PartialInclude]]:
+        includes = self._get_analysis(in_path).get("includes")
+        if includes is None:
+            return None
+        return [(name, tuple((tag, inverted) for tag, inverted in sections)) for name, sections in includes]
+
+    def set_includes(self, in_path: str, includes: typing.List[_PartialInclude]):
+        self._get_analysis(in_path)["includes"] = includes
+
+
+def _get_partial_usage(
+    in_txt: str, partial_usages: typing.Dict[str, _BodyUsage], parse_cache: typing.Optional[ParseCache] = None
+) -> _BodyUsage:
+    """
+    what the body of a partial uses outside of its sections, including the partials it includes
+    """
+    return _get_body_usage(_parse_with_cache(in_txt, parse_cache).children, partial_usages=partial_usages)
+
+
+def _get_partial_usages(
+    graph: PartialGraph,
+    errors: typing.Optional[typing.List[str]] = None,
+    parse_cache: typing.Optional[ParseCache] = None,
+    template_analyses: typing.Optional[_TemplateAnalyses] = None,
+) -> typing.Dict[str, _BodyUsage]:
+    """
+    What the body of each partial in graph uses by partial name, found in topological order
+    so that partials including partials count what those use
+    Partials in a cycle do not count what the partial closing the cycle uses
+    Partials which can not be read or parsed are left out, with a message naming them added to errors when it is given
+    Partials are parsed with parse_cache when given, and those with an analysis in template_analyses are not read
+    """
+    path_to_names = collections.defaultdict(list)
+    for name, path in graph.partial_name_to_path.items():
+        path_to_names[path].append(name)
+    partial_usages = {}
+    order, _ = graph.topological_order()
+    for path in order:
+        if path not in path_to_names:
+            continue
+        partial_usage = template_analyses.get_partial_usage(path) if template_analyses is not None else None
+        if partial_usage is None:
+            try:
+                in_txt, _ = _read_file(path)
+                partial_usage = _get_partial_usage(in_txt, partial_usages, parse_cache)
+            except (OSError, TemplateError) as error:
+                if errors is not None:
+                    errors.append("Could not find what partial {} uses: {}".format(path, error))
+                continue
+            if template_analyses is not None:
+                template_analyses.set_partial_usage(path, partial_usage)
+        for name in path_to_names[path]:
+            partial_usages[name] = partial_usage
+    return partial_usages
+
+
+def _get_partial_includes(
+    graph: PartialGraph,
+    parse_cache: typing.Optional[ParseCache] = None,
+    template_analyses: typing.Optional[_TemplateAnalyses] = None,
+) -> typing.Dict[str, typing.List[_PartialInclude]]:
+    """
+    The partials each template in graph which includes partials includes, with their enclosing sections, by path
+    Templates which can not be read or parsed are left out, they are reported when they are converted
+    Templates are parsed with parse_cache when given, and those with an analysis in template_analyses are not read
+    """
+    in_path_to_includes = {}
+    for in_path, partial_paths in graph.partials.items():
+        if not partial_paths:
+            continue
+        includes = template_analyses.get_includes(in_path) if template_analyses is not None else None
+        if includes is None:
+            analyzed_file = _analyze_file(in_path, parse_cache=parse_cache)
+            if isinstance(analyzed_file, TemplateError):
+                continue
+            _, includes = analyzed_file
+            if template_analyses is not None:
+                template_analyses.set_includes(in_path, includes)
+        in_path_to_includes[in_path] = includes
+    return in_path_to_includes
+
+
+def _get_partial_context_tags(
+    in_dir: str,
+    graph: PartialGraph,
+    in_path_to_includes: typing.Dict[str, typing.List[_PartialInclude]],
+    converter: Converter,
+) -> typing.Dict[str, typing.Optional[str]]:
+    """
+    What {{.}} refers to outside of sections in each partial in graph which is included, by path, for Converter
+    partial_context_tags. That is what it refers to where the partial is included, with the section types known to
+    converter, see _get_section_context_tag, so this outside of sections or in each and with sections and the tag of
+    an if section in one. It is none when the includes of a partial disagree or are in sections of unknown type
+    Templates are visited before the partials they include, includes closing a cycle of partials are not counted
+    """
+    norm_path_to_path = {os.path.normpath(in_path): in_path for in_path in graph.partials}
+    partial_path_to_include_context_tags = collections.defaultdict(set)
+    partial_context_tags = {}
+    visited_in_paths = set()
+    order, _ = graph.topological_order()
+    for in_path in reversed(order):
+        visited_in_paths.add(in_path)
+        context_tag = HANDLEBARS_CONTEXT_TAG
+        if in_path in partial_path_to_include_context_tags:
+            include_context_tags = partial_path_to_include_context_tags.pop(in_path)
+            context_tag = include_context_tags.pop() if len(include_context_tags) == 1 else None
+            partial_context_tags[in_path] = context_tag
+        for name, sections in in_path_to_includes.get(in_path, []):
+            partial_path = __resolve_partial(name, in_path, in_dir, norm_path_to_path)
+            if partial_path is None or partial_path in visited_in_paths:
+                continue
+            include_context_tag = context_tag
+            for tag, inverted in sections:
+                include_context_tag = _get_section_context_tag(
+                    converter._get_handlebars_tag_type(tag, inverted, in_path), tag, include_context_tag
+                )
+            # {{.}} is kept in sections of unknown type, which does not say what it refers to
+            if include_context_tag == MUSTACHE_CONTEXT_TAG:
+                include_context_tag = None
+            partial_path_to_include_context_tags[partial_path].add(include_context_tag)
+    return partial_context_tags
+
+
+def _hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hash_file(path: str) -> typing.Optional[str]:
+    try:
+        with open(path, "rb") as file:
+            return _hash_bytes(file.read())
+    except FileNotFoundError:
+        return None
+
+
+def _get_config_hash(
+    handlebars_tag_set: HandlebarTagSet,
+    whitespace_config: HandlebarsWhitespaceConfig,
+    infer_threshold: typing.Optional[float] = None,
+    tag_set_overrides: typing.Sequence[typing.Tuple[typing.Sequence[str], HandlebarTagSet]] = (),
+    known_tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+) -> str:
+    def tag_set_to_dict(tag_set: HandlebarTagSet) -> dict:
+        return {
+            "if_tags": sorted(tag_set.if_tags),
+            "each_tags": sorted(tag_set.each_tags),
+            "with_tags": sorted(tag_set.with_tags),
+        }
+    config = {
+        **tag_set_to_dict(handlebars_tag_set),
+        "whitespace_config": dataclasses.asdict(whitespace_config),
+    }
+    if infer_threshold is not None:
+        config["infer_threshold"] = infer_threshold
+    if tag_set_overrides:
+        config["tag_set_overrides"] = [
+            [list(globs), tag_set_to_dict(tag_set)] for globs, tag_set in tag_set_overrides
+        ]
+    if known_tag_inferences and infer_threshold is not None:
+        # only whether and as what each tag is applied changes the output
+        config["known_tag_types"] = {
+            tag: tag_inference.handlebars_tag_type.name if tag_inference.confidence >= infer_threshold else None
+            for tag, tag_inference in known_tag_inferences.items()
+        }
+    return _hash_bytes(json.dumps(config, sort_keys=True).encode())
+
+
+def _load_manifest(out_dir: str, key: str = "files") -> typing.Dict[str, dict]:
+    """
+    returns manifest entries keyed by input path relative to in_dir, the out files or with key analyses
+    the template analyses, see _TemplateAnalyses
+    a missing manifest or one written by another MANIFEST_VERSION has no entries
+    """
+    try:
+        with open(os.path.join(out_dir, MANIFEST_FILE_NAME)) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get(key, {})
+
+
+def _write_manifest(
+    out_dir: str, manifest_files: typing.Dict[str, dict], analyses: typing.Optional[typing.Dict[str, dict]] = None
+):
+    manifest = {"version": MANIFEST_VERSION, "files": manifest_files}
+    if analyses:
+        manifest["analyses"] = analyses
+    with open(os.path.join(out_dir, MANIFEST_FILE_NAME), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+
+def _create_files_incremental(
+    in_dir: str,
+    out_dir: str,
     in_path_to_out_path: dict,
     handlebars_tag_set: HandlebarTagSet,
     whitespace_config: HandlebarsWhitespaceConfig,
+    jobs: int = 1,
+    io_threads: int = 0,
+    reporter: typing.Optional[Reporter] = None,
+    profiler: typing.Optional[Profiler] = None,
+    infer_threshold: typing.Optional[float] = None,
+    tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+    tag_set_overrides: typing.Sequence[typing.Tuple[typing.Sequence[str], HandlebarTagSet]] = (),
+    partial_graph: typing.Optional[PartialGraph] = None,
+    parse_cache: typing.Optional[ParseCache] = None,
+    mmap_min_size: typing.Optional[int] = None,
+    failed_in_paths: typing.Optional[typing.List[str]] = None,
+    partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+    known_tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+    template_analyses: typing.Optional[_TemplateAnalyses] = None,
+    partial_context_tags: typing.Optional[typing.Dict[str, typing.Optional[str]]] = None,
 ) -> typing.Tuple[typing.List[str], typing.Set[str]]:
-    existing_out_folders = set()
-    ambiguous_tags = set()
-    input_files_used_to_make_output_files = []
-    for i, (in_path, out_path) in enumerate(in_path_to_out_path.items()):
-        print(
-            "Reading file {} out of {}, path={}".format(
-                i + 1, len(in_path_to_out_path), in_path
+    """
+    Like _create_files but only converts inputs which are new or changed since the last run
+    An input is unchanged if its hash, the config hash and its output hash match the manifest in out_dir
+    When inference is on and partial_graph is given, the hashes of the partials an input includes must match too,
+    because what they use decides how its sections are inferred, so a changed partial only reconverts its dependents
+    partial_usages are found from partial_graph unless given. known_tag_inferences are part of the config hash,
+    so a tag whose merged inference changes reconverts every input. When partial_context_tags is given what {{.}}
+    refers to at the top of an input must match too, so a partial is reconverted when it is included elsewhere
+    The analyses of template_analyses are written to the manifest so that the next run only analyzes changed
+    inputs, the hashes of inputs are taken from it when given
+    Outputs of inputs which no longer exist are deleted
+    """
+    if reporter is None:
+        reporter = Reporter()
+    manifest_files = _load_manifest(out_dir)
+    config_hash = _get_config_hash(
+        handlebars_tag_set, whitespace_config, infer_threshold, tag_set_overrides, known_tag_inferences
+    )
+    in_path_to_entry = {}
+    changed_in_path_to_out_path = {}
+    unchanged_in_paths = []
+    manifest_measure = profiler.measure("manifest") if profiler is not None else contextlib.nullcontext()
+    with manifest_measure:
+        if template_analyses is not None:
+            in_path_to_hash = template_analyses.in_path_to_hash
+        else:
+            in_path_to_hash = {in_path: _hash_file(in_path) for in_path in in_path_to_out_path}
+        if infer_threshold is None:
+            partial_graph = partial_usages = None
+        partial_errors = []
+        if partial_graph is not None and partial_usages is None:
+            partial_usages = _get_partial_usages(partial_graph, partial_errors, parse_cache, template_analyses)
+        for in_path, out_path in in_path_to_out_path.items():
+            entry = {
+                "in_hash": in_path_to_hash[in_path],
+                "config_hash": config_hash,
+                "out_path": os.path.relpath(out_path, out_dir),
+            }
+            if partial_graph is not None:
+                entry["partials_hash"] = _get_partials_hash(in_dir, partial_graph, in_path, in_path_to_hash)
+            if partial_context_tags is not None:
+                entry["context_tag"] = partial_context_tags.get(in_path, HANDLEBARS_CONTEXT_TAG)
+            in_path_to_entry[in_path] = entry
+            old_entry = manifest_files.get(os.path.relpath(in_path, in_dir))
+            if (
+                old_entry is not None
+                and {key: old_entry.get(key) for key in entry} == entry
+                and _hash_file(out_path) == old_entry["out_hash"]
+            ):
+                unchanged_in_paths.append(in_path)
+                continue
+            changed_in_path_to_out_path[in_path] = out_path
+    for message in partial_errors:
+        reporter.message(message)
+    reporter.message(
+        "{} files are unchanged since the last run, converting {} files".format(
+            len(unchanged_in_paths), len(changed_in_path_to_out_path)
+        )
+    )
+
+    input_files_used_to_make_output_files, ambiguous_tags = _create_files(
+        changed_in_path_to_out_path,
+        handlebars_tag_set,
+        whitespace_config,
+        jobs=jobs,
+        io_threads=io_threads,
+        reporter=reporter,
+        profiler=profiler,
+        infer_threshold=infer_threshold,
+        tag_inferences=tag_inferences,
+        tag_set_overrides=tag_set_overrides,
+        in_dir=in_dir,
+        partial_usages=partial_usages,
+        parse_cache=parse_cache,
+        mmap_min_size=mmap_min_size,
+        failed_in_paths=failed_in_paths,
+        known_tag_inferences=known_tag_inferences,
+        partial_context_tags=partial_context_tags,
+    )
+
+    in_rel_paths = {os.path.relpath(in_path, in_dir) for in_path in in_path_to_out_path}
+    for in_rel_path, old_entry in manifest_files.items():
+        if in_rel_path in in_rel_paths:
+            continue
+        out_path = os.path.join(out_dir, old_entry["out_path"])
+        if os.path.isfile(out_path):
+            os.remove(out_path)
+            reporter.message("Removed file {} because its input {} was deleted".format(out_path, in_rel_path))
+    reporter.flush()
+
+    new_manifest_files = {}
+    for in_path in unchanged_in_paths:
+        in_rel_path = os.path.relpath(in_path, in_dir)
+        new_manifest_files[in_rel_path] = manifest_files[in_rel_path]
+    for in_path in input_files_used_to_make_output_files:
+        entry = in_path_to_entry[in_path]
+        entry["out_hash"] = _hash_file(in_path_to_out_path[in_path])
+        new_manifest_files[os.path.relpath(in_path, in_dir)] = entry
+    os.makedirs(out_dir, exist_ok=True)
+    _write_manifest(out_dir, new_manifest_files, template_analyses.analyses if template_analyses is not None else None)
+    return unchanged_in_paths + input_files_used_to_make_output_files, ambiguous_tags
+
+
+@dataclass
+class _WatchSnapshot:
+    # modification time in nanoseconds of every scanned folder, which changes when a file in it is added or removed
+    dir_mtimes: typing.Dict[str, int] = field(default_factory=dict)
+    # out path, modification time in nanoseconds and size of every template by in path
+    templates: typing.Dict[str, typing.Tuple[str, int, int]] = field(default_factory=dict)
+
+
+def __get_mtime_ns(path: str) -> typing.Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _take_watch_snapshot(
+    in_dir: str,
+    out_dir: str,
+    recursive: bool,
+    include_globs: typing.Iterable[str] = (),
+    exclude_globs: typing.Iterable[str] = (),
+    follow_symlinks: bool = True,
+    previous_snapshot: typing.Optional[_WatchSnapshot] = None,
+) -> _WatchSnapshot:
+    """
+    Stats every template, in_dir is only walked again when a folder of previous_snapshot changed,
+    which keeps polling a large tree cheap
+    """
+    snapshot = _WatchSnapshot()
+    if previous_snapshot is not None and all(
+        __get_mtime_ns(dir_path) == dir_mtime for dir_path, dir_mtime in previous_snapshot.dir_mtimes.items()
+    ):
+        snapshot.dir_mtimes = previous_snapshot.dir_mtimes
+        in_path_to_out_path = {
+            in_path: out_path for in_path, (out_path, _, _) in previous_snapshot.templates.items()
+        }
+    else:
+        scanned_dirs = []
+        in_path_to_out_path = dict(
+            _iter_in_file_to_out_file_pairs(
+                in_dir, out_dir, recursive, include_globs, exclude_globs, follow_symlinks, scanned_dirs
             )
         )
-        with open(in_path) as file:
-            in_txt = file.read()
+        snapshot.dir_mtimes = {dir_path: __get_mtime_ns(dir_path) for dir_path in scanned_dirs}
+    for in_path, out_path in in_path_to_out_path.items():
+        try:
+            in_stat = os.stat(in_path)
+        except FileNotFoundError:
+            # removed since the walk
+            continue
+        snapshot.templates[in_path] = (out_path, in_stat.st_mtime_ns, in_stat.st_size)
+    return snapshot
+
+
+def _is_watch_snapshot_settled(watch_snapshot: _WatchSnapshot, in_paths: typing.Iterable[str]) -> bool:
+    """
+    Whether no folder of watch_snapshot and none of in_paths changed since it was taken
+    """
+    for dir_path, dir_mtime in watch_snapshot.dir_mtimes.items():
+        if __get_mtime_ns(dir_path) != dir_mtime:
+            return False
+    for in_path in in_paths:
+        try:
+            in_stat = os.stat(in_path)
+        except FileNotFoundError:
+            if in_path in watch_snapshot.templates:
+                return False
+            continue
+        state = watch_snapshot.templates.get(in_path)
+        if state is None or state[1:] != (in_stat.st_mtime_ns, in_stat.st_size):
+            return False
+    return True
+
+
+def __convert_watched_files(
+    in_path_to_out_path: typing.Dict[str, str],
+    converter: Converter,
+    jobs: int,
+    io_threads: int,
+    reporter: Reporter,
+    mmap_min_size: typing.Optional[int] = None,
+):
+    if len(in_path_to_out_path) < WATCH_MIN_FILES_FOR_JOBS:
+        jobs = 1
+    # templates which can not be parsed are reported and skipped by _create_files
+    try:
+        _create_files(
+            in_path_to_out_path,
+            converter.handlebars_tag_set,
+            converter.whitespace_config,
+            jobs=jobs,
+            io_threads=io_threads,
+            reporter=reporter,
+            converter=converter,
+            mmap_min_size=mmap_min_size,
+        )
+    except OSError as error:
+        # like a template deleted after it was seen, the next change is picked up by the next snapshot
+        reporter.message("Could not convert {}: {}".format(error.filename, error))
+    except ValueError as error:
+        # templates which can not be decoded or parsed are skipped by _create_files, anything else is reported
+        # so that the watch goes on
+        reporter.message("Could not convert the changed templates: {}".format(error))
+
+
+def _get_applied_tag_type(
+    tag_inference: typing.Optional[TagInference], infer_threshold: float
+) -> typing.Optional[HandlebarsTagType]:
+    """
+    the type sections of a tag with tag_inference are converted as, none when they are ambiguous
+    """
+    if tag_inference is None or tag_inference.confidence < infer_threshold:
+        return None
+    return tag_inference.handlebars_tag_type
+
+
+def _watch(
+    in_dir: str,
+    out_dir: str,
+    recursive: bool,
+    converter: Converter,
+    include_globs: typing.Iterable[str] = (),
+    exclude_globs: typing.Iterable[str] = (),
+    follow_symlinks: bool = True,
+    jobs: int = 1,
+    io_threads: int = 0,
+    reporter: typing.Optional[Reporter] = None,
+    stop_event: typing.Optional[threading.Event] = None,
+    interval: float = WATCH_INTERVAL,
+    debounce: float = WATCH_DEBOUNCE,
+    mmap_min_size: typing.Optional[int] = None,
+):
+    """
+    Converts every template, then checks the modification times in in_dir every interval seconds and reconverts
+    templates which are added or changed once no more changes come for debounce seconds
+    Outputs of removed templates are deleted
+    converter is used for the whole watch so that its caches stay warm
+    The partial graph is kept up to date, its cycles and missing partials are reported when they change,
+    and partials whose {{.}} refers to something else after a change are reconverted, see _get_partial_context_tags
+    When converter infers section types, its known_tag_inferences are inferred across every template like a full run
+    does, only changed templates and those including a changed partial are analyzed again, and the templates
+    including a changed partial or using a tag whose inferred type changes are reconverted too
+    Templates which can not be read or parsed are reported and the watch goes on
+    Runs until stop_event is set
+    """
+    if reporter is None:
+        reporter = Reporter()
+    if stop_event is None:
+        stop_event = threading.Event()
+    include_globs, exclude_globs = list(include_globs), list(exclude_globs)
+
+    def take_snapshot(previous_snapshot: _WatchSnapshot) -> _WatchSnapshot:
+        return _take_watch_snapshot(
+            in_dir, out_dir, recursive, include_globs, exclude_globs, follow_symlinks, previous_snapshot
+        )
+
+    watch_snapshot = None
+    snapshot = {}
+    in_path_to_partial_names = {}
+    partial_graph = PartialGraph()
+    old_partial_graph_messages = []
+    template_analyses = None
+    while not stop_event.is_set():
+        watch_snapshot = take_snapshot(watch_snapshot)
+        if watch_snapshot.templates == snapshot:
+            stop_event.wait(interval)
+            continue
+        # editors save in bursts, wait for them to settle, only the changed templates and folders need checking
+        while not stop_event.wait(debounce):
+            changed_in_paths = [
+                in_path for in_path, state in watch_snapshot.templates.items() if snapshot.get(in_path) != state
+            ]
+            if _is_watch_snapshot_settled(watch_snapshot, changed_in_paths):
+                break
+            watch_snapshot = take_snapshot(watch_snapshot)
+        if stop_event.is_set():
+            break
+        new_snapshot = watch_snapshot.templates
 
-        out_txt, file_ambiguous_tags = _convert_handlebars_to_mustache(
-            in_txt, handlebars_tag_set, whitespace_config
+        changed_in_paths = [in_path for in_path, state in new_snapshot.items() if snapshot.get(in_path) != state]
+        removed_in_paths = [in_path for in_path in snapshot if in_path not in new_snapshot]
+        for in_path in removed_in_paths:
+            out_path = snapshot[in_path][0]
+            if os.path.isfile(out_path):
+                os.remove(out_path)
+                reporter.message("Removed file {} because its input {} was deleted".format(out_path, in_path))
+        snapshot = new_snapshot
+
+        in_paths_to_convert = set(changed_in_paths)
+        order = list(snapshot)
+        for in_path in removed_in_paths:
+            in_path_to_partial_names.pop(in_path, None)
+        for in_path in changed_in_paths:
+            try:
+                in_path_to_partial_names[in_path] = _scan_partial_names(_read_file(in_path)[0])
+            except (OSError, TemplateError) as error:
+                in_path_to_partial_names[in_path] = []
+                reporter.message("Could not read {}: {}".format(in_path, error))
+        old_partial_graph = partial_graph
+        partial_graph = _link_partial_graph(in_dir, in_path_to_partial_names)
+        partial_graph_messages = __get_partial_graph_messages(partial_graph)
+        if partial_graph_messages != old_partial_graph_messages:
+            for message in partial_graph_messages:
+                reporter.message(message)
+            old_partial_graph_messages = partial_graph_messages
+        # the analyses of templates which did not change and include no changed partial are kept
+        template_analyses = _TemplateAnalyses(
+            in_dir,
+            partial_graph,
+            {in_path: "{}-{}".format(mtime_ns, size) for in_path, (_, mtime_ns, size) in snapshot.items()},
+            template_analyses.analyses if template_analyses is not None else None,
+        )
+        if converter.infer_threshold is not None:
+            partial_errors = []
+            converter.partial_usages = _get_partial_usages(
+                partial_graph, partial_errors, converter.parse_cache, template_analyses
+            )
+            for message in partial_errors:
+                reporter.message(message)
+            in_paths_to_convert.update(partial_graph.iter_dependents(changed_in_paths))
+            in_paths_to_convert.update(
+                in_path for in_path in old_partial_graph.iter_dependents(removed_in_paths) if in_path in snapshot
+            )
+            order, _ = partial_graph.topological_order()
+            # like a full run, tags are inferred across every template, and templates with a tag whose applied
+            # type changes are reconverted
+            tag_index = _build_tag_index(
+                snapshot,
+                jobs if len(changed_in_paths) >= WATCH_MIN_FILES_FOR_JOBS else 1,
+                converter.partial_usages,
+                None,
+                converter.parse_cache,
+                template_analyses,
+            )
+            known_tag_inferences = _classify_tags(
+                tag_index, converter.handlebars_tag_set, converter.tag_set_overrides, in_dir, include_configured=False
+            )
+            for tag in {*known_tag_inferences, *converter.known_tag_inferences}:
+                if _get_applied_tag_type(
+                    known_tag_inferences.get(tag), converter.infer_threshold
+                ) is not _get_applied_tag_type(converter.known_tag_inferences.get(tag), converter.infer_threshold):
+                    in_paths_to_convert.update(usage.in_path for usage in tag_index.get(tag, []))
+            converter.known_tag_inferences = known_tag_inferences
+        # partials whose {{.}} refers to something else after the change are reconverted
+        partial_context_tags = _get_partial_context_tags(
+            in_dir,
+            partial_graph,
+            _get_partial_includes(partial_graph, converter.parse_cache, template_analyses),
+            converter,
         )
-        if file_ambiguous_tags:
-            ambiguous_tags.update(file_ambiguous_tags)
-            print(
-                "Skipped writing file {} because it has ambiguous tags".format(out_path)
+        for in_path in {*partial_context_tags, *converter.partial_context_tags}:
+            context_tag = partial_context_tags.get(in_path, HANDLEBARS_CONTEXT_TAG)
+            if in_path in snapshot and context_tag != converter._get_context_tag(in_path):
+                in_paths_to_convert.add(in_path)
+        converter.partial_context_tags = partial_context_tags
+        __convert_watched_files(
+            {in_path: snapshot[in_path][0] for in_path in order if in_path in in_paths_to_convert},
+            converter,
+            jobs,
+            io_threads,
+            reporter,
+            mmap_min_size,
+        )
+        reporter.flush()
+
+
+class _SectionUsagePass(NodeVisitor):
+    """
+    collects the tag and SectionUsage of each section of a template in the order the sections close,
+    and the name and enclosing sections, as (tag, inverted) outermost first, of each partial it includes
+    tags are in handlebars form like myList.[0], partials count as their body as described in partial_usages
+    """
+
+    def __init__(
+        self, in_txt: str, in_path: str, partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None
+    ):
+        self.in_txt = in_txt
+        self.in_path = in_path
+        self.partial_usages = partial_usages
+        self.tags_and_usages = []
+        self.includes = []
+        # the tag and whether it is inverted of the enclosing sections
+        self.sections = []
+        # the line of index in in_txt, sections are visited in source order so lines are counted once
+        self.line = 1
+        self.index = 0
+
+    def visit_Section(self, node: Section):
+        self.line += self.in_txt.count("\n", self.index, node.start)
+        self.index = node.start
+        tag = _mustache_to_handlebars_tag_element(node.value)
+        inverted = type(node) is Inverted
+        usage = SectionUsage(self.in_path, self.line, tuple(tag for tag, _ in self.sections), inverted=inverted)
+        self.sections.append((tag, inverted))
+        self.generic_visit(node)
+        self.sections.pop()
+        body_usage = _get_body_usage(node.children, node.value, self.partial_usages)
+        usage.uses_context_tag = body_usage.uses_context_tag
+        usage.uses_iteration_tags = body_usage.uses_iteration_tags
+        usage.uses_own_tag = body_usage.uses_own_tag
+        usage.uses_other_tags = body_usage.uses_other_tags
+        self.tags_and_usages.append((tag, usage))
+
+    visit_Inverted = visit_Section
+
+    def visit_Partial(self, node: Partial):
+        self.includes.append((node.value, tuple(self.sections)))
+
+
+def _analyze_file(
+    in_path: str,
+    partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+    parse_cache: typing.Optional[ParseCache] = None,
+) -> typing.Union[
+    typing.Tuple[typing.List[typing.Tuple[str, SectionUsage]], typing.List[_PartialInclude]], TemplateError
+]:
+    """
+    the tag and usage of every section in in_path and the partials it includes, see _SectionUsagePass,
+    or the TemplateError of a template which can not be read or parsed
+    """
+    try:
+        in_txt, _ = _read_file(in_path)
+        template = _parse_with_cache(in_txt, parse_cache)
+    except (OSError, TemplateError) as error:
+        return TemplateError("{} in {}".format(error, in_path))
+    section_usage_pass = _SectionUsagePass(in_txt, in_path, partial_usages)
+    section_usage_pass.visit(template)
+    return section_usage_pass.tags_and_usages, section_usage_pass.includes
+
+
+def _build_tag_index(
+    in_paths: typing.Iterable[str],
+    jobs: int = 1,
+    partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+    errors: typing.Optional[typing.List[str]] = None,
+    parse_cache: typing.Optional[ParseCache] = None,
+    template_analyses: typing.Optional[_TemplateAnalyses] = None,
+) -> typing.Dict[str, typing.List[SectionUsage]]:
+    """
+    An inverted index from each section tag to its usages across in_paths, in path and line order
+    jobs: the number of processes to read and analyze files in, 0 uses one per cpu
+    partial_usages: what the body of each partial uses by name, see _get_partial_usages
+    errors: when given, a message naming each template which can not be parsed is added to it,
+        those templates are left out
+    parse_cache: parses templates when given
+    template_analyses: when given, templates with an analysis in it are not read and the others are added to it,
+        along with the partials they include
+    """
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    in_paths = list(in_paths)
+    in_path_to_tags_and_usages = {}
+    if template_analyses is not None:
+        for in_path in in_paths:
+            tags_and_usages = template_analyses.get_section_usages(in_path)
+            if tags_and_usages is not None:
+                in_path_to_tags_and_usages[in_path] = tags_and_usages
+    in_paths_to_analyze = [in_path for in_path in in_paths if in_path not in in_path_to_tags_and_usages]
+    with contextlib.ExitStack() as exit_stack:
+        if jobs == 1 or not in_paths_to_analyze:
+            analyzed_files = map(
+                _analyze_file, in_paths_to_analyze, itertools.repeat(partial_usages), itertools.repeat(parse_cache)
             )
+        else:
+            executor = exit_stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+            analyzed_files = executor.map(
+                _analyze_file,
+                in_paths_to_analyze,
+                itertools.repeat(partial_usages),
+                itertools.repeat(parse_cache),
+                chunksize=max(1, len(in_paths_to_analyze) // (jobs * 4)),
+            )
+        for in_path, analyzed_file in zip(in_paths_to_analyze, analyzed_files):
+            if isinstance(analyzed_file, TemplateError):
+                if errors is not None:
+                    errors.append("Could not analyze {}".format(analyzed_file))
+                continue
+            tags_and_usages, includes = analyzed_file
+            if template_analyses is not None:
+                template_analyses.set_section_usages(in_path, tags_and_usages)
+                template_analyses.set_includes(in_path, includes)
+            in_path_to_tags_and_usages[in_path] = tags_and_usages
+    tag_index = collections.defaultdict(list)
+    for in_path in in_paths:
+        for tag, usage in in_path_to_tags_and_usages.get(in_path, []):
+            tag_index[tag].append(usage)
+    return dict(tag_index)
+
+
+def _classify_tags(
+    tag_index: typing.Dict[str, typing.List[SectionUsage]],
+    handlebars_tag_set: HandlebarTagSet,
+    tag_set_overrides: typing.Sequence[typing.Tuple[typing.Sequence[str], HandlebarTagSet]] = (),
+    in_dir: str = "",
+    include_configured: bool = True,
+) -> typing.Dict[str, TagInference]:
+    """
+    Returns the handlebars tag type of every {{#tag}} in tag_index with the reason it was chosen
+    Tags in handlebars_tag_set keep their type, the others are inferred from all of their section bodies
+    with the confidence of their least certain section, see _infer_handlebars_tag_type
+    Sections in templates whose tag set overrides, matched relative to in_dir like Converter does, give their tag
+    a type are not inferred from, and a tag whose every section is such is configured
+    Tags only used in {{^tag}} sections are left out because they are always unless,
+    configured tags are left out too unless include_configured is set
+    """
+    tag_to_handlebars_tag_type = _get_tag_to_handlebars_tag_type(handlebars_tag_set)
+    get_tag_to_handlebars_tag_type_for_path = Converter(
+        handlebars_tag_set, HandlebarsWhitespaceConfig(), tag_set_overrides=tag_set_overrides, in_dir=in_dir
+    )._get_tag_to_handlebars_tag_type_for_path
+    tag_to_classification = {}
+    for tag, usages in tag_index.items():
+        usages = [usage for usage in usages if not usage.inverted]
+        if not usages:
+            continue
+        if tag in tag_to_handlebars_tag_type:
+            if include_configured:
+                tag_to_classification[tag] = TagInference(tag_to_handlebars_tag_type[tag], 1.0, "configured")
             continue
+        configured_handlebars_tag_types = []
+        inferred_usages = []
+        for usage in usages:
+            handlebars_tag_type = get_tag_to_handlebars_tag_type_for_path(usage.in_path).get(tag)
+            if handlebars_tag_type is None:
+                inferred_usages.append(usage)
+            elif handlebars_tag_type not in configured_handlebars_tag_types:
+                configured_handlebars_tag_types.append(handlebars_tag_type)
+        if not inferred_usages:
+            if include_configured:
+                type_names = [handlebars_tag_type.name.lower() for handlebars_tag_type in configured_handlebars_tag_types]
+                tag_to_classification[tag] = TagInference(
+                    configured_handlebars_tag_types[0], 1.0, "configured as {} by overrides".format(" and ".join(type_names))
+                )
+            continue
+        for usage in inferred_usages:
+            _merge_tag_inference(
+                tag_to_classification,
+                tag,
+                _infer_handlebars_tag_type(
+                    tag, usage.uses_context_tag, usage.uses_iteration_tags, usage.uses_own_tag, usage.uses_other_tags
+                ),
+            )
+    return tag_to_classification
 
-        out_folder = os.path.dirname(out_path)
-        if out_folder not in existing_out_folders:
-            if not os.path.isdir(out_folder):
-                os.mkdir(out_folder)
-            existing_out_folders.add(out_folder)
 
-        with open(out_path, "w") as file:
-            file.write(out_txt)
-        input_files_used_to_make_output_files.append(in_path)
-        print("Wrote file {}".format(out_path))
-    return input_files_used_to_make_output_files, ambiguous_tags
+def _infer_tag_types(
+    in_paths: typing.Iterable[str],
+    handlebars_tag_set: HandlebarTagSet,
+    jobs: int = 1,
+    partial_usages: typing.Optional[typing.Dict[str, _BodyUsage]] = None,
+    parse_cache: typing.Optional[ParseCache] = None,
+    template_analyses: typing.Optional[_TemplateAnalyses] = None,
+    tag_set_overrides: typing.Sequence[typing.Tuple[typing.Sequence[str], HandlebarTagSet]] = (),
+    in_dir: str = "",
+) -> typing.Dict[str, TagInference]:
+    """
+    the inference of each section tag of in_paths which is in no tag set, merged over all of its sections
+    which are in no tag set override either, for Converter known_tag_inferences
+    Templates which can not be parsed are left out
+    parse_cache and template_analyses spare parsing templates again, see _build_tag_index
+    """
+    return _classify_tags(
+        _build_tag_index(in_paths, jobs, partial_usages, None, parse_cache, template_analyses),
+        handlebars_tag_set,
+        tag_set_overrides,
+        in_dir,
+        include_configured=False,
+    )
 
 
-def _clean_up_files(files_to_delete: typing.List[str]):
-    if not files_to_delete:
-        print("Original templates have not been deleted")
+def _write_tag_classification(
+    path: str,
+    tag_index: typing.Dict[str, typing.List[SectionUsage]],
+    tag_to_classification: typing.Dict[str, TagInference],
+    infer_threshold: float = INFER_THRESHOLD,
+):
+    """
+    Writes the if_tags, each_tags and with_tags lists of the tags classified with at least infer_threshold confidence,
+    the types their sections were inferred as and the confidence of the other tags,
+    then the classification, confidence, reason and usages of each tag
+    """
+    handlebars_tag_type_to_key = {
+        HandlebarsTagType.IF: "if_tags",
+        HandlebarsTagType.EACH: "each_tags",
+        HandlebarsTagType.WITH: "with_tags",
+    }
+    classification = {key: [] for key in handlebars_tag_type_to_key.values()}
+    unresolved = {}
+    tags = {}
+    for tag, tag_inference in sorted(tag_to_classification.items()):
+        if tag_inference.confidence >= infer_threshold:
+            key = handlebars_tag_type_to_key[tag_inference.handlebars_tag_type]
+            classification[key].append(tag)
+        else:
+            key = None
+            candidates = {
+                _infer_handlebars_tag_type(
+                    tag, usage.uses_context_tag, usage.uses_iteration_tags, usage.uses_own_tag, usage.uses_other_tags
+                ).handlebars_tag_type
+                for usage in tag_index[tag]
+                if not usage.inverted
+            }
+            unresolved[tag] = {
+                "candidates": [
+                    key for handlebars_tag_type, key in handlebars_tag_type_to_key.items() if handlebars_tag_type in candidates
+                ],
+                "confidence": tag_inference.confidence,
+            }
+        tags[tag] = {
+            "classification": key,
+            "confidence": tag_inference.confidence,
+            "reason": tag_inference.reason,
+            "usages": [dataclasses.asdict(usage) for usage in tag_index[tag]],
+        }
+    classification["unresolved"] = unresolved
+    classification["tags"] = tags
+    with open(path, "w") as file:
+        json.dump(classification, file, indent=2)
+
+
+@dataclass
+class ConversionConfig:
+    """
+    the tag classifications and options of a -config file
+    """
+    handlebars_tag_set: HandlebarTagSet = field(default_factory=HandlebarTagSet)
+    # (globs, tag set) pairs, see Converter
+    tag_set_overrides: typing.List[typing.Tuple[typing.List[str], HandlebarTagSet]] = field(default_factory=list)
+    # command line option values by option name without the leading -
+    options: dict = field(default_factory=dict)
+
+
+def __config_error(path: str, message: str) -> ValueError:
+    return ValueError("Invalid config file {}, {}".format(path, message))
+
+
+def __config_strings(path: str, config_section: dict, key: str) -> typing.List[str]:
+    strings = config_section.get(key, [])
+    if not isinstance(strings, list) or not all(isinstance(string, str) for string in strings):
+        raise __config_error(path, "{} must be a list of strings".format(key))
+    return strings
+
+
+def _load_config(path: str) -> ConversionConfig:
+    """
+    Reads a json config file like
+    {
+        "if_tags": ["isEnabled"], "each_tags": ["items"], "with_tags": ["owner"],
+        "overrides": [{"paths": ["api/*", "*_model.mustache"], "each_tags": ["owner"]}],
+        "options": {"remove_whitespace_before_open": true, "exclude": ["vendor"]}
+    }
+    override paths are globs matched like -include globs, so api/* applies to every template under in_dir/api
+    The unresolved and tags keys written by -analyze are ignored so that its output can be used as a config
+    """
+    with open(path) as file:
+        config = json.load(file)
+    if not isinstance(config, dict):
+        raise __config_error(path, "it must hold a json object")
+    unknown_keys = set(config) - {"if_tags", "each_tags", "with_tags", "overrides", "options", "unresolved", "tags"}
+    if unknown_keys:
+        raise __config_error(path, "unknown keys {}".format(sorted(unknown_keys)))
+    tag_set_overrides = []
+    for override in config.get("overrides", []):
+        if not isinstance(override, dict) or not override.get("paths"):
+            raise __config_error(path, "each override must be an object with paths")
+        tag_set_overrides.append(
+            (
+                __config_strings(path, override, "paths"),
+                HandlebarTagSet(
+                    if_tags=set(__config_strings(path, override, "if_tags")),
+                    each_tags=set(__config_strings(path, override, "each_tags")),
+                    with_tags=set(__config_strings(path, override, "with_tags")),
+                ),
+            )
+        )
+    options = config.get("options", {})
+    if not isinstance(options, dict):
+        raise __config_error(path, "options must be an object")
+    return ConversionConfig(
+        HandlebarTagSet(
+            if_tags=set(__config_strings(path, config, "if_tags")),
+            each_tags=set(__config_strings(path, config, "each_tags")),
+            with_tags=set(__config_strings(path, config, "with_tags")),
+        ),
+        tag_set_overrides,
+        options,
+    )
+
+
+def __report_tag_inferences(tag_inferences: typing.Dict[str, TagInference], ambiguous_tags: typing.Set[str]):
+    applied_tags = sorted(set(tag_inferences) - ambiguous_tags)
+    if not applied_tags:
         return
-    for i, path in enumerate(files_to_delete):
+    print("\ninferred the type of {} tags from their section bodies:".format(len(applied_tags)))
+    for tag in applied_tags:
+        tag_inference = tag_inferences[tag]
         print(
-            "Removing file {} out of {}, path={}".format(
-                i + 1, len(files_to_delete), path
+            "{}={} confidence={} because {}".format(
+                tag, tag_inference.handlebars_tag_type.name.lower(), tag_inference.confidence, tag_inference.reason
             )
         )
-        os.remove(path)
 
 
-def __handle_ambiguous_tags(ambiguous_tags: typing.Set[str], qty_skipped_files: int):
+def __handle_ambiguous_tags(
+    ambiguous_tags: typing.Set[str],
+    qty_skipped_files: int,
+    tag_inferences: typing.Optional[typing.Dict[str, TagInference]] = None,
+):
     print("\nskipped generating {} files".format(qty_skipped_files))
     print("qty_ambiguous_tags={}".format(len(ambiguous_tags)))
     print("ambiguous_tags={}".format(ambiguous_tags))
 
-    suspected_if_tags = []
-    suspected_each_tags = []
-    for tag in ambiguous_tags:
-        if (
-            tag.startswith("is")
-            or tag.startswith("has")
-            or tag.startswith("getHas")
-            or tag.startswith("use")
-            or tag.startswith("getIs")
-        ):
-            suspected_if_tags.append(tag)
-    ambiguous_tags = ambiguous_tags - set(suspected_if_tags)
+    handlebars_tag_type_to_suspected_tags = {
+        HandlebarsTagType.IF: [],
+        HandlebarsTagType.EACH: [],
+        HandlebarsTagType.WITH: [],
+    }
     for tag in ambiguous_tags:
-        if tag.endswith("s"):
-            suspected_each_tags.append(tag)
-    ambiguous_tags = ambiguous_tags - set(suspected_each_tags)
-    suspected_with_tags = list(ambiguous_tags)
-    print("here are some guesses at what your tags may be based only on tag names:\n")
+        if tag == MUSTACHE_CONTEXT_TAG:
+            continue
+        if tag_inferences and tag in tag_inferences:
+            handlebars_tag_type = tag_inferences[tag].handlebars_tag_type
+        else:
+            handlebars_tag_type = _guess_handlebars_tag_type_from_name(tag)
+        handlebars_tag_type_to_suspected_tags[handlebars_tag_type].append(tag)
+    suspected_if_tags, suspected_each_tags, suspected_with_tags = handlebars_tag_type_to_suspected_tags.values()
+    if tag_inferences:
+        print("here are some guesses at what your tags may be based on their section bodies and names:\n")
+    else:
+        print("here are some guesses at what your tags may be based only on tag names:\n")
     print('-handlebars_if_tags="{}"\n'.format(" ".join(suspected_if_tags)))
     print('-handlebars_each_tags="{}"\n'.format(" ".join(suspected_each_tags)))
     print('-handlebars_with_tags="{}"\n'.format(" ".join(suspected_with_tags)))
+    if MUSTACHE_CONTEXT_TAG in ambiguous_tags:
+        print("{{.}} is ambiguous in partials which are included in sections of different types or of unknown type\n")
+
+
+def __get_partial_graph_messages(partial_graph: PartialGraph) -> typing.List[str]:
+    _, cycles = partial_graph.topological_order()
+    messages = [
+        "Partials include each other in a cycle: {}".format(" -> ".join([*cycle, cycle[0]])) for cycle in cycles
+    ]
+    for in_path, names in partial_graph.unresolved.items():
+        messages.append("Partials {} of {} are not templates in in_dir".format(names, in_path))
+    return messages
+
+
+def __report_check(out_dir: str, out_path_to_check: typing.Dict[str, FileCheck], seconds: float) -> bool:
+    """
+    prints a line for each out file which is not up to date and a summary, returns whether all of them are
+    """
+    check_status_to_qty = collections.Counter()
+    for out_path, file_check in out_path_to_check.items():
+        check_status_to_qty[file_check.check_status] += 1
+        if file_check.check_status is CheckStatus.UNCHANGED:
+            continue
+        line = "{} {}".format(file_check.check_status.value, os.path.relpath(out_path, out_dir))
+        if file_check.ambiguous_tags:
+            line += " ambiguous_tags={}".format(" ".join(sorted(file_check.ambiguous_tags)))
+        if file_check.error:
+            line += " error={}".format(file_check.error)
+        print(line)
+    print(
+        "Checked {} files in {:.2f}s, {}".format(
+            len(out_path_to_check),
+            seconds,
+            ", ".join(
+                "{} {}".format(check_status.value, check_status_to_qty[check_status]) for check_status in CheckStatus
+            ),
+        )
+    )
+    return check_status_to_qty[CheckStatus.UNCHANGED] == len(out_path_to_check)
+
+
+def __analyze(in_dir: str, recursive: bool, args: argparse.Namespace, handlebars_tag_set: HandlebarTagSet):
+    in_paths = [
+        in_path
+        for in_path, _ in _iter_mustache_files(in_dir, recursive, args.include, args.exclude, args.follow_symlinks)
+    ]
+    partial_graph = _build_partial_graph(in_dir, in_paths)
+    for message in __get_partial_graph_messages(partial_graph):
+        print(message)
+    parse_cache = ParseCache(args.parse_cache) if args.parse_cache else None
+    partial_errors = []
+    partial_usages = _get_partial_usages(partial_graph, partial_errors, parse_cache)
+    tag_index = _build_tag_index(in_paths, args.jobs, partial_usages, partial_errors, parse_cache)
+    for message in partial_errors:
+        print(message)
+    tag_to_classification = _classify_tags(
+        tag_index, handlebars_tag_set, args.conversion_config.tag_set_overrides, in_dir
+    )
+    _write_tag_classification(args.analyze, tag_index, tag_to_classification, args.infer_threshold)
+    print(
+        "Analyzed {} files with {} section tags, wrote their classification to {}".format(
+            len(in_paths), len(tag_to_classification), args.analyze
+        )
+    )
+    handlebars_tag_type_to_tags = collections.defaultdict(list)
+    for tag, tag_inference in sorted(tag_to_classification.items()):
+        if tag_inference.confidence >= args.infer_threshold:
+            handlebars_tag_type_to_tags[tag_inference.handlebars_tag_type].append(tag)
+    print('-handlebars_if_tags="{}"\n'.format(" ".join(handlebars_tag_type_to_tags[HandlebarsTagType.IF])))
+    print('-handlebars_each_tags="{}"\n'.format(" ".join(handlebars_tag_type_to_tags[HandlebarsTagType.EACH])))
+    print('-handlebars_with_tags="{}"\n'.format(" ".join(handlebars_tag_type_to_tags[HandlebarsTagType.WITH])))
 
 
 def mustache_to_handlebars():
@@ -417,17 +4156,14 @@ def mustache_to_handlebars():
         not args.only_in_dir,
         args.delete_in_files,
     )
+    conversion_config = args.conversion_config
     handlebars_if_tags, handlebars_each_tags, handlebars_with_tags = (
-        args.handlebars_if_tags,
-        args.handlebars_each_tags,
-        args.handlebars_with_tags,
+        args.handlebars_if_tags | conversion_config.handlebars_tag_set.if_tags,
+        args.handlebars_each_tags | conversion_config.handlebars_tag_set.each_tags,
+        args.handlebars_with_tags | conversion_config.handlebars_tag_set.with_tags,
     )
     handlebars_if_tags.update({HANDLEBARS_FIRST, HANDLEBARS_LAST})
 
-    if not out_dir:
-        out_dir = in_dir
-
-    in_path_to_out_path = _get_in_file_to_out_file_map(in_dir, out_dir, recursive)
     handlebars_tag_set = HandlebarTagSet(
         if_tags=handlebars_if_tags,
         each_tags=handlebars_each_tags,
@@ -439,15 +4175,195 @@ def mustache_to_handlebars():
         remove_whitespace_before_close=args.remove_whitespace_before_close,
         remove_whitespace_after_close=args.remove_whitespace_after_close,
     )
-    input_files_used_to_make_output_files, ambiguous_tags = _create_files(
-        in_path_to_out_path, handlebars_tag_set, whitespace_config
-    )
 
-    if ambiguous_tags:
-        __handle_ambiguous_tags(
-            ambiguous_tags,
-            len(in_path_to_out_path) - len(input_files_used_to_make_output_files),
+    if in_dir == STDIN_PATH:
+        try:
+            ambiguous_tags = convert_stream(sys.stdin, sys.stdout, handlebars_tag_set, whitespace_config)
+        except (TemplateError, UnicodeDecodeError) as error:
+            sys.stdout.flush()
+            print("Could not convert {}: {}".format(STDIN_PATH, error), file=sys.stderr)
+            sys.exit(1)
+        if ambiguous_tags:
+            # stdout holds the template so report on stderr
+            with contextlib.redirect_stdout(sys.stderr):
+                __handle_ambiguous_tags(ambiguous_tags, 0)
+            sys.exit(1)
+        return
+
+    if not out_dir:
+        out_dir = in_dir
+
+    if args.analyze:
+        __analyze(in_dir, recursive, args, handlebars_tag_set)
+        return
+
+    reporter = REPORTERS[args.report]()
+    infer_threshold = args.infer_threshold if args.infer_tags else None
+    parse_cache = ParseCache(args.parse_cache) if args.parse_cache else None
+    if args.watch:
+        converter = Converter(
+            handlebars_tag_set,
+            whitespace_config,
+            infer_threshold=infer_threshold,
+            tag_set_overrides=conversion_config.tag_set_overrides,
+            in_dir=in_dir,
+            parse_cache=parse_cache,
         )
+        reporter.message("Watching {} for changes, press ctrl+c to stop".format(in_dir))
+        try:
+            _watch(
+                in_dir,
+                out_dir,
+                recursive,
+                converter,
+                args.include,
+                args.exclude,
+                args.follow_symlinks,
+                jobs=args.jobs,
+                io_threads=args.io_threads,
+                reporter=reporter,
+                mmap_min_size=args.mmap_min_size,
+            )
+        except KeyboardInterrupt:
+            reporter.flush()
+        return
+    tag_inferences = {}
+    failed_in_paths = []
+    profiler = Profiler() if args.profile else None
+    c_profiler = None
+    if args.cprofile:
+        c_profiler = cProfile.Profile()
+        c_profiler.enable()
+    in_file_to_out_file_pairs = _iter_in_file_to_out_file_pairs(
+        in_dir, out_dir, recursive, args.include, args.exclude, args.follow_symlinks
+    )
+    if profiler is not None:
+        in_file_to_out_file_pairs = profiler.measure_iterator("discover", in_file_to_out_file_pairs)
+    # the partial graph is built in every run to report partials which are missing or include each other in a cycle
+    # and to find what {{.}} refers to in partials, so conversion starts once every template is found
+    in_path_to_out_path = dict(in_file_to_out_file_pairs)
+    partial_usages = known_tag_inferences = template_analyses = None
+    with profiler.measure("partials") if profiler is not None else contextlib.nullcontext():
+        partial_graph = _build_partial_graph(in_dir, in_path_to_out_path)
+        if infer_threshold is not None or args.manifest:
+            # the analyses of the last run are reused for unchanged templates
+            template_analyses = _TemplateAnalyses(
+                in_dir,
+                partial_graph,
+                {in_path: _hash_file(in_path) for in_path in in_path_to_out_path},
+                _load_manifest(out_dir, "analyses") if args.manifest else None,
+            )
+        partial_errors = []
+        if infer_threshold is not None:
+            partial_usages = _get_partial_usages(partial_graph, partial_errors, parse_cache, template_analyses)
+            # so that sections of a tag get the same type in every template
+            known_tag_inferences = _infer_tag_types(
+                in_path_to_out_path,
+                handlebars_tag_set,
+                args.jobs,
+                partial_usages,
+                parse_cache,
+                template_analyses,
+                conversion_config.tag_set_overrides,
+                in_dir,
+            )
+        converter = Converter(
+            handlebars_tag_set,
+            whitespace_config,
+            infer_threshold=infer_threshold,
+            tag_set_overrides=conversion_config.tag_set_overrides,
+            in_dir=in_dir,
+            partial_usages=partial_usages,
+            parse_cache=parse_cache,
+            known_tag_inferences=known_tag_inferences,
+        )
+        converter.partial_context_tags = _get_partial_context_tags(
+            in_dir, partial_graph, _get_partial_includes(partial_graph, parse_cache, template_analyses), converter
+        )
+    for message in [*__get_partial_graph_messages(partial_graph), *partial_errors]:
+        reporter.message(message)
+    if infer_threshold is not None:
+        # inferring a section needs what the partials in it use, so partials are converted first
+        order, _ = partial_graph.topological_order()
+        in_path_to_out_path = {in_path: in_path_to_out_path[in_path] for in_path in order}
+    if args.check:
+        start_time = time.perf_counter()
+        out_path_to_check = _check_files(
+            in_dir,
+            out_dir,
+            recursive,
+            in_path_to_out_path,
+            converter,
+            jobs=args.jobs,
+            mmap_min_size=args.mmap_min_size,
+            include_globs=args.include,
+            exclude_globs=args.exclude,
+            follow_symlinks=args.follow_symlinks,
+        )
+        if c_profiler is not None:
+            c_profiler.disable()
+            c_profiler.dump_stats(args.cprofile)
+        if not __report_check(out_dir, out_path_to_check, time.perf_counter() - start_time):
+            sys.exit(1)
+        return
+    if args.manifest:
+        input_files_used_to_make_output_files, ambiguous_tags = _create_files_incremental(
+            in_dir,
+            out_dir,
+            in_path_to_out_path,
+            handlebars_tag_set,
+            whitespace_config,
+            jobs=args.jobs,
+            io_threads=args.io_threads,
+            reporter=reporter,
+            profiler=profiler,
+            infer_threshold=infer_threshold,
+            tag_inferences=tag_inferences,
+            tag_set_overrides=conversion_config.tag_set_overrides,
+            partial_graph=partial_graph,
+            partial_usages=partial_usages,
+            known_tag_inferences=known_tag_inferences,
+            template_analyses=template_analyses,
+            partial_context_tags=converter.partial_context_tags,
+            parse_cache=parse_cache,
+            mmap_min_size=args.mmap_min_size,
+            failed_in_paths=failed_in_paths,
+        )
+    else:
+        input_files_used_to_make_output_files, ambiguous_tags = _create_files(
+            in_path_to_out_path,
+            handlebars_tag_set,
+            whitespace_config,
+            jobs=args.jobs,
+            io_threads=args.io_threads,
+            reporter=reporter,
+            profiler=profiler,
+            tag_inferences=tag_inferences,
+            converter=converter,
+            mmap_min_size=args.mmap_min_size,
+            failed_in_paths=failed_in_paths,
+        )
+
+    if c_profiler is not None:
+        c_profiler.disable()
+        c_profiler.dump_stats(args.cprofile)
+    if profiler is not None:
+        profiler.stop()
+        with open(args.profile, "w") as file:
+            json.dump(profiler.to_dict(args.profile_top), file, indent=2)
+
+    # keep json lines output parseable
+    with contextlib.redirect_stdout(sys.stderr if args.report == "json" else sys.stdout):
+        if tag_inferences:
+            __report_tag_inferences(tag_inferences, ambiguous_tags)
+        if ambiguous_tags:
+            __handle_ambiguous_tags(
+                ambiguous_tags,
+                len(in_path_to_out_path) - len(input_files_used_to_make_output_files) - len(failed_in_paths),
+                tag_inferences,
+            )
 
     if delete_in_files:
-        _clean_up_files(input_files_used_to_make_output_files)
+        _clean_up_files(input_files_used_to_make_output_files, reporter)
+    if failed_in_paths:
+        sys.exit(1)
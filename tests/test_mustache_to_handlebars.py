@@ -1,7 +1,16 @@
 import glob
+import io
+import json
 import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
 import unittest
+import unittest.mock
 
+import mustache_to_handlebars
 import mustache_to_handlebars.main as main
 
 
@@ -36,6 +45,46 @@ class TestHelpers(unittest.TestCase):
             },
         )
 
+    def test_get_in_file_to_out_file_map_globs_and_ignore_file(self):
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as linked_dir:
+            rel_paths = [
+                "mustache_templates/a.mustache",
+                "mustache_templates/b_test.mustache",
+                "mustache_templates/notes.txt",
+                "node_modules/c.mustache",
+                "vendor/d.mustache",
+                ".hidden/e.mustache",
+            ]
+            for rel_path in rel_paths:
+                os.makedirs(os.path.join(in_dir, os.path.dirname(rel_path)), exist_ok=True)
+                with open(os.path.join(in_dir, rel_path), "w") as file:
+                    file.write("")
+            with open(os.path.join(in_dir, main.IGNORE_FILE_NAME), "w") as file:
+                file.write("# vendored templates\nvendor/*\n")
+            with open(os.path.join(linked_dir, "f.mustache"), "w") as file:
+                file.write("")
+            os.symlink(linked_dir, os.path.join(in_dir, "linked"))
+            # a link to a parent folder is not walked again
+            os.symlink(in_dir, os.path.join(in_dir, "mustache_templates", "loop"))
+
+            in_file_to_out_file_map = main._get_in_file_to_out_file_map(
+                in_dir=in_dir, out_dir="out", recursive=True, exclude_globs=["node_modules"], follow_symlinks=False
+            )
+            self.assertEqual(
+                in_file_to_out_file_map,
+                {
+                    os.path.join(in_dir, "mustache_templates", "a.mustache"): os.path.join("out", "mustache_templates", "a.handlebars"),
+                    os.path.join(in_dir, "mustache_templates", "b_test.mustache"): os.path.join("out", "mustache_templates", "b_test.handlebars"),
+                },
+            )
+            in_file_to_out_file_map = main._get_in_file_to_out_file_map(
+                in_dir=in_dir, out_dir="out", recursive=True, include_globs=["*_test.mustache", "linked/*"]
+            )
+            self.assertEqual(
+                list(in_file_to_out_file_map.values()),
+                [os.path.join("out", "linked", "f.handlebars"), os.path.join("out", "mustache_templates", "b_test.handlebars")],
+            )
+
     def test_create_files(self):
         in_file_to_out_file_map = main._get_in_file_to_out_file_map(
             in_dir=self.in_dir, out_dir=self.in_dir, recursive=False
@@ -89,6 +138,500 @@ class TestHelpers(unittest.TestCase):
 
         main._clean_up_files(handlebars_files)
 
+    def test_create_files_with_jobs_and_io_threads_matches_serial(self):
+        handlebars_tag_set = main.HandlebarTagSet(
+            if_tags={main.HANDLEBARS_FIRST, main.HANDLEBARS_LAST, 'appName', 'appDescription', 'version'},
+        )
+        whitespace_config = main.HandlebarsWhitespaceConfig(remove_whitespace_before_open=True)
+        results = []
+        out_txts = []
+        for jobs, io_threads in [(1, 0), (2, 0), (1, 2), (2, 2)]:
+            with tempfile.TemporaryDirectory() as out_dir:
+                # output folders are made with their missing parents
+                out_dir = os.path.join(out_dir, "nested", "deeper")
+                in_file_to_out_file_map = main._get_in_file_to_out_file_map(
+                    in_dir=self.in_dir, out_dir=out_dir, recursive=True
+                )
+                used_in_files, ambiguous_tags = main._create_files(
+                    in_file_to_out_file_map, handlebars_tag_set, whitespace_config, jobs=jobs, io_threads=io_threads
+                )
+                results.append((used_in_files, ambiguous_tags))
+                file_txts = {}
+                for out_path in in_file_to_out_file_map.values():
+                    if os.path.isfile(out_path):
+                        with open(out_path, "rb") as file:
+                            file_txts[os.path.relpath(out_path, out_dir)] = file.read()
+                out_txts.append(file_txts)
+        self.assertEqual(results[0][1], {"infoEmail"})
+        self.assertEqual(set(out_txts[0]), {"api.handlebars", os.path.join("model_templates", "imports.handlebars")})
+        for result, file_txts in zip(results[1:], out_txts[1:]):
+            self.assertEqual(result, results[0])
+            self.assertEqual(file_txts, out_txts[0])
+
+    def test_write_file_skips_identical_content(self):
+        out_folder_cache = main._OutFolderCache()
+        with tempfile.TemporaryDirectory() as out_dir:
+            out_path = os.path.join(out_dir, "a", "b.handlebars")
+            self.assertTrue(main._write_file(out_path, "{{#if a}}\n{{/if}}\n", out_folder_cache))
+            os.utime(out_path, (0, 0))
+            self.assertFalse(main._write_file(out_path, "{{#if a}}\n{{/if}}\n", out_folder_cache))
+            self.assertEqual(os.stat(out_path).st_mtime, 0)
+            # same size, different content
+            self.assertTrue(main._write_file(out_path, "{{#if b}}\n{{/if}}\n", out_folder_cache))
+            self.assertNotEqual(os.stat(out_path).st_mtime, 0)
+            with open(out_path) as file:
+                self.assertEqual(file.read(), "{{#if b}}\n{{/if}}\n")
+            self.assertEqual(os.listdir(os.path.dirname(out_path)), ["b.handlebars"])
+
+    def test_create_files_reporters(self):
+        handlebars_tag_set = main.HandlebarTagSet(if_tags={"a"})
+        whitespace_config = main.HandlebarsWhitespaceConfig()
+        with tempfile.TemporaryDirectory() as in_dir:
+            for name, in_txt in [("a", "{{#a}}{{/a}}"), ("b", "{{#b}}{{/b}}")]:
+                with open(os.path.join(in_dir, name + ".mustache"), "w") as file:
+                    file.write(in_txt)
+            in_file_to_out_file_map = main._get_in_file_to_out_file_map(in_dir, in_dir, recursive=True)
+
+            stream = io.StringIO()
+            main._create_files(
+                in_file_to_out_file_map, handlebars_tag_set, whitespace_config, reporter=main.JsonLinesReporter(stream)
+            )
+            events = [json.loads(line) for line in stream.getvalue().splitlines()]
+            self.assertEqual(
+                [event["event"] for event in events],
+                ["file_read", "file_written", "file_read", "file_skipped", "summary"],
+            )
+            self.assertEqual(events[3]["ambiguous_tags"], ["b"])
+            summary = events[-1]
+            self.assertEqual(
+                (summary["qty_files"], summary["qty_written"], summary["qty_skipped"], summary["qty_ambiguous_tags"]),
+                (2, 1, 1, 1),
+            )
+            self.assertEqual(summary["in_bytes"], 24)
+
+            stream = io.StringIO()
+            main._create_files(
+                in_file_to_out_file_map, handlebars_tag_set, whitespace_config, reporter=main.QuietReporter(stream)
+            )
+            lines = stream.getvalue().splitlines()
+            self.assertEqual(len(lines), 1)
+            self.assertIn("wrote 0, unchanged 1, skipped 1, failed 0, ambiguous tags 1", lines[0])
+
+            stream = io.StringIO()
+            with unittest.mock.patch.object(main, "PROGRESS_BAR_INTERVAL", 0):
+                main._create_files(
+                    in_file_to_out_file_map,
+                    handlebars_tag_set,
+                    whitespace_config,
+                    reporter=main.ProgressBarReporter(stream),
+                )
+            # what a terminal shows of each line, the skipped file is not written over the progress bar
+            shown_lines = [line.split("\r")[-1] for line in stream.getvalue().split("\n")]
+            self.assertEqual(
+                shown_lines[:2],
+                [
+                    "Skipped writing file {} because it has ambiguous tags".format(os.path.join(in_dir, "b.handlebars")),
+                    "[{}] 2/2 files".format("#" * main.PROGRESS_BAR_WIDTH),
+                ],
+            )
+            self.assertTrue(shown_lines[2].startswith("Converted 2 files"))
+
+    def test_create_files_skips_invalid_templates(self):
+        handlebars_tag_set = main.HandlebarTagSet(if_tags={"a"})
+        whitespace_config = main.HandlebarsWhitespaceConfig()
+        with tempfile.TemporaryDirectory() as in_dir:
+            for name, in_txt in [("a", "{{#a}}x"), ("b", "{{b}}"), ("c", "{{/c}}")]:
+                with open(os.path.join(in_dir, name + ".mustache"), "w") as file:
+                    file.write(in_txt)
+            for jobs, io_threads, mmap_min_size in [(1, 0, None), (2, 0, None), (1, 2, None), (1, 0, 0)]:
+                with tempfile.TemporaryDirectory() as out_dir:
+                    in_file_to_out_file_map = main._get_in_file_to_out_file_map(in_dir, out_dir, recursive=True)
+                    stream = io.StringIO()
+                    failed_in_paths = []
+                    used_in_files, _ = main._create_files(
+                        in_file_to_out_file_map,
+                        handlebars_tag_set,
+                        whitespace_config,
+                        jobs=jobs,
+                        io_threads=io_threads,
+                        reporter=main.JsonLinesReporter(stream),
+                        mmap_min_size=mmap_min_size,
+                        failed_in_paths=failed_in_paths,
+                    )
+                    self.assertEqual(os.listdir(out_dir), ["b.handlebars"])
+                    self.assertEqual(used_in_files, [os.path.join(in_dir, "b.mustache")])
+                    self.assertEqual(failed_in_paths, [os.path.join(in_dir, name + ".mustache") for name in "ac"])
+                    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+                    failed_events = [event for event in events if event["event"] == "file_failed"]
+                    self.assertEqual([event["in_path"] for event in failed_events], failed_in_paths)
+                    self.assertIn("never closed", failed_events[0]["error"])
+                    self.assertEqual(events[-1]["qty_failed"], 2)
+
+    def test_create_files_profiler(self):
+        handlebars_tag_set = main.HandlebarTagSet(if_tags={"appName", "appDescription", "version"})
+        whitespace_config = main.HandlebarsWhitespaceConfig()
+        for jobs, io_threads in [(1, 0), (2, 0), (1, 2)]:
+            with tempfile.TemporaryDirectory() as out_dir:
+                profiler = main.Profiler()
+                in_file_to_out_file_pairs = profiler.measure_iterator(
+                    "discover", main._iter_in_file_to_out_file_pairs(self.in_dir, out_dir, recursive=True)
+                )
+                main._create_files(
+                    in_file_to_out_file_pairs,
+                    handlebars_tag_set,
+                    whitespace_config,
+                    jobs=jobs,
+                    io_threads=io_threads,
+                    reporter=main.QuietReporter(io.StringIO()),
+                    profiler=profiler,
+                )
+                profiler.stop()
+                profile = profiler.to_dict(top_n=2)
+                self.assertEqual(
+                    {phase: phase_time["count"] for phase, phase_time in profile["phases"].items()},
+                    # a discover measurement per template and one for the end of the walk
+                    {"discover": 4, "read": 3, "tokenize": 3, "parse": 3, "convert": 3, "write": 2},
+                )
+                self.assertEqual(len(profile["files"]), 3)
+                self.assertEqual(len(profile["slowest_files"]), 2)
+                slowest_seconds = [file_profile["seconds"] for file_profile in profile["slowest_files"]]
+                self.assertEqual(slowest_seconds, sorted(slowest_seconds, reverse=True))
+                api_profile = next(
+                    file_profile for file_profile in profile["files"] if file_profile["in_path"].endswith("api.mustache")
+                )
+                self.assertEqual(set(api_profile["phases"]), {"read", "tokenize", "parse", "convert", "write"})
+                self.assertEqual(api_profile["in_size"], os.path.getsize(os.path.join(self.in_dir, "api.mustache")))
+
+    def test_convert_dir_profiler(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            profiler = mustache_to_handlebars.Profiler()
+            ambiguous_tags = mustache_to_handlebars.convert_dir(
+                self.in_dir,
+                out_dir,
+                mustache_to_handlebars.HandlebarTagSet(if_tags={"appName", "appDescription", "version"}),
+                mustache_to_handlebars.HandlebarsWhitespaceConfig(),
+                reporter=main.QuietReporter(io.StringIO()),
+                profiler=profiler,
+            )
+            self.assertEqual(ambiguous_tags, {"infoEmail"})
+            self.assertTrue(os.path.isfile(os.path.join(out_dir, "api.handlebars")))
+            self.assertEqual(
+                {phase: phase_time.count for phase, phase_time in profiler.phase_times.items()},
+                {"discover": 4, "partials": 1, "read": 3, "tokenize": 3, "parse": 3, "convert": 3, "write": 2},
+            )
+
+    def test_build_tag_index_and_classify_tags(self):
+        with tempfile.TemporaryDirectory() as in_dir:
+            in_path_to_txt = {
+                os.path.join(in_dir, "a.mustache"): "{{#items}}\n{{.}}\n{{/items}}\n{{#isOn}}{{/isOn}}\n",
+                os.path.join(in_dir, "b.mustache"): (
+                    "{{#owner}}\n{{#pets}}{{#-first}}{{name}}{{/-first}}{{/pets}}\n{{/owner}}\n{{^flag}}{{/flag}}"
+                ),
+            }
+            for in_path, in_txt in in_path_to_txt.items():
+                with open(in_path, "w") as file:
+                    file.write(in_txt)
+            for jobs in [1, 2]:
+                tag_index = main._build_tag_index(sorted(in_path_to_txt), jobs=jobs)
+                self.assertEqual(set(tag_index), {"items", "isOn", "owner", "pets", "@first", "flag"})
+                b_path = os.path.join(in_dir, "b.mustache")
+                self.assertEqual(
+                    tag_index["pets"], [main.SectionUsage(b_path, 2, ("owner",), False, uses_iteration_tags=True)]
+                )
+                self.assertEqual(tag_index["@first"][0].context, ("owner", "pets"))
+                self.assertEqual(tag_index["flag"][0].line, 4)
+                self.assertTrue(tag_index["flag"][0].inverted)
+
+            tag_to_classification = main._classify_tags(tag_index, main.HandlebarTagSet(if_tags={"@first"}))
+            self.assertEqual(
+                {tag: tag_inference.handlebars_tag_type for tag, tag_inference in tag_to_classification.items()},
+                {
+                    "items": main.HandlebarsTagType.EACH,
+                    "isOn": main.HandlebarsTagType.IF,
+                    "owner": main.HandlebarsTagType.WITH,
+                    "pets": main.HandlebarsTagType.EACH,
+                    "@first": main.HandlebarsTagType.IF,
+                },
+            )
+            out_path = os.path.join(in_dir, "tags.json")
+            main._write_tag_classification(out_path, tag_index, tag_to_classification)
+            with open(out_path) as file:
+                classification = json.load(file)
+            self.assertEqual(classification["each_tags"], ["items", "pets"])
+            self.assertEqual(
+                (classification["tags"]["items"]["reason"], classification["tags"]["items"]["confidence"]),
+                ("its body uses {{.}}", 0.95),
+            )
+
+            # isOn is an if with 0.85 confidence, owner is used as a with and as an each
+            tag_index["owner"].append(main.SectionUsage(b_path, 5, (), False, uses_context_tag=True))
+            tag_to_classification = main._classify_tags(tag_index, main.HandlebarTagSet(if_tags={"@first"}))
+            main._write_tag_classification(out_path, tag_index, tag_to_classification, infer_threshold=0.9)
+            with open(out_path) as file:
+                classification = json.load(file)
+            self.assertEqual(
+                (classification["if_tags"], classification["each_tags"], classification["with_tags"]),
+                (["@first"], ["items", "pets"], []),
+            )
+            self.assertEqual(
+                classification["unresolved"],
+                {
+                    "isOn": {"candidates": ["if_tags"], "confidence": tag_to_classification["isOn"].confidence},
+                    "owner": {"candidates": ["each_tags", "with_tags"], "confidence": 0.0},
+                },
+            )
+            self.assertIsNone(classification["tags"]["owner"]["classification"])
+
+    def test_pattern_constants_are_kept(self):
+        self.assertEqual(re.findall(main.MUSTACHE_PARTIAL_PATTERN, "{{> a }}{{>b}}"), ["a", "b"])
+        self.assertEqual(main._scan_partial_names("{{> a }}{{>b}}{{> a}}"), ["a", "b"])
+        self.assertEqual(re.findall(main.MUSTACHE_IF_UNLESS_CLOSE_PATTERN, "{{#a}}{{b}}{{/a}}"), ["#a", "/a"])
+        self.assertEqual(re.findall(main.MUSTACHE_VARIABLE_TAG, "{{#a}}{{b}}{{/a}}"), ["b"])
+        self.assertEqual(main.HandlebarsTagType.CLOSE.value, ("", ""))
+
+    def test_partial_graph(self):
+        with tempfile.TemporaryDirectory() as in_dir:
+            os.mkdir(os.path.join(in_dir, "parts"))
+            name_to_txt = {
+                "page": "{{#items}}{{> parts/item}}{{/items}}{{> missing}}",
+                os.path.join("parts", "item"): "<li>{{> row }}</li>",
+                os.path.join("parts", "row"): "{{#-first}}first {{/-first}}{{name}}{{> parts/item}}",
+            }
+            for name, in_txt in name_to_txt.items():
+                with open(os.path.join(in_dir, name + ".mustache"), "w") as file:
+                    file.write(in_txt)
+            page, item, row = [os.path.join(in_dir, name + ".mustache") for name in name_to_txt]
+
+            partial_graph = main._build_partial_graph(in_dir, [page, item, row])
+            self.assertEqual(partial_graph.partials, {page: [item], item: [row], row: [item]})
+            self.assertEqual(partial_graph.unresolved, {page: ["missing"]})
+            order, cycles = partial_graph.topological_order()
+            self.assertEqual(order, [row, item, page])
+            self.assertEqual(cycles, [[item, row]])
+            self.assertEqual(set(partial_graph.iter_dependents([row])), {item, page})
+            self.assertEqual(set(partial_graph.iter_partials(page)), {item, row})
+
+            partial_usages = main._get_partial_usages(partial_graph)
+            self.assertEqual(set(partial_usages), {"parts/item", "row"})
+            self.assertTrue(partial_usages["parts/item"].uses_iteration_tags)
+            converter = main.Converter(
+                main.HandlebarTagSet(), main.HandlebarsWhitespaceConfig(), infer_threshold=0.8, partial_usages=partial_usages
+            )
+            self.assertEqual(
+                converter.convert("{{#items}}{{> parts/item}}{{/items}}"),
+                ("{{#each items}}{{> parts/item}}{{/each}}", self.empty_set),
+            )
+
+    def test_mustache_to_handlebars_partial_context_tags(self):
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            name_to_txt = {
+                "page": "{{#isOn}}{{> flag}}{{> shared}}{{/isOn}}{{> missing}}",
+                "list": "{{#names}}{{> name}}{{> shared}}{{/names}}",
+                "flag": "<b>{{.}}</b>",
+                "name": "<i>{{.}}</i>",
+                "shared": "{{.}}",
+            }
+            for name, in_txt in name_to_txt.items():
+                with open(os.path.join(in_dir, name + ".mustache"), "w") as file:
+                    file.write(in_txt)
+            argv = [
+                "mustache_to_handlebars",
+                in_dir,
+                "-out_dir",
+                out_dir,
+                "-handlebars_if_tags",
+                "isOn",
+                "-handlebars_each_tags",
+                "names",
+            ]
+            stdout = io.StringIO()
+            with unittest.mock.patch("sys.argv", argv), unittest.mock.patch("sys.stdout", stdout):
+                main.mustache_to_handlebars()
+            # the partial graph is reported without -infer_tags
+            self.assertIn(
+                "Partials ['missing'] of {} are not templates in in_dir".format(os.path.join(in_dir, "page.mustache")),
+                stdout.getvalue(),
+            )
+            self.assertIn("{{.}} is ambiguous in partials", stdout.getvalue())
+            name_to_out_txt = {}
+            for name in name_to_txt:
+                out_path = os.path.join(out_dir, name + ".handlebars")
+                if os.path.isfile(out_path):
+                    with open(out_path) as file:
+                        name_to_out_txt[name] = file.read()
+            # {{.}} in a partial included in an if section is the if tag, and shared is included in both
+            self.assertEqual(
+                name_to_out_txt,
+                {
+                    "page": "{{#if isOn}}{{> flag}}{{> shared}}{{/if}}{{> missing}}",
+                    "list": "{{#each names}}{{> name}}{{> shared}}{{/each}}",
+                    "flag": "<b>{{isOn}}</b>",
+                    "name": "<i>{{this}}</i>",
+                },
+            )
+
+    def test_watch(self):
+        def wait_for(condition):
+            deadline = time.monotonic() + 5
+            while not condition():
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+
+        def read(path):
+            try:
+                with open(path) as file:
+                    return file.read()
+            except FileNotFoundError:
+                return None
+
+        converter = main.Converter(main.HandlebarTagSet(), main.HandlebarsWhitespaceConfig(), infer_threshold=0.8)
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            page_path, item_path = os.path.join(in_dir, "page.mustache"), os.path.join(in_dir, "item.mustache")
+            for path, in_txt in [(page_path, "{{#items}}{{> item}}{{/items}}"), (item_path, "{{name}}")]:
+                with open(path, "w") as file:
+                    file.write(in_txt)
+            stop_event = threading.Event()
+            stream = io.StringIO()
+            reporter = main.QuietReporter(stream)
+            thread = threading.Thread(
+                target=main._watch,
+                args=(in_dir, out_dir, True, converter),
+                kwargs={"reporter": reporter, "stop_event": stop_event},
+            )
+            thread.start()
+            try:
+                page_out_path = os.path.join(out_dir, "page.handlebars")
+                wait_for(lambda: read(os.path.join(out_dir, "item.handlebars")) == "{{name}}")
+                # items can not be inferred until the partial uses -first
+                self.assertIsNone(read(page_out_path))
+
+                with open(item_path, "w") as file:
+                    file.write("{{#-first}}{{/-first}}{{name}}")
+                wait_for(lambda: read(page_out_path) == "{{#each items}}{{> item}}{{/each}}")
+
+                # a partial which can not be parsed is reported and the watch goes on
+                with open(item_path, "w") as file:
+                    file.write("{{#oops}}")
+                wait_for(lambda: "never closed" in stream.getvalue())
+                self.assertTrue(thread.is_alive())
+                with open(item_path, "w") as file:
+                    file.write("{{name}}!")
+                wait_for(lambda: read(os.path.join(out_dir, "item.handlebars")) == "{{name}}!")
+
+                # so is one which is not utf-8
+                with open(item_path, "wb") as file:
+                    file.write("{{name}} é".encode("latin-1"))
+                wait_for(lambda: "it is not utf-8 text" in stream.getvalue().lower())
+                self.assertTrue(thread.is_alive())
+                with open(item_path, "w") as file:
+                    file.write("{{name}}?")
+                wait_for(lambda: read(os.path.join(out_dir, "item.handlebars")) == "{{name}}?")
+
+                os.remove(item_path)
+                wait_for(lambda: read(os.path.join(out_dir, "item.handlebars")) is None)
+
+                # tags are inferred across every template like a full run, so sections of flag inferred as each
+                # and as if are ambiguous, the folder is moved in at once so the watch sees both templates together
+                with tempfile.TemporaryDirectory() as other_dir:
+                    flags_dir = os.path.join(other_dir, "flags")
+                    os.mkdir(flags_dir)
+                    name_to_txt = {"a": "{{#flag}}{{.}}{{/flag}}", "b": "{{#flag}}{{flag}}{{/flag}}", "c": "{{c}}"}
+                    for name, in_txt in name_to_txt.items():
+                        with open(os.path.join(flags_dir, name + ".mustache"), "w") as file:
+                            file.write(in_txt)
+                    os.rename(flags_dir, os.path.join(in_dir, "flags"))
+                wait_for(lambda: read(os.path.join(out_dir, "flags", "c.handlebars")) == "{{c}}")
+                self.assertIsNone(read(os.path.join(out_dir, "flags", "a.handlebars")))
+                self.assertIsNone(read(os.path.join(out_dir, "flags", "b.handlebars")))
+                # once they agree the unchanged template using flag is converted too
+                with open(os.path.join(in_dir, "flags", "a.mustache"), "w") as file:
+                    file.write("{{#flag}}{{flag}}!{{/flag}}")
+                wait_for(lambda: read(os.path.join(out_dir, "flags", "b.handlebars")) == "{{#if flag}}{{flag}}{{/if}}")
+                self.assertEqual(read(os.path.join(out_dir, "flags", "a.handlebars")), "{{#if flag}}{{flag}}!{{/if}}")
+            finally:
+                stop_event.set()
+                thread.join()
+
+    def test_create_files_incremental(self):
+        handlebars_tag_set = main.HandlebarTagSet(if_tags={"a"})
+        whitespace_config = main.HandlebarsWhitespaceConfig()
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            in_path_a = os.path.join(in_dir, "a.mustache")
+            in_path_b = os.path.join(in_dir, "b.mustache")
+            for in_path in [in_path_a, in_path_b]:
+                with open(in_path, "w") as file:
+                    file.write("{{#a}}x{{/a}}")
+
+            def create_files():
+                in_file_to_out_file_map = main._get_in_file_to_out_file_map(
+                    in_dir=in_dir, out_dir=out_dir, recursive=True
+                )
+                return main._create_files_incremental(
+                    in_dir, out_dir, in_file_to_out_file_map, handlebars_tag_set, whitespace_config
+                )
+
+            used_in_files, _ = create_files()
+            self.assertEqual(set(used_in_files), {in_path_a, in_path_b})
+            manifest_files = main._load_manifest(out_dir)
+            self.assertEqual(set(manifest_files), {"a.mustache", "b.mustache"})
+
+            with open(in_path_b, "w") as file:
+                file.write("{{#a}}y{{/a}}")
+            os.remove(in_path_a)
+            used_in_files, _ = create_files()
+            self.assertEqual(used_in_files, [in_path_b])
+            self.assertFalse(os.path.exists(os.path.join(out_dir, "a.handlebars")))
+            with open(os.path.join(out_dir, "b.handlebars")) as file:
+                self.assertEqual(file.read(), "{{#if a}}y{{/if}}")
+            self.assertEqual(set(main._load_manifest(out_dir)), {"b.mustache"})
+
+            # an unchanged input is not converted again unless the config changes
+            with unittest.mock.patch.object(main, "_convert_file") as convert_file:
+                create_files()
+                convert_file.assert_not_called()
+            handlebars_tag_set = main.HandlebarTagSet(each_tags={"a"})
+            create_files()
+            with open(os.path.join(out_dir, "b.handlebars")) as file:
+                self.assertEqual(file.read(), "{{#each a}}y{{/each}}")
+
+    def test_mustache_to_handlebars_manifest_reuses_analyses(self):
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir, \
+                tempfile.TemporaryDirectory() as cache_dir:
+            for name, in_txt in [("part", "{{#-first}}{{/-first}}"), ("a", "{{#items}}{{> part}}{{/items}}")]:
+                with open(os.path.join(in_dir, name + ".mustache"), "w") as file:
+                    file.write(in_txt)
+            argv = [
+                "mustache_to_handlebars", in_dir, "-out_dir", out_dir, "-manifest", "-parse_cache", cache_dir,
+                "-infer_tags", "-jobs", "1", "-report", "quiet",
+            ]
+
+            def run():
+                with unittest.mock.patch("sys.argv", argv), unittest.mock.patch("sys.stdout", io.StringIO()), \
+                        unittest.mock.patch.object(main, "_parse", wraps=main._parse) as parse, \
+                        unittest.mock.patch.object(main, "_load_template", wraps=main._load_template) as load_template:
+                    main.mustache_to_handlebars()
+                return parse.call_count + load_template.call_count
+
+            self.assertGreater(run(), 0)
+            self.assertEqual(set(main._load_manifest(out_dir, "analyses")), {"part.mustache", "a.mustache"})
+            # nothing changed, so no template is parsed or loaded from the parse cache to infer or convert it
+            self.assertEqual(run(), 0)
+            with open(os.path.join(out_dir, "a.handlebars")) as file:
+                self.assertEqual(file.read(), "{{#each items}}{{> part}}{{/each}}")
+            # tag, line, context, inverted and the uses fields of each section
+            self.assertEqual(
+                main._load_manifest(out_dir, "analyses")["a.mustache"]["section_usages"],
+                [["items", 1, [], False, False, True, False, False]],
+            )
+            # a changed partial is analyzed again along with the template including it
+            with open(os.path.join(in_dir, "part.mustache"), "w") as file:
+                file.write("{{name}}")
+            run()
+            self.assertEqual(
+                main._load_manifest(out_dir, "analyses")["a.mustache"]["section_usages"],
+                [["items", 1, [], False, False, False, False, True]],
+            )
+
     def test_convert_handlebars_to_mustache_if_unless_first_last(self):
         in_txt = "\n".join(
             [
@@ -346,6 +889,551 @@ class TestHelpers(unittest.TestCase):
         self.assertEqual(out_txt, expected_out_txt)
         self.assertEqual(ambiguous_tags, expected_ambiguous_tags)
 
+    def test_tokenize(self):
+        in_txt = "a {{b}}{{{c}}}{{#d}}{{^e}}{{/e}}{{/d}}{{> f }}{{! g }}{{=<% %>=}}<%h%>"
+        tokens = list(main._tokenize(in_txt))
+        self.assertEqual(
+            [(token.token_type, token.value) for token in tokens],
+            [
+                (main.MustacheTokenType.TEXT, "a "),
+                (main.MustacheTokenType.VARIABLE, "b"),
+                (main.MustacheTokenType.VARIABLE, "c"),
+                (main.MustacheTokenType.SECTION, "d"),
+                (main.MustacheTokenType.INVERTED, "e"),
+                (main.MustacheTokenType.CLOSE, "e"),
+                (main.MustacheTokenType.CLOSE, "d"),
+                (main.MustacheTokenType.PARTIAL, "f"),
+                (main.MustacheTokenType.COMMENT, "g"),
+                (main.MustacheTokenType.DELIMITER, "<% %>"),
+                (main.MustacheTokenType.VARIABLE, "h"),
+            ]
+        )
+        self.assertEqual("".join(token.raw for token in tokens), in_txt)
+
+    def test_tokenize_standalone_tags(self):
+        in_txt = "\n".join(
+            [
+                "  {{#a}}  ",
+                "{{#b}}{{/b}}",
+                "x {{c}}",
+                "\t{{/a}}\r",
+                "{{! d }}",
+            ]
+        )
+        tokens = [token for token in main._tokenize(in_txt) if token.token_type is not main.MustacheTokenType.TEXT]
+        self.assertEqual(
+            [(token.value, token.standalone) for token in tokens],
+            [("a", True), ("b", False), ("b", False), ("c", False), ("a", True), ("d", True)],
+        )
+
+    def test_parse_and_visit(self):
+        in_txt = "a {{b}}\n{{#c}}{{^d}}{{> e}}{{/d}}{{/c}}{{! f }}"
+        template = main._parse(main._tokenize(in_txt))
+        self.assertEqual(
+            [type(node) for node in template.children], [main.Text, main.Variable, main.Text, main.Section, main.Comment]
+        )
+        section = template.children[3]
+        self.assertEqual(in_txt[section.start:section.end], "{{#c}}{{^d}}{{> e}}{{/d}}{{/c}}")
+        self.assertEqual((section.raw, section.close_raw), ("{{#c}}", "{{/c}}"))
+        inverted = section.children[0]
+        self.assertIsInstance(inverted, main.Inverted)
+        self.assertEqual(in_txt[inverted.children[0].start:inverted.children[0].end], "{{> e}}")
+        self.assertFalse(hasattr(inverted, "__dict__"))
+
+        class TagCollector(main.NodeVisitor):
+            def __init__(self):
+                self.tags = []
+
+            def visit_Variable(self, node):
+                self.tags.append(node.value)
+
+            def visit_Section(self, node):
+                self.tags.append(node.value)
+                self.generic_visit(node)
+
+            visit_Partial = visit_Variable
+
+        tag_collector = TagCollector()
+        tag_collector.visit(template)
+        # inverted sections have no visit method so their children are still visited
+        self.assertEqual(tag_collector.tags, ["b", "c", "e"])
+
+    def test_parse_cache(self):
+        in_txt = "a {{b.0}}\n{{#c}}\n{{^d}}{{> e}}{{/d}}{{.}}\n{{/c}}{{! f }}{{=<% %>=}}<%g%>"
+        template = main._parse(main._tokenize(in_txt))
+        self.assertEqual(main._dump_template(main._load_template(main._dump_template(template))), main._dump_template(template))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            parse_cache = main.ParseCache(cache_dir)
+            handlebars_tag_set = main.HandlebarTagSet(each_tags={"c"})
+            whitespace_config = main.HandlebarsWhitespaceConfig(remove_whitespace_before_open=True)
+            converter = main.Converter(handlebars_tag_set, whitespace_config, parse_cache=parse_cache)
+            expected = main.Converter(handlebars_tag_set, whitespace_config).convert(in_txt)
+            self.assertEqual(converter.convert(in_txt), expected)
+            self.assertEqual(converter.convert(in_txt), expected)
+            self.assertEqual((parse_cache.hits, parse_cache.misses), (1, 1))
+            # a new config reuses the parsed template
+            converter = main.Converter(main.HandlebarTagSet(with_tags={"c"}), whitespace_config, parse_cache=parse_cache)
+            self.assertEqual(converter.convert(in_txt)[0], expected[0].replace("each", "with"))
+            self.assertEqual((parse_cache.hits, parse_cache.misses), (2, 1))
+            # damaged entries are parsed again
+            [entry_name] = os.listdir(parse_cache.entry_dir)
+            with open(os.path.join(parse_cache.entry_dir, entry_name), "wb") as file:
+                file.write(b"damaged")
+            self.assertEqual(converter.convert(in_txt)[0], expected[0].replace("each", "with"))
+            self.assertEqual((parse_cache.hits, parse_cache.misses), (2, 2))
+
+    def test_convert_stream_matches_convert(self):
+        handlebars_tag_set = main.HandlebarTagSet(
+            if_tags={main.HANDLEBARS_FIRST, main.HANDLEBARS_LAST, 'appName', 'appDescription', 'version'},
+        )
+        whitespace_config = main.HandlebarsWhitespaceConfig(
+            remove_whitespace_before_open=True,
+            remove_whitespace_after_close=True,
+        )
+        in_txts = [
+            "{{#version}}{{a\n.0}}\n  {{/version}}\n{{=<% %>=}}\n<%#appName%>{{x}}<%/appName%>\n",
+            # windows of a line without newlines are split between tags
+            "  {{#version}} {{a.0}} {{{b}}} x{{/version}} {{{{c}} }}} {{=<% %>=}}<%#appName%>{{x}} <%={{ }}=%>{{/appName}}  ",
+        ]
+        for path in main._get_in_file_to_out_file_map(self.in_dir, self.in_dir, recursive=True):
+            with open(path) as file:
+                in_txts.append(file.read())
+        for in_txt in in_txts:
+            expected = main._convert_handlebars_to_mustache(in_txt, handlebars_tag_set, whitespace_config)
+            # text may be split into more tokens at window boundaries
+            stream_tokens = list(main._tokenize_stream(io.StringIO(in_txt), chunk_size=3))
+            self.assertEqual("".join(token.raw for token in stream_tokens), in_txt)
+            self.assertEqual(
+                [
+                    (token.start, token.value, token.standalone)
+                    for token in stream_tokens if token.token_type is not main.MustacheTokenType.TEXT
+                ],
+                [
+                    (token.start, token.value, token.standalone)
+                    for token in main._tokenize(in_txt) if token.token_type is not main.MustacheTokenType.TEXT
+                ],
+            )
+            writer = io.StringIO()
+            with unittest.mock.patch.object(main, "STREAM_CHUNK_SIZE", 5):
+                ambiguous_tags = main.convert_stream(
+                    io.StringIO(in_txt), writer, handlebars_tag_set, whitespace_config
+                )
+            self.assertEqual((writer.getvalue(), ambiguous_tags), expected)
+
+    def test_convert_stream_writes_sections_as_they_are_read(self):
+        handlebars_tag_set = main.HandlebarTagSet(if_tags={"w"}, each_tags={"items"})
+        # on many lines and on one line
+        for body in [
+            "{{#items}}\n  <li>{{name}}</li>\n{{/items}}\n" * 10000,
+            "{{#items}}<li>{{name}}</li>{{/items}} " * 10000,
+        ]:
+            out_fragments = []
+            out_size = 0
+
+            def write(out_fragment):
+                nonlocal out_size
+                # keeps only the first and last fragments
+                del out_fragments[1:]
+                out_fragments.append(out_fragment)
+                out_size += len(out_fragment)
+
+            reader = io.StringIO("{{#w}}\n" + body + "{{/w}}\n")
+            writer = unittest.mock.Mock(write=write)
+            tracemalloc.start()
+            try:
+                with unittest.mock.patch.object(main, "STREAM_CHUNK_SIZE", 4096):
+                    ambiguous_tags = main.convert_stream(
+                        reader, writer, handlebars_tag_set, main.HandlebarsWhitespaceConfig()
+                    )
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertEqual((ambiguous_tags, out_fragments[0], out_fragments[-1]), (set(), "{{#if w}}", "\n"))
+            self.assertGreater(out_size, len(body))
+            self.assertLess(peak, len(body) // 4)
+
+    def test_convert_mapped_matches_convert(self):
+        handlebars_tag_set = main.HandlebarTagSet(if_tags={"appName", "version"}, each_tags={"items"})
+        whitespace_config = main.HandlebarsWhitespaceConfig(remove_whitespace_before_open=True)
+        converter = main.Converter(handlebars_tag_set, whitespace_config)
+        in_txts = [
+            "",
+            "é {{#version}}{{a.0}}\n  {{/version}}\n{{#items}}\n{{.}}\n{{/items}}",
+            "{{=<% %>=}}\n<%#appName%>{{x}} é<%/appName%>\n<%={{ }}=%>{{y}}",
+            "{{#ambiguous}}{{/ambiguous}}",
+        ]
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            for i, in_txt in enumerate(in_txts):
+                with open(os.path.join(in_dir, "{}.mustache".format(i)), "w", encoding="utf-8") as file:
+                    file.write(in_txt)
+                expected_txt, expected_ambiguous_tags = converter.convert(in_txt)
+                chunks = []
+                ambiguous_tags, _ = converter.convert_mapped(in_txt.encode("utf-8"), chunks.append, "utf-8")
+                if expected_ambiguous_tags:
+                    expected_txt = ""
+                self.assertEqual((b"".join(chunks).decode("utf-8"), ambiguous_tags), (expected_txt, expected_ambiguous_tags))
+            in_path_to_out_path = main._get_in_file_to_out_file_map(in_dir, out_dir, recursive=True)
+            with unittest.mock.patch.object(main.locale, "getpreferredencoding", return_value="UTF-8"):
+                for _ in range(2):
+                    main._create_files(
+                        in_path_to_out_path, handlebars_tag_set, whitespace_config, mmap_min_size=0, converter=converter
+                    )
+            self.assertEqual(sorted(os.listdir(out_dir)), ["0.handlebars", "1.handlebars", "2.handlebars"])
+            for i, in_txt in enumerate(in_txts[:3]):
+                with open(os.path.join(out_dir, "{}.handlebars".format(i)), encoding="utf-8") as file:
+                    self.assertEqual(file.read(), converter.convert(in_txt)[0])
+
+        # line endings are translated like those of a template that is read
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            in_path = os.path.join(in_dir, "crlf.mustache")
+            with open(in_path, "wb") as file:
+                file.write(b"a\r\n  {{#version}}\r\n{{! x\r\ny }}{{a\r\n.0}}\r{{/version}}  \r\n\rb\r")
+            in_path_to_out_path = {in_path: os.path.join(out_dir, "crlf.handlebars")}
+            with unittest.mock.patch.object(main.locale, "getpreferredencoding", return_value="UTF-8"):
+                main._create_files(in_path_to_out_path, handlebars_tag_set, whitespace_config, converter=converter)
+                with open(in_path_to_out_path[in_path], "rb") as file:
+                    out_bytes = file.read()
+                for mmap_min_size in [None, 0]:
+                    out_path_to_check = main._check_files(
+                        in_dir, out_dir, True, in_path_to_out_path, converter, jobs=1, mmap_min_size=mmap_min_size
+                    )
+                    self.assertEqual(list(out_path_to_check.values()), [main.FileCheck(main.CheckStatus.UNCHANGED)])
+                main._create_files(
+                    in_path_to_out_path, handlebars_tag_set, whitespace_config, mmap_min_size=0, converter=converter
+                )
+                with open(in_path_to_out_path[in_path], "rb") as file:
+                    self.assertEqual(file.read(), out_bytes)
+            self.assertNotIn(b"\r", out_bytes)
+
+    def test_mustache_to_handlebars_stdin(self):
+        stdout = io.StringIO()
+        with unittest.mock.patch("sys.argv", ["mustache_to_handlebars", "-", "-handlebars_if_tags", "a"]), \
+                unittest.mock.patch("sys.stdin", io.StringIO("{{#a}}\n{{b.1}}\n{{/a}}\n")), \
+                unittest.mock.patch("sys.stdout", stdout):
+            main.mustache_to_handlebars()
+        self.assertEqual(stdout.getvalue(), "{{#if a}}\n{{b.[1]}}\n{{/if}}\n")
+
+        stderr = io.StringIO()
+        with unittest.mock.patch("sys.argv", ["mustache_to_handlebars", "-", "-handlebars_if_tags", "a"]), \
+                unittest.mock.patch("sys.stdin", io.StringIO("{{#a}}\n{{b}}\n")), \
+                unittest.mock.patch("sys.stdout", io.StringIO()), unittest.mock.patch("sys.stderr", stderr):
+            with self.assertRaises(SystemExit) as context:
+                main.mustache_to_handlebars()
+        self.assertEqual(context.exception.code, 1)
+        self.assertEqual(stderr.getvalue(), "Could not convert -: Open tags ['a'] are never closed\n")
+
+        for option in ["-infer_tags", "-check"]:
+            stderr = io.StringIO()
+            with unittest.mock.patch("sys.argv", ["mustache_to_handlebars", "-", option]), \
+                    unittest.mock.patch("sys.stderr", stderr):
+                with self.assertRaises(SystemExit):
+                    main.mustache_to_handlebars()
+            self.assertIn("{} can not be used when in_dir is -".format(option), stderr.getvalue())
+
+    def test_mustache_to_handlebars_check(self):
+        with tempfile.TemporaryDirectory() as in_dir, tempfile.TemporaryDirectory() as out_dir:
+            for name, in_txt in [("a", "{{#a}}{{b}}{{/a}}"), ("b", "{{c}}"), ("c", "{{d}}"), ("d", "{{#e}}{{/e}}")]:
+                with open(os.path.join(in_dir, name + ".mustache"), "w") as file:
+                    file.write(in_txt)
+            argv = ["mustache_to_handlebars", in_dir, "-out_dir", out_dir, "-handlebars_if_tags", "a", "-report", "quiet"]
+            with unittest.mock.patch("sys.argv", argv), unittest.mock.patch("sys.stdout", io.StringIO()):
+                main.mustache_to_handlebars()
+            stdout = io.StringIO()
+            with unittest.mock.patch("sys.argv", [*argv, "-check", "-jobs", "1"]), \
+                    unittest.mock.patch("sys.stdout", stdout):
+                with self.assertRaises(SystemExit) as context:
+                    main.mustache_to_handlebars()
+            self.assertEqual(context.exception.code, 1)
+            self.assertEqual(stdout.getvalue().splitlines()[:-1], ["ambiguous d.handlebars ambiguous_tags=e"])
+
+            with open(os.path.join(out_dir, "b.handlebars"), "w") as file:
+                file.write("edited")
+            os.remove(os.path.join(out_dir, "c.handlebars"))
+            with open(os.path.join(out_dir, "e.handlebars"), "w") as file:
+                file.write("")
+            out_dir_names = sorted(os.listdir(out_dir))
+            out_path_to_check = main._check_files(
+                in_dir,
+                out_dir,
+                True,
+                main._get_in_file_to_out_file_map(in_dir, out_dir, recursive=True),
+                main.Converter(main.HandlebarTagSet(if_tags={"a", "e"}), main.HandlebarsWhitespaceConfig()),
+                jobs=2,
+            )
+            self.assertEqual(
+                {os.path.basename(out_path): file_check for out_path, file_check in out_path_to_check.items()},
+                {
+                    "a.handlebars": main.FileCheck(main.CheckStatus.UNCHANGED),
+                    "b.handlebars": main.FileCheck(main.CheckStatus.CHANGED),
+                    "c.handlebars": main.FileCheck(main.CheckStatus.MISSING),
+                    "d.handlebars": main.FileCheck(main.CheckStatus.MISSING),
+                    "e.handlebars": main.FileCheck(main.CheckStatus.STALE),
+                },
+            )
+            with open(os.path.join(in_dir, "a.mustache"), "w") as file:
+                file.write("{{#a}}")
+            [file_check, _] = main._check_file(
+                os.path.join(in_dir, "a.mustache"),
+                os.path.join(out_dir, "a.handlebars"),
+                main.Converter(main.HandlebarTagSet(if_tags={"a"}), main.HandlebarsWhitespaceConfig()),
+            )
+            self.assertEqual(file_check.check_status, main.CheckStatus.INVALID)
+            self.assertIn("never closed", file_check.error)
+            # nothing is written
+            self.assertEqual(sorted(os.listdir(out_dir)), out_dir_names)
+
+        # handlebars files which are not written from templates, like ignored vendored ones, are not stale
+        with tempfile.TemporaryDirectory() as in_dir:
+            for rel_path in ["a.mustache", "old.handlebars", "node_modules/pkg/vendor.handlebars"]:
+                os.makedirs(os.path.dirname(os.path.join(in_dir, rel_path)), exist_ok=True)
+                with open(os.path.join(in_dir, rel_path), "w") as file:
+                    file.write("{{a}}")
+            with open(os.path.join(in_dir, ".m2hignore"), "w") as file:
+                file.write("node_modules\n")
+            converter = main.Converter(main.HandlebarTagSet(), main.HandlebarsWhitespaceConfig())
+            out_path_to_check = main._check_files(
+                in_dir, in_dir, True, main._get_in_file_to_out_file_map(in_dir, in_dir, recursive=True), converter
+            )
+            self.assertEqual(
+                {os.path.relpath(path, in_dir): check.check_status for path, check in out_path_to_check.items()},
+                {"a.handlebars": main.CheckStatus.MISSING, "old.handlebars": main.CheckStatus.STALE},
+            )
+            # with a manifest only the out files it lists are stale
+            main._create_files_incremental(
+                in_dir,
+                in_dir,
+                main._get_in_file_to_out_file_map(in_dir, in_dir, recursive=True),
+                main.HandlebarTagSet(),
+                main.HandlebarsWhitespaceConfig(),
+            )
+            os.remove(os.path.join(in_dir, "a.mustache"))
+            out_path_to_check = main._check_files(in_dir, in_dir, True, {}, converter)
+            self.assertEqual(
+                {os.path.relpath(path, in_dir): check.check_status for path, check in out_path_to_check.items()},
+                {"a.handlebars": main.CheckStatus.STALE},
+            )
+
+    def test_converter_tag_cache(self):
+        converter = main.Converter(
+            main.HandlebarTagSet(if_tags={"a.[0]"}),
+            main.HandlebarsWhitespaceConfig(),
+            tag_cache_size=2,
+        )
+        out_txt, _ = converter.convert("{{#a.0}}{{b.1}}{{b.1}}{{c.2}}{{/a.0}}")
+        self.assertEqual(out_txt, "{{#if a.[0]}}{{b.[1]}}{{b.[1]}}{{c.[2]}}{{/if}}")
+        cache_info = converter.tag_cache_info()
+        self.assertEqual((cache_info.hits, cache_info.misses, cache_info.currsize), (1, 3, 2))
+        self.assertEqual(main.MUSTACHE_TO_HANDLEBARS_TAG, {"-first": main.HANDLEBARS_FIRST, "-last": main.HANDLEBARS_LAST})
+        self.assertEqual(main.Converter(converter.handlebars_tag_set, converter.whitespace_config).tag_cache_info().currsize, 0)
+
+    def test_converter_convert_many(self):
+        converter = mustache_to_handlebars.Converter(
+            mustache_to_handlebars.HandlebarTagSet(if_tags={"a"}, each_tags={"a", "b"}, with_tags={"b", "c"}),
+            mustache_to_handlebars.HandlebarsWhitespaceConfig(remove_whitespace_after_close=True),
+        )
+        self.assertEqual(
+            list(converter.convert_many(["{{#a}}\n{{/a}}\n", "{{#b}}{{/b}}{{#c}}{{/c}}", "{{#d}}{{/d}}"])),
+            [
+                ("{{#if a}}\n{{/if~}}\n", self.empty_set),
+                ("{{#each b}}{{/each}}{{#with c}}{{/with}}", self.empty_set),
+                ("{{#ifOrEachOrWith d}}{{/ifOrEachOrWith}}", {"d"}),
+            ]
+        )
+
+    def test_converter_infers_section_types(self):
+        converter = mustache_to_handlebars.Converter(
+            mustache_to_handlebars.HandlebarTagSet(with_tags={"owner"}),
+            mustache_to_handlebars.HandlebarsWhitespaceConfig(remove_whitespace_before_open=True),
+            infer_threshold=0.8,
+        )
+        in_txt = (
+            "{{#person}}\n"
+            "{{#items}}\n{{.}}\n{{/items}}\n"
+            "{{#pets}}{{#-first}}{{name}}{{/-first}}{{/pets}}\n"
+            "{{#owner}}{{name}}{{/owner}}\n"
+            "{{/person}}\n"
+            "{{#title}}{{title}}{{/title}}{{#isOn}}on{{/isOn}}\n"
+        )
+        out_txt, ambiguous_tags, tag_inferences = converter.convert_with_inferences(in_txt)
+        self.assertEqual(
+            out_txt,
+            "{{~#ifOrEachOrWith person}}\n"
+            "{{~#each items}}\n{{this}}\n{{/each}}\n"
+            "{{#each pets}}{{#ifOrEachOrWith @first}}{{name}}{{/ifOrEachOrWith}}{{/each}}\n"
+            "{{#with owner}}{{name}}{{/with}}\n"
+            "{{/ifOrEachOrWith}}\n"
+            "{{#if title}}{{title}}{{/if}}{{#if isOn}}on{{/if}}\n"
+        )
+        self.assertEqual(ambiguous_tags, {"person", "@first"})
+        self.assertEqual(
+            {tag: (tag_inference.handlebars_tag_type, tag_inference.confidence) for tag, tag_inference in tag_inferences.items()},
+            {
+                "person": (main.HandlebarsTagType.WITH, 0.5),
+                "items": (main.HandlebarsTagType.EACH, 0.95),
+                "pets": (main.HandlebarsTagType.EACH, 0.95),
+                "@first": (main.HandlebarsTagType.WITH, 0.5),
+                "title": (main.HandlebarsTagType.IF, 0.9),
+                "isOn": (main.HandlebarsTagType.IF, 0.85),
+            },
+        )
+        writer = io.StringIO()
+        self.assertEqual(converter.convert_stream(io.StringIO(in_txt), writer), ambiguous_tags)
+        self.assertEqual(writer.getvalue(), out_txt)
+        # inference is off by default
+        _, ambiguous_tags = mustache_to_handlebars.Converter(
+            converter.handlebars_tag_set, converter.whitespace_config
+        ).convert(in_txt)
+        self.assertEqual(ambiguous_tags, {"person", "items", "pets", "@first", "title", "isOn"})
+
+        # sections of a tag inferred as different types are all ambiguous, within and across templates
+        in_txt = "{{#x}}{{.}}{{/x}} {{#x}}{{x}}{{/x}}"
+        out_txt, ambiguous_tags, tag_inferences = converter.convert_with_inferences(in_txt)
+        self.assertEqual(out_txt, "{{#ifOrEachOrWith x}}{{.}}{{/ifOrEachOrWith}} {{#ifOrEachOrWith x}}{{x}}{{/ifOrEachOrWith}}")
+        self.assertEqual((ambiguous_tags, tag_inferences["x"].confidence), ({"x"}, 0.0))
+        with tempfile.TemporaryDirectory() as in_dir:
+            in_paths = [os.path.join(in_dir, "a.mustache"), os.path.join(in_dir, "b.mustache")]
+            for in_path, in_txt in zip(in_paths, ["{{#x}}{{.}}{{/x}}", "{{#x}}{{x}}{{/x}}"]):
+                with open(in_path, "w") as file:
+                    file.write(in_txt)
+            known_tag_inferences = main._infer_tag_types(in_paths, converter.handlebars_tag_set)
+            self.assertEqual(known_tag_inferences["x"].confidence, 0.0)
+            converter = mustache_to_handlebars.Converter(
+                converter.handlebars_tag_set,
+                converter.whitespace_config,
+                infer_threshold=0.8,
+                known_tag_inferences=known_tag_inferences,
+            )
+            for in_path in in_paths:
+                self.assertEqual(main._convert_file(in_path, converter)[1], {"x"})
+            # sections whose tag a tag set override configures are not inferred from
+            tag_set_overrides = [(["a.mustache"], main.HandlebarTagSet(each_tags={"x"}))]
+            known_tag_inferences = main._infer_tag_types(
+                in_paths, converter.handlebars_tag_set, tag_set_overrides=tag_set_overrides, in_dir=in_dir
+            )
+            self.assertEqual(
+                (known_tag_inferences["x"].handlebars_tag_type, known_tag_inferences["x"].confidence),
+                (main.HandlebarsTagType.IF, 0.9),
+            )
+            tag_set_overrides.append((["b.mustache"], main.HandlebarTagSet(if_tags={"x"})))
+            self.assertEqual(
+                main._infer_tag_types(
+                    in_paths, converter.handlebars_tag_set, tag_set_overrides=tag_set_overrides, in_dir=in_dir
+                ),
+                {},
+            )
+
+    def test_load_config_and_tag_set_overrides(self):
+        with tempfile.TemporaryDirectory() as in_dir:
+            config_path = os.path.join(in_dir, "config.json")
+            with open(config_path, "w") as file:
+                json.dump(
+                    {
+                        "if_tags": ["a"],
+                        "each_tags": ["b"],
+                        "overrides": [
+                            {"paths": ["api/*"], "with_tags": ["a", "c"]},
+                            {"paths": ["*_model.mustache"], "if_tags": ["c"]},
+                        ],
+                        "options": {"remove_whitespace_before_open": True},
+                        "tags": {},
+                    },
+                    file,
+                )
+            config = main._load_config(config_path)
+            self.assertEqual(config.handlebars_tag_set, main.HandlebarTagSet(if_tags={"a"}, each_tags={"b"}))
+            self.assertEqual(config.options, {"remove_whitespace_before_open": True})
+
+            converter = main.Converter(
+                config.handlebars_tag_set,
+                main.HandlebarsWhitespaceConfig(),
+                tag_set_overrides=config.tag_set_overrides,
+                in_dir=in_dir,
+            )
+            in_txt = "{{#a}}{{/a}}{{#b}}{{/b}}{{#c}}{{/c}}"
+            self.assertEqual(
+                converter.convert(in_txt, os.path.join(in_dir, "x.mustache")),
+                ("{{#if a}}{{/if}}{{#each b}}{{/each}}{{#ifOrEachOrWith c}}{{/ifOrEachOrWith}}", {"c"}),
+            )
+            self.assertEqual(
+                converter.convert(in_txt, os.path.join(in_dir, "api", "x.mustache")),
+                ("{{#with a}}{{/with}}{{#each b}}{{/each}}{{#with c}}{{/with}}", self.empty_set),
+            )
+            # later overrides win
+            self.assertEqual(
+                converter.convert(in_txt, os.path.join(in_dir, "api", "x_model.mustache"))[0],
+                "{{#with a}}{{/with}}{{#each b}}{{/each}}{{#if c}}{{/if}}",
+            )
+
+            with open(config_path, "w") as file:
+                json.dump({"if_tags": "a"}, file)
+            with self.assertRaises(ValueError):
+                main._load_config(config_path)
+
+    def test_mustache_to_handlebars_config_options(self):
+        with tempfile.TemporaryDirectory() as in_dir:
+            config_path = os.path.join(in_dir, "config.json")
+            argv = ["mustache_to_handlebars", in_dir, "-config", config_path]
+            get_args = getattr(main, "__get_args")
+            with open(config_path, "w") as file:
+                json.dump({"options": {"exclude": ["vendor"], "jobs": "2", "report": "quiet"}}, file)
+            with unittest.mock.patch("sys.argv", argv):
+                args = get_args()
+            self.assertEqual((args.exclude, args.jobs, args.report), (["vendor"], 2, "quiet"))
+            for options, message in [
+                ({"exclude": "model_templates"}, "invalid option exclude in config file"),
+                ({"report": "bogus"}, "invalid option report in config file"),
+                ({"jobs": "many"}, "invalid option jobs in config file"),
+                ({"manifest": "yes"}, "invalid option manifest in config file"),
+            ]:
+                with open(config_path, "w") as file:
+                    json.dump({"options": options}, file)
+                stderr = io.StringIO()
+                with unittest.mock.patch("sys.argv", argv), unittest.mock.patch("sys.stderr", stderr):
+                    with self.assertRaises(SystemExit):
+                        get_args()
+                self.assertIn(message, stderr.getvalue())
+
+    def test_convert_handlebars_to_mustache_context_tag(self):
+        converter = main.Converter(
+            main.HandlebarTagSet(if_tags={"a.[0]", main.HANDLEBARS_FIRST}, each_tags={"items"}, with_tags={"owner"}),
+            main.HandlebarsWhitespaceConfig(),
+        )
+        out_txt, ambiguous_tags = converter.convert(
+            "{{.}}{{#items}}{{.}}{{#-first}}{{{.}}}{{/-first}}{{#a.0}}{{&.}}{{^b}}{{.}}{{/b}}{{/a.0}}{{/items}}"
+            "{{#owner}}{{.}}{{/owner}}{{#c}}{{.}}{{/c}}"
+        )
+        self.assertEqual(
+            out_txt,
+            "{{this}}{{#each items}}{{this}}{{#if @first}}{{{this}}}{{/if}}"
+            "{{#if a.[0]}}{{&a.[0]}}{{#unless b}}{{a.[0]}}{{/unless}}{{/if}}{{/each}}"
+            "{{#with owner}}{{this}}{{/with}}{{#ifOrEachOrWith c}}{{.}}{{/ifOrEachOrWith}}",
+        )
+        self.assertEqual(ambiguous_tags, {"c"})
+
+    def test_convert_handlebars_to_mustache_set_delimiter(self):
+        in_txt = "{{=<% %>=}}<%#a%>{{literal}} <%{b.0}%><%/a%>"
+        handlebars_tag_set = main.HandlebarTagSet(
+            if_tags={main.HANDLEBARS_FIRST, main.HANDLEBARS_LAST, "a"},
+            each_tags=self.empty_set,
+            with_tags=self.empty_set,
+        )
+        out_txt, ambiguous_tags = main._convert_handlebars_to_mustache(
+            in_txt,
+            handlebars_tag_set,
+            main.HandlebarsWhitespaceConfig(),
+        )
+        self.assertEqual(out_txt, "{{#if a}}\\{{literal}} {{{b.[0]}}}{{/if}}")
+        self.assertEqual(ambiguous_tags, self.empty_set)
+
+    def test_convert_handlebars_to_mustache_unbalanced_tags(self):
+        handlebars_tag_set = main.HandlebarTagSet(if_tags={"a", "b"})
+        whitespace_config = main.HandlebarsWhitespaceConfig()
+        for in_txt in ["{{/a}}", "{{#a}}{{/b}}", "{{#a}}", "{{a"]:
+            with self.assertRaises(ValueError):
+                main._convert_handlebars_to_mustache(
+                    in_txt, handlebars_tag_set, whitespace_config
+                )
+
 
 if __name__ == "__main__":
     unittest.main()